@@ -1,3 +1,7 @@
+"""
+Типы характеристик товаров и стратегии их сравнения
+"""
+
 from __future__ import annotations
 
 from typing import List, Optional, Union, Type
@@ -5,6 +9,9 @@ from typing import List, Optional, Union, Type
 from django.db import models
 from django.forms import IntegerField
 
+TRUE_VALUES = ('1', 'true', 'yes', 'да', '+')
+FALSE_VALUES = ('', '0', 'false', 'no', 'нет', '-')
+
 
 class CharacteristicType(models.IntegerChoices):
     """
@@ -39,8 +46,45 @@ class CharacteristicType(models.IntegerChoices):
             return bool
         return str
 
+    @staticmethod
+    def clean_value(value_type: CharacteristicType, value: object) -> str:
+        """
+        Проверка и приведение значения характеристики к виду для хранения.
+        Логические значения хранятся как '1' и '', потому что get_value
+        приводит строку через bool()
+
+        :param value_type: тип характеристики
+        :param value: значение из формы или файла
+        :return: значение для ProductCharacteristic.value
+        :raises ValueError: значение не соответствует типу
+        """
+        text = '' if value is None else str(value).strip()
+        if value_type == CharacteristicType.bool:
+            if text.lower() in TRUE_VALUES:
+                return '1'
+            if text.lower() in FALSE_VALUES:
+                return ''
+            raise ValueError(f'Ожидается логическое значение, получено "{text}"')
+        if not text:
+            raise ValueError('Пустое значение')
+        if value_type == CharacteristicType.int:
+            try:
+                return str(int(text))
+            except ValueError as error:
+                raise ValueError(f'Ожидается целое число, получено "{text}"') from error
+        if value_type == CharacteristicType.float:
+            try:
+                return str(float(text.replace(',', '.')))
+            except ValueError as error:
+                raise ValueError(f'Ожидается число, получено "{text}"') from error
+        return text
+
     @staticmethod
     def get_name_by_value(value: int | IntegerField) -> str:
+        """
+        :param value: значение типа
+        :return: название типа
+        """
         for choice in CharacteristicType.choices:
             if choice[0] == value:
                 return choice[1]
@@ -77,6 +121,10 @@ class ComparatorStrategy(models.IntegerChoices):
 
     @staticmethod
     def get_name_by_value(value: int | IntegerField) -> str:
+        """
+        :param value: значение стратегии сравнения
+        :return: название стратегии сравнения
+        """
         for choice in ComparatorStrategy.choices:
             if choice[0] == value:
                 return choice[1]
@@ -94,6 +142,9 @@ class Characteristic:
         self.value = value
 
     def get_value(self) -> object:
+        """
+        :return: значение, приведённое к типу характеристики
+        """
         characteristic_type = CharacteristicType.get_type_by_name(self.type)
         return characteristic_type(self.value)
 
@@ -154,6 +205,11 @@ class ComparatorResult:
     def clean(better: Optional[Characteristic],
               worse: Optional[Characteristic],
               equal: Optional[List[Characteristic]]) -> None:
+        """
+        Проверка результата сравнения: заполнены либо лучший и худший, либо два равных
+
+        :raises AttributeError: результат заполнен неверно
+        """
         cmp_filled: bool = better is not None and worse is not None
         equal_filled: bool = equal is not None
         if cmp_filled and equal_filled:
@@ -177,10 +233,16 @@ class Comparator:
         return self.__class__.__name__
 
     def internal_compare(self) -> int:
+        """
+        :return: больше 0 - первый лучше, меньше 0 - второй лучше, 0 - равны
+        """
         print(type(self))
         raise NotImplementedError('Не реализована функция сравнения в компараторе')
 
     def compare(self) -> ComparatorResult:
+        """
+        :return: результат сравнения двух характеристик
+        """
         cmp = self.internal_compare()
         if cmp > 0:
             return ComparatorResult(better=self.first, worse=self.second, equal=None, cmp=cmp)
@@ -207,6 +269,11 @@ class RatingComparator(Comparator):
         return self.__class__.__name__
 
     def get_rating(self, characteristic: Characteristic) -> int:
+        """
+        :param characteristic: характеристика
+        :return: рейтинг значения характеристики по шкале
+        :raises ValueError: значения нет в шкале
+        """
         for item in self.rating:
             if item['value'] == characteristic.value:
                 return item['rating']
@@ -223,6 +290,10 @@ class RatingComparator(Comparator):
 
 
 class SmallerIsBetterComparator(Comparator):
+    """
+    Сравнение: лучше меньшее значение
+
+    """
     def __str__(self):
         return self.__class__.__name__
 
@@ -236,6 +307,10 @@ class SmallerIsBetterComparator(Comparator):
 
 
 class BiggerIsBetterComparator(Comparator):
+    """
+    Сравнение: лучше большее значение
+
+    """
     def __str__(self):
         return self.__class__.__name__
 
@@ -0,0 +1,118 @@
+"""
+Настройка соединений с БД
+"""
+
+import itertools
+import re
+from contextvars import ContextVar, Token
+from typing import Dict, Union
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PRAGMA_NAME = re.compile(r'^[a-z_]+$')
+PRAGMA_VALUE = re.compile(r'^-?\w+$')
+
+
+def apply_sqlite_pragmas(cursor, pragmas: Dict[str, Union[str, int]]) -> None:
+    """
+    Выполнение PRAGMA для соединения с SQLite. Параметры в PRAGMA
+    не подставляются, поэтому имена и значения проверяются
+
+    :param cursor: курсор соединения
+    :param pragmas: {имя: значение}, например SQLITE_PRAGMAS
+    :raises ValueError: недопустимое имя или значение
+    """
+    for name, value in pragmas.items():
+        if not PRAGMA_NAME.match(name) or not PRAGMA_VALUE.match(str(value)):
+            raise ValueError(f'Недопустимая PRAGMA: {name} = {value}')
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+# Текущий запрос читает из основной БД: посетитель недавно писал
+# или уже записал что-то в этом запросе
+_use_primary: ContextVar[bool] = ContextVar('use_primary', default=False)
+# В текущем запросе была запись
+_wrote: ContextVar[bool] = ContextVar('wrote', default=False)
+
+
+def use_primary(value: bool = True) -> Token:
+    """
+    :param value: читать ли из основной БД в текущем контексте
+    :return: токен для reset_primary
+    """
+    return _use_primary.set(value)
+
+
+def reset_primary(token: Token) -> None:
+    """
+    :param token: токен use_primary, значение до которого восстанавливается
+    """
+    _use_primary.reset(token)
+
+
+def track_writes() -> Token:
+    """
+    Начало учёта записей (в начале запроса)
+
+    :return: токен для has_written
+    """
+    return _wrote.set(False)
+
+
+def has_written(token: Token) -> bool:
+    """
+    Окончание учёта записей
+
+    :param token: токен track_writes
+    :return: была ли запись после track_writes
+    """
+    wrote = _wrote.get()
+    _wrote.reset(token)
+    return wrote
+
+
+class ReadReplicaRouter:
+    """
+    Запись - в основную БД, чтение - по очереди в реплики из
+    DATABASE_REPLICAS. Чтение остаётся в основной БД, если реплик нет,
+    если идёт транзакция (чтение перед записью должно видеть её данные)
+    и если текущий посетитель недавно писал (см. ReplicaStickinessMiddleware)
+    """
+
+    _counter = itertools.count()
+
+    def db_for_read(self, model, **hints):
+        """
+        :param model: модель
+        :return: алиас БД для чтения: очередная реплика или основная БД
+        """
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or _use_primary.get() or connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return DEFAULT_DB_ALIAS
+        return replicas[next(self._counter) % len(replicas)]
+
+    def db_for_write(self, model, **hints):
+        """
+        Запись отмечается, чтобы дальнейшие чтения шли в основную БД
+
+        :param model: модель
+        :return: алиас основной БД
+        """
+        _wrote.set(True)
+        _use_primary.set(True)
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        """
+        :return: связи между объектами из разных БД разрешены
+        """
+        # реплики содержат те же данные, что и основная БД
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        """
+        :param db: алиас БД
+        :return: миграции применяются только к основной БД
+        """
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,124 @@
+"""
+Фоновый сброс накопленных буферов в БД
+"""
+
+import atexit
+import logging
+import threading
+from typing import Callable, Optional
+
+from django.conf import settings
+from django.db import close_old_connections, DatabaseError
+
+logger = logging.getLogger(__name__)
+
+# Флаг "поток сейчас сбрасывает буфер": сброс, выполненный прямо в запросе
+# (буфер переполнен или фоновый поток выключен), - не работа страницы,
+# и его запросы не входят в её бюджет (main.middleware.QueryStats)
+_flushing = threading.local()
+
+
+def is_flushing() -> bool:
+    """
+    :return: выполняется ли сейчас в потоке сброс буфера
+    """
+    return getattr(_flushing, 'active', False)
+
+
+class PeriodicFlusher:
+    """
+    Поток, который раз в interval секунд вызывает функцию сброса буфера.
+    Поток запускается лениво при первой записи в буфер, а при завершении
+    процесса выполняется последний сброс, поэтому потеря ограничена
+    одним интервалом только при аварийном падении
+
+    :param name: имя буфера (для логов и метрик)
+    :param flush: функция сброса, возвращает количество сброшенных записей
+    :param interval_setting: имя настройки с интервалом в секундах;
+        0 или None - фоновый поток не запускается
+    :param stop_when_idle: завершать поток, когда сброс вернул 0, - для
+        редкой работы вроде очистки удалённых строк; следующий start()
+        запустит поток снова
+    """
+
+    def __init__(self, name: str, flush: Callable[[], int], interval_setting: str,
+                 stop_when_idle: bool = False):
+        self.name = name
+        self.flush = flush
+        self.interval_setting = interval_setting
+        self.stop_when_idle = stop_when_idle
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        self._lock = threading.Lock()
+        self._atexit_registered = False
+        # start() вызван после начала последнего сброса: поток не должен
+        # завершаться по простою, иначе новая работа останется без потока
+        self._requested = False
+
+    @property
+    def interval(self) -> Optional[float]:
+        """
+        :return: интервал сброса в секундах из настройки (0 или None - без потока)
+        """
+        return getattr(settings, self.interval_setting, None)
+
+    def is_running(self) -> bool:
+        """
+        :return: работает ли фоновый поток
+        """
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """
+        Запуск фонового потока, если он ещё не запущен и включён настройкой
+        """
+        self._requested = True
+        if self.is_running() or not self.interval:
+            return
+        with self._lock:
+            if self.is_running():
+                return
+            self._stopped.clear()
+            self._thread = threading.Thread(target=self._run, name=f'{self.name}-flusher',
+                                            daemon=True)
+            self._thread.start()
+            if not self._atexit_registered:
+                atexit.register(self.stop)
+                self._atexit_registered = True
+
+    def stop(self) -> None:
+        """
+        Остановка потока и финальный сброс буфера
+        """
+        self._stopped.set()
+        if self.is_running():
+            self._thread.join()
+        self.flush_safely()
+
+    def flush_safely(self) -> int:
+        """
+        Сброс буфера, ошибки БД только логируются: данные остаются в буфере
+        и будут сброшены в следующий раз
+
+        :return: количество сброшенных записей
+        """
+        active = is_flushing()
+        _flushing.active = True
+        try:
+            return self.flush()
+        except DatabaseError:
+            logger.exception('Не удалось сбросить буфер %s', self.name)
+            return 0
+        finally:
+            _flushing.active = active
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self.interval):
+            self._requested = False
+            count = self.flush_safely()
+            close_old_connections()
+            if self.stop_when_idle and not count:
+                with self._lock:
+                    if not self._requested:
+                        self._thread = None
+                        return
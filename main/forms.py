@@ -6,6 +6,7 @@ from django.urls import reverse
 
 from main.models import User, Product, ProductImage, UserAvatar, \
     ComparingReview, CategoryCharacteristic, Application, ProductCharacteristic
+from main.product_import import get_format
 
 
 class RegistrationForm(UserCreationForm):
@@ -228,3 +229,16 @@ class ProductCharacteristicForm(forms.ModelForm):
             'product': forms.HiddenInput(),
             'characteristic': forms.TextInput(attrs={'disabled': ''}),
         }
+
+
+class ProductImportForm(forms.Form):
+    """
+    Файл для импорта товаров (см. main.product_import)
+    """
+    file = forms.FileField(label='Файл CSV или JSONL')
+
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        if get_format(file.name) is None:
+            raise forms.ValidationError('Поддерживаются файлы .csv, .jsonl и .json')
+        return file
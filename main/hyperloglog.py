@@ -0,0 +1,83 @@
+"""
+Приближённый подсчёт уникальных значений (HyperLogLog)
+"""
+
+import hashlib
+import math
+from typing import Iterable, Optional
+
+# 2 ** 8 = 256 регистров по байту, стандартная ошибка ~6.5%.
+# Менять нельзя без пересчёта сохранённых скетчей
+PRECISION = 8
+REGISTERS = 1 << PRECISION
+
+
+class HyperLogLog:
+    """
+    Скетч HyperLogLog: оценка количества различных значений по
+    фиксированному набору регистров. Скетчи объединяются поэлементным
+    максимумом, поэтому уникальных за неделю можно получить из дневных
+    скетчей без хранения самих значений
+
+    :param registers: сохранённые регистры (None - пустой скетч)
+    """
+
+    def __init__(self, registers: Optional[bytes] = None):
+        if registers is None:
+            self.registers = bytearray(REGISTERS)
+        elif len(registers) != REGISTERS:
+            raise ValueError(f'Ожидалось {REGISTERS} регистров, получено {len(registers)}')
+        else:
+            self.registers = bytearray(registers)
+
+    def add(self, value: str) -> None:
+        """
+        Учёт значения
+
+        :param value: значение (например, идентификатор посетителя)
+        """
+        hashed = int.from_bytes(hashlib.sha1(value.encode('utf-8')).digest()[:8], 'big')
+        index = hashed >> (64 - PRECISION)
+        rest = hashed & ((1 << (64 - PRECISION)) - 1)
+        rank = (64 - PRECISION) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def update(self, other: 'HyperLogLog') -> None:
+        """
+        Объединение с другим скетчем
+
+        :param other: скетч
+        """
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self) -> int:
+        """
+        :return: оценка количества различных учтённых значений
+        """
+        alpha = 0.7213 / (1 + 1.079 / REGISTERS)
+        estimate = alpha * REGISTERS ** 2 / sum(2.0 ** -rank for rank in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * REGISTERS and zeros:
+            estimate = REGISTERS * math.log(REGISTERS / zeros)
+        return round(estimate)
+
+    def copy(self) -> 'HyperLogLog':
+        """
+        :return: независимая копия скетча
+        """
+        return HyperLogLog(bytes(self.registers))
+
+    def __bytes__(self) -> bytes:
+        return bytes(self.registers)
+
+    @staticmethod
+    def merge(sketches: Iterable['HyperLogLog']) -> 'HyperLogLog':
+        """
+        :param sketches: скетчи
+        :return: скетч объединения
+        """
+        merged = HyperLogLog()
+        for sketch in sketches:
+            merged.update(sketch)
+        return merged
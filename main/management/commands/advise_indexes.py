@@ -0,0 +1,412 @@
+"""
+Подбор индексов по журналу медленных запросов
+"""
+
+import json
+import math
+import os
+import re
+import tempfile
+from collections import Counter
+from typing import Dict, List, Sequence, Tuple
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connection, connections, models
+from django.db.migrations import AddIndex, Migration
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+
+from main.management.commands.benchmark_sqlite import Command as SqliteBenchmark
+from main.slow_queries import explain
+
+# Условия на колонку в WHERE: "таблица"."колонка" = / IN / < ...
+# IS NULL пропускается: это фильтр мягкого удаления (deleted_at IS NULL),
+# которому соответствуют почти все строки, индекс по нему не поможет
+CONDITION = re.compile(r'"(\w+)"\."(\w+)" (=|IN|IS(?! NULL)|<=|>=|<|>) ')
+ORDER_COLUMN = re.compile(r'"(\w+)"\."(\w+)"')
+EQUALITY_OPERATORS = ('=', 'IN', 'IS')
+
+ADVISE_ALIAS = 'advise_indexes'
+
+Candidate = Tuple[str, Tuple[str, ...]]
+
+
+def parse_query(sql: str) -> Dict[str, Dict[str, List[str]]]:
+    """
+    Колонки, по которым запрос ищет и сортирует, по таблицам. Разбор
+    рассчитан на SQL, который строит ORM Django, а не на произвольный SQL
+
+    :param sql: запрос
+    :return: {таблица: {'equality': [...], 'range': [...], 'order': [...]}}
+    """
+    where = sql.split(' WHERE ', 1)[1] if ' WHERE ' in sql else ''
+    where, _, order = where.partition(' ORDER BY ')
+    if not where and ' ORDER BY ' in sql:
+        order = sql.rsplit(' ORDER BY ', 1)[1]
+    order = order.split(' LIMIT ')[0]
+
+    tables: Dict[str, Dict[str, List[str]]] = {}
+
+    def add(table: str, kind: str, column: str) -> None:
+        columns = tables.setdefault(table, {'equality': [], 'range': [], 'order': []})[kind]
+        if column not in columns:
+            columns.append(column)
+
+    for table, column, operator in CONDITION.findall(where):
+        add(table, 'equality' if operator in EQUALITY_OPERATORS else 'range', column)
+    for table, column in ORDER_COLUMN.findall(order):
+        add(table, 'order', column)
+    return tables
+
+
+def get_candidates(sql: str) -> List[Candidate]:
+    """
+    Индексы-кандидаты для запроса: каждая колонка из условия равенства
+    отдельно и вместе с первой колонкой диапазона или сортировки, а также
+    все колонки равенства вместе
+
+    :param sql: запрос
+    :return: (таблица, колонки) кандидатов
+    """
+    candidates = []
+    for table, columns in parse_query(sql).items():
+        tail = (columns['range'] + columns['order'])[:1]
+        for column in columns['equality']:
+            candidates.append((table, (column,)))
+            if tail and tail[0] != column:
+                candidates.append((table, (column, tail[0])))
+        if len(columns['equality']) > 1:
+            rest = [column for column in tail if column not in columns['equality']]
+            candidates.append((table, tuple(columns['equality'] + rest)))
+        if not columns['equality'] and tail:
+            candidates.append((table, tuple(tail)))
+    return list(dict.fromkeys(candidates))
+
+
+def get_existing_indexes(database, table: str) -> List[Tuple[str, ...]]:
+    """
+    :param database: подключение к БД
+    :param table: таблица
+    :return: колонки существующих индексов (включая первичный ключ и уникальные)
+    """
+    with database.cursor() as cursor:
+        constraints = database.introspection.get_constraints(cursor, table)
+    return [tuple(constraint['columns']) for constraint in constraints.values()
+            if constraint['index'] or constraint['unique'] or constraint['primary_key']]
+
+
+def is_covered(candidate: Candidate, existing: Dict[str, List[Tuple[str, ...]]]) -> bool:
+    """
+    :return: есть ли индекс, начинающийся с колонок кандидата
+    """
+    table, columns = candidate
+    return any(index[:len(columns)] == columns for index in existing.get(table, []))
+
+
+class PlanCost:
+    """
+    Грубая оценка стоимости плана EXPLAIN QUERY PLAN по числу строк:
+    полный просмотр таблицы - все её строки, поиск по индексу - логарифм
+    плюс найденные строки (по числу различных значений колонок условия),
+    временное B-дерево для сортировки - n log n найденных строк. Шаги
+    плана - вложенные циклы, кроме частей MULTI-INDEX OR, которые
+    складываются. SQLite не сообщает стоимость плана, поэтому важны
+    только относительные значения
+
+    :param database: подключение к БД, в которой строятся планы
+    """
+
+    STEP = re.compile(r'^(SCAN|SEARCH) (?:TABLE )?(\w+)(?: AS \w+)?(.*)$')
+    SEARCH_CONDITION = re.compile(r'\((.*)\)$')
+
+    def __init__(self, database):
+        self.database = database
+        self.rows: Dict[str, int] = {}
+        self.distinct: Dict[Tuple[str, str], int] = {}
+        self.tables = set(database.introspection.table_names())
+
+    def count(self, sql: str) -> int:
+        """
+        :param sql: запрос с одним числом в результате
+        :return: это число
+        """
+        with self.database.cursor() as cursor:
+            cursor.execute(sql)
+            return cursor.fetchone()[0]
+
+    def get_rows(self, table: str) -> int:
+        """
+        :param table: таблица
+        :return: количество строк таблицы (запоминается)
+        """
+        if table not in self.rows:
+            quoted = self.database.ops.quote_name(table)
+            self.rows[table] = self.count(f'SELECT COUNT(*) FROM {quoted}')
+        return self.rows[table]
+
+    def get_distinct(self, table: str, column: str) -> int:
+        """
+        :param table: таблица
+        :param column: колонка
+        :return: количество различных значений колонки (запоминается), не меньше 1
+        """
+        if (table, column) not in self.distinct:
+            quote = self.database.ops.quote_name
+            self.distinct[table, column] = max(self.count(
+                f'SELECT COUNT(DISTINCT {quote(column)}) FROM {quote(table)}'
+            ), 1)
+        return self.distinct[table, column]
+
+    def get_matched(self, table: str, rows: int, rest: str) -> float:
+        """
+        :return: оценка числа строк, найденных поиском по индексу
+        """
+        if 'PRIMARY KEY' in rest:
+            return 1
+        condition = self.SEARCH_CONDITION.search(rest)
+        matched = float(rows)
+        for term in condition.group(1).split(' AND ') if condition else []:
+            column, equals, _ = term.partition('=')
+            if equals and column.isidentifier():
+                matched /= self.get_distinct(table, column)
+            else:
+                matched /= 3
+        return max(matched, 1)
+
+    def __call__(self, plan: Sequence[str]) -> float:
+        cost = 0.0
+        loops = 1.0
+        union_table = None
+        union_rows = 0.0
+        for step in plan:
+            if step == 'MULTI-INDEX OR':
+                union_table, union_rows = '', 0.0
+                continue
+            match = self.STEP.match(step)
+            if match:
+                kind, table, rest = match.groups()
+                rows = self.get_rows(table) if table in self.tables else 1
+                matched = rows if kind == 'SCAN' else self.get_matched(table, rows, rest)
+                step_cost = rows * (0.5 if 'COVERING INDEX' in rest else 1.0) if kind == 'SCAN' \
+                    else math.log2(rows + 2) + matched
+                cost += loops * step_cost
+                if union_table is not None and union_table in ('', table):
+                    union_table = table
+                    union_rows += matched
+                    continue
+                if union_table:
+                    loops *= union_rows
+                    union_table = None
+                loops *= matched
+            elif step.startswith('USE TEMP B-TREE'):
+                if union_table:
+                    loops *= union_rows
+                    union_table = None
+                cost += loops * math.log2(loops + 2)
+        return cost
+
+
+class Command(BaseCommand):
+    """
+    Подбор индексов по журналу запросов:
+
+        curl -b sessionid=... 'https://.../slow_queries/?format=json' > queries.json
+        python manage.py advise_indexes queries.json --write-migration
+
+    Рабочая БД только читается: она копируется через sqlite3 backup во
+    временный файл, и индексы создаются и удаляются в копии, поэтому
+    команда не держит блокировку записи рабочей БД.
+
+    Запросы группируются по тексту, вес группы - количество запросов
+    (или суммарное время, если в записях есть time_ms). Для запросов
+    строятся индексы-кандидаты; каждый кандидат создаётся в копии,
+    запросы заново проходят EXPLAIN QUERY PLAN, после чего кандидат
+    удаляется. Индексы выбираются
+    жадно, пока выигрыш очередного не меньше --min-benefit от исходной
+    стоимости. Для выбранных индексов пишется миграция; те же индексы
+    нужно добавить в Meta.indexes моделей (команда выводит их), иначе
+    makemigrations предложит их удалить
+    """
+
+    help = 'Подбирает индексы по журналу запросов и пишет миграцию'
+
+    def add_arguments(self, parser):
+        parser.add_argument('files', nargs='+', help='JSON-выгрузки журнала медленных запросов')
+        parser.add_argument('--min-benefit', type=float, default=0.05,
+                            help='минимальная доля выигрыша от исходной стоимости')
+        parser.add_argument('--max-indexes', type=int, default=10)
+        parser.add_argument('--write-migration', action='store_true')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Оценка планов реализована только для SQLite')
+
+        queries = self.load_queries(options['files'])
+        if not queries:
+            raise CommandError('В журнале нет запросов SELECT, UPDATE или DELETE')
+        chosen, baseline, current = self.search_on_copy(queries, options)
+        if not chosen:
+            self.stdout.write(self.style.SUCCESS('Полезных индексов не найдено'))
+            return
+        gain = 1 - current / baseline
+        self.stdout.write(f'Итоговая стоимость {current:.0f} ({gain:.0%} выигрыша)')
+        indexes = self.get_model_indexes([candidate for candidate, _ in chosen])
+        for model, index in indexes:
+            self.stdout.write(f'{model.__name__}.Meta.indexes: '
+                              f'models.Index(fields={index.fields!r}, name={index.name!r})')
+        if options['write_migration']:
+            by_app: Dict[str, list] = {}
+            for model, index in indexes:
+                by_app.setdefault(model._meta.app_label, []).append((model, index))
+            for app_indexes in by_app.values():
+                path = self.write_migration(app_indexes)
+                self.stdout.write(self.style.SUCCESS(f'Миграция записана: {path}'))
+
+    def search_on_copy(self, queries: Sequence[Tuple[str, list, float]],
+                       options: dict) -> Tuple[List[Tuple[Candidate, float]], float, float]:
+        """
+        Подбор индексов в копии рабочей БД во временном файле
+
+        :param queries: запросы журнала (load_queries)
+        :param options: параметры команды
+        :return: то же, что search
+        """
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'advise.sqlite3')
+            SqliteBenchmark.copy_database(path)
+            # отдельный алиас: интроспекция Django находит подключение по алиасу
+            wrapper = type(connections[DEFAULT_DB_ALIAS])
+            database = wrapper(dict(connection.settings_dict, NAME=path), ADVISE_ALIAS)
+            connections[ADVISE_ALIAS] = database
+            try:
+                return self.search(database, queries, options)
+            finally:
+                database.close()
+                del connections[ADVISE_ALIAS]
+
+    def search(self, database, queries: Sequence[Tuple[str, list, float]],
+               options: dict) -> Tuple[List[Tuple[Candidate, float]], float, float]:
+        """
+        Жадный подбор индексов в копии БД: выбранные индексы остаются
+        в копии, следующий кандидат оценивается вместе с ними
+
+        :param database: подключение к копии БД
+        :param queries: запросы журнала (load_queries)
+        :param options: параметры команды
+        :return: выбранные индексы с выигрышем, исходная и итоговая стоимость
+        """
+        cost = PlanCost(database)
+        candidates = list(dict.fromkeys(
+            candidate for sql, _, _ in queries for candidate in get_candidates(sql)
+        ))
+        tables = {table for table, _ in candidates}
+        existing = {table: get_existing_indexes(database, table) for table in tables}
+        candidates = [candidate for candidate in candidates if not is_covered(candidate, existing)]
+
+        chosen: List[Tuple[Candidate, float]] = []
+        baseline = current = self.total_cost(queries, cost)
+        self.stdout.write(f'Запросов: {len(queries)}, исходная стоимость {baseline:.0f}')
+        while candidates and len(chosen) < options['max_indexes']:
+            benefits = [(current - self.cost_with(candidate, queries, cost), candidate)
+                        for candidate in candidates]
+            benefit, best = max(benefits, key=lambda item: item[0])
+            if benefit <= 0 or benefit < baseline * options['min_benefit']:
+                break
+            self.create_index(database, best, f'advised_{len(chosen)}')
+            chosen.append((best, benefit))
+            current -= benefit
+            candidates.remove(best)
+            self.stdout.write(f'{best[0]}({", ".join(best[1])}): '
+                              f'-{benefit:.0f} ({benefit / baseline:.0%} от исходной)')
+        return chosen, baseline, current
+
+    @staticmethod
+    def load_queries(paths: Sequence[str]) -> List[Tuple[str, list, float]]:
+        """
+        :param paths: файлы с записями журнала ({'sql', 'params', 'time_ms'})
+        :return: (запрос, параметры первого из одинаковых, вес) по группам одинаковых запросов
+        """
+        weights: Counter = Counter()
+        params = {}
+        for path in paths:
+            with open(path, encoding='utf-8') as file:
+                for entry in json.load(file):
+                    sql = entry['sql']
+                    if not sql.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+                        continue
+                    weights[sql] += entry.get('time_ms') or 1
+                    params.setdefault(sql, entry.get('params') or [])
+        return [(sql, params[sql], weight) for sql, weight in weights.most_common()]
+
+    @staticmethod
+    def total_cost(queries: Sequence[Tuple[str, list, float]], cost: PlanCost) -> float:
+        """
+        :param queries: запросы журнала (load_queries)
+        :param cost: оценка планов в копии БД
+        :return: взвешенная стоимость планов всех запросов
+        """
+        return sum(weight * cost(explain(cost.database, sql, params) or [])
+                   for sql, params, weight in queries)
+
+    @staticmethod
+    def create_index(database, candidate: Candidate, name: str) -> None:
+        """
+        :param database: подключение к копии БД
+        :param candidate: таблица и колонки индекса
+        :param name: имя индекса
+        """
+        table, columns = candidate
+        quote = database.ops.quote_name
+        with database.cursor() as cursor:
+            cursor.execute(f'CREATE INDEX {quote(name)} ON {quote(table)} '
+                           f'({", ".join(quote(column) for column in columns)})')
+
+    def cost_with(self, candidate: Candidate, queries, cost: PlanCost) -> float:
+        """
+        :return: стоимость запросов при добавлении индекса-кандидата
+        """
+        self.create_index(cost.database, candidate, 'advise_candidate')
+        try:
+            return self.total_cost(queries, cost)
+        finally:
+            with cost.database.cursor() as cursor:
+                cursor.execute('DROP INDEX "advise_candidate"')
+
+    @staticmethod
+    def get_model_indexes(candidates: Sequence[Candidate]) -> List[Tuple[type, models.Index]]:
+        """
+        :param candidates: выбранные индексы
+        :return: модели и индексы Django для них
+        """
+        by_table = {model._meta.db_table: model for model in apps.get_models()}
+        indexes = []
+        for table, columns in candidates:
+            model = by_table.get(table)
+            if model is None:
+                continue
+            by_column = {field.column: field.name for field in model._meta.concrete_fields}
+            index = models.Index(fields=[by_column[column] for column in columns])
+            index.set_name_with_model(model)
+            indexes.append((model, index))
+        return indexes
+
+    @staticmethod
+    def write_migration(indexes: Sequence[Tuple[type, models.Index]]) -> str:
+        """
+        :param indexes: модели и индексы одного приложения
+        :return: путь к файлу миграции
+        """
+        app_label = indexes[0][0]._meta.app_label
+        loader = MigrationLoader(None, ignore_no_migrations=True)
+        leaf = max(loader.graph.leaf_nodes(app_label))
+        number = int(leaf[1].split('_')[0]) + 1
+
+        migration = Migration(f'{number:04d}_advised_indexes', app_label)
+        migration.dependencies = [leaf]
+        migration.operations = [AddIndex(model._meta.model_name, index) for model, index in indexes]
+        writer = MigrationWriter(migration)
+        os.makedirs(os.path.dirname(writer.path), exist_ok=True)
+        with open(writer.path, 'w', encoding='utf-8') as file:
+            file.write(writer.as_string())
+        return writer.path
@@ -0,0 +1,41 @@
+"""
+Перенос старых фактов оценки в архив с дневными сводками
+"""
+
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from main.models import ProductRateFact, ReviewRateFact
+
+
+class Command(BaseCommand):
+    """
+    Архивация старых фактов оценки пачками: каждая пачка - отдельная
+    короткая транзакция, поэтому команда не держит блокировку записи
+    надолго и её можно прервать и перезапустить в любой момент
+    """
+
+    help = 'Переносит старые оценки в архив и дневные сводки'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than-days', type=int, default=180,
+                            help='архивировать оценки старше указанного числа дней')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+        parser.add_argument('--max-chunks', type=int, default=None,
+                            help='ограничить количество пачек за один запуск')
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['older_than_days'])
+        for fact_model in (ProductRateFact, ReviewRateFact):
+            archived = chunks = 0
+            while options['max_chunks'] is None or chunks < options['max_chunks']:
+                count = fact_model.archive_chunk(before, options['chunk_size'])
+                if count == 0:
+                    break
+                archived += count
+                chunks += 1
+            self.stdout.write(self.style.SUCCESS(
+                f'{fact_model.__name__}: перенесено в архив {archived}'
+            ))
@@ -0,0 +1,176 @@
+"""
+Сравнение настроек соединений SQLite под параллельной нагрузкой
+"""
+
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from main.db import apply_sqlite_pragmas
+from main.management.commands.loadtest import percentile
+
+READ_SQL = 'SELECT * FROM "main_product" WHERE "id" = ?'
+WRITE_SQL = 'UPDATE "main_product" SET "views" = "views" + 1 WHERE "id" = ?'
+IDS_SQL = 'SELECT "id" FROM "main_product" ORDER BY RANDOM() LIMIT 1000'
+VIEWS_SQL = 'SELECT COALESCE(SUM("views"), 0) FROM "main_product"'
+
+
+class Profile:
+    """
+    Способ работы с соединениями: как раньше (новое соединение на каждый
+    запрос, журнал по умолчанию) или как настроено сейчас (соединение
+    живёт в потоке, SQLITE_PRAGMAS)
+
+    :param name: название
+    :param persistent: одно соединение на поток
+    :param pragmas: PRAGMA для каждого соединения
+    """
+
+    def __init__(self, name: str, persistent: bool, pragmas: Dict[str, object]):
+        self.name = name
+        self.persistent = persistent
+        self.pragmas = pragmas
+
+    def connect(self, path: str) -> sqlite3.Connection:
+        """
+        :param path: файл БД
+        :return: соединение в режиме autocommit с PRAGMA профиля
+        """
+        database = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        apply_sqlite_pragmas(database.cursor(), self.pragmas)
+        return database
+
+
+PROFILES = [
+    Profile('before', persistent=False, pragmas={'journal_mode': 'delete'}),
+    Profile('after', persistent=True, pragmas=settings.SQLITE_PRAGMAS),
+]
+
+
+class Command(BaseCommand):
+    """
+    Сравнение пропускной способности SQLite до и после настройки
+    соединений: --readers потоков читают товары, --writers потоков
+    увеличивают счётчик просмотров, как product_page. Нагрузка идёт
+    на копии БД (для каждого профиля своей), исходная БД не меняется;
+    столбец "просмотров" - прирост просмотров в копии
+    """
+
+    help = 'Замеряет чтение и запись SQLite при параллельной нагрузке ' \
+           'до и после настройки соединений'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=2)
+        parser.add_argument('--duration', type=float, default=5, help='секунд на профиль')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Команда сравнивает настройки SQLite')
+
+        self.stdout.write(f'{"профиль":<10}{"чтений/с":>12}{"записей/с":>12}'
+                          f'{"p95 чтения, мс":>17}{"p95 записи, мс":>17}'
+                          f'{"ошибок":>9}{"просмотров":>12}')
+        with tempfile.TemporaryDirectory() as directory:
+            for profile in PROFILES:
+                path = os.path.join(directory, f'{profile.name}.sqlite3')
+                self.copy_database(path)
+                # id берутся из копии: нагрузка идёт по зафиксированным строкам
+                product_ids = self.query(path, IDS_SQL)
+                if not product_ids:
+                    raise CommandError('В БД нет товаров: сначала выполните generate_dataset')
+                views = self.query(path, VIEWS_SQL)[0]
+                result = self.run_profile(profile, path, product_ids, options)
+                # прирост просмотров в копии - сколько записей действительно изменили строки
+                views = self.query(path, VIEWS_SQL)[0] - views
+                self.stdout.write(
+                    f'{profile.name:<10}{result["reads"] / options["duration"]:>12.1f}'
+                    f'{result["writes"] / options["duration"]:>12.1f}'
+                    f'{result["read_p95_ms"]:>17.2f}{result["write_p95_ms"]:>17.2f}'
+                    f'{result["errors"]:>9}{views:>12}'
+                )
+
+    @staticmethod
+    def query(path: str, sql: str) -> List[object]:
+        """
+        :param path: файл БД
+        :param sql: запрос
+        :return: первый столбец результата
+        """
+        database = sqlite3.connect(path)
+        try:
+            return [row[0] for row in database.execute(sql).fetchall()]
+        finally:
+            database.close()
+
+    @staticmethod
+    def copy_database(path: str) -> None:
+        """
+        :param path: файл для копии рабочей БД
+        """
+        # Отдельное соединение: копируется зафиксированное состояние, и открытая
+        # транзакция соединения Django не блокирует копирование
+        source = sqlite3.connect(connection.settings_dict['NAME'])
+        target = sqlite3.connect(path)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+    @staticmethod
+    def run_profile(profile: Profile, path: str, product_ids: List[int], options: dict) -> dict:
+        """
+        :return: количество чтений и записей, их p95 в мс и число ошибок блокировки
+        """
+        # Режим журнала хранится в файле БД, поэтому выставляется до нагрузки
+        profile.connect(path).close()
+        latencies: Dict[str, List[float]] = {'read': [], 'write': []}
+        errors = [0]
+        lock = threading.Lock()
+        deadline = time.monotonic() + options['duration']
+
+        def worker(kind: str, sql: str) -> None:
+            rng = random.Random()
+            persistent = profile.connect(path) if profile.persistent else None
+            timings = []
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                database = persistent or profile.connect(path)
+                try:
+                    database.execute(sql, (rng.choice(product_ids),)).fetchall()
+                    timings.append(time.perf_counter() - start)
+                except sqlite3.OperationalError:
+                    with lock:
+                        errors[0] += 1
+                finally:
+                    if persistent is None:
+                        database.close()
+            if persistent is not None:
+                persistent.close()
+            with lock:
+                latencies[kind].extend(timings)
+
+        workers: List[Callable] = [lambda: worker('read', READ_SQL)] * options['readers']
+        workers += [lambda: worker('write', WRITE_SQL)] * options['writers']
+        threads = [threading.Thread(target=target) for target in workers]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        return {
+            'reads': len(latencies['read']),
+            'writes': len(latencies['write']),
+            'read_p95_ms': percentile(sorted(latencies['read']), 95) * 1000,
+            'write_p95_ms': percentile(sorted(latencies['write']), 95) * 1000,
+            'errors': errors[0],
+        }
@@ -0,0 +1,21 @@
+"""
+Перенос оценок из буфера в факты и агрегаты
+"""
+
+from django.core.management.base import BaseCommand
+
+from main.models import PendingRating
+
+
+class Command(BaseCommand):
+    """
+    Перенос всех оценок из буфера в факты и агрегаты.
+    Нужна, если фоновый поток отключён (RATING_BUFFER_FLUSH_INTERVAL = 0),
+    например для запуска по cron
+    """
+
+    help = 'Переносит накопленные оценки из буфера в факты'
+
+    def handle(self, *args, **options):
+        flushed = PendingRating.flush_all()
+        self.stdout.write(self.style.SUCCESS(f'Перенесено оценок: {flushed}'))
@@ -0,0 +1,425 @@
+"""
+Генерация большого набора данных для нагрузочного тестирования
+"""
+
+import random
+from array import array
+from datetime import timedelta
+from itertools import islice
+from typing import Callable, Dict, Iterator, List, Sequence
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from main.characteristic import CharacteristicType, ComparatorStrategy
+from main.models import User, ProductCategory, CategoryCharacteristic, \
+    CategoryStringCharacteristicRating, Product, ProductCharacteristic, ProductRateFact, \
+    ComparingReview, Store, StoreProduct, RATING_SCALE, bayesian_score
+from main.management.commands.rebuild_rating_aggregates import AGGREGATE_FIELDS
+
+# Распределение оценок: пятёрок и четвёрок больше, чем единиц
+RATING_WEIGHTS = [5, 5, 15, 35, 40]
+RATE_FACT_DAYS = 365
+
+
+class Command(BaseCommand):
+    """
+    Генерация большого набора данных для нагрузочного тестирования:
+
+        python manage.py generate_dataset --categories 500 --products 1000000 \\
+            --users 200000 --rate-facts 20000000 --reviews 2000000 --store-links 2000000
+
+    Значения характеристик соответствуют типу и стратегии сравнения
+    характеристики: для строковых создаётся рейтинговая шкала, и значения
+    берутся из неё. Пара (пользователь, товар) в оценках не повторяется.
+    Все записи идут пачками по --chunk-size в отдельных транзакциях
+    (bulk_create, а для самых больших таблиц - executemany);
+    id созданных объектов хранятся в array, а не в списках объектов,
+    чтобы память не росла с объёмом. Агрегаты рейтингов товаров
+    сразу соответствуют фактам: rebuild_rating_aggregates --dry-run
+    не находит расхождений. Счётчики обзоров и магазинов товаров
+    пересчитываются в конце, так как вставка идёт мимо сигналов
+    """
+
+    help = 'Генерирует синтетические данные заданного объёма'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # выставляются в handle: генератор с --seed, размер пачки и метка запуска
+        self.random = random.Random()
+        self.chunk_size = 10000
+        self.run = ''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=20)
+        parser.add_argument('--characteristics', type=int, default=5,
+                            help='характеристик на категорию')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--rate-facts', type=int, default=100000)
+        parser.add_argument('--reviews', type=int, default=10000)
+        parser.add_argument('--stores', type=int, default=100)
+        parser.add_argument('--store-links', type=int, default=10000)
+        parser.add_argument('--chunk-size', type=int, default=10000)
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        if options['categories'] < 1 or options['users'] < 1 or options['products'] < 2:
+            raise CommandError('Нужны хотя бы одна категория, один пользователь и два товара')
+        if options['rate_facts'] > options['users'] * options['products']:
+            raise CommandError('Оценок больше, чем пар (пользователь, товар)')
+
+        self.random = random.Random(options['seed'])
+        self.chunk_size = options['chunk_size']
+        self.run = f'{self.random.getrandbits(32):08x}'
+
+        users = self.generate_users(options['users'])
+        categories = self.generate_categories(options['categories'])
+        characteristics = self.generate_characteristics(categories, options['characteristics'])
+        products = self.generate_products(options['products'], categories, users)
+        self.generate_product_characteristics(products, categories, characteristics)
+        self.generate_rate_facts(options['rate_facts'], products, users)
+        self.generate_reviews(options['reviews'], products, len(categories), users)
+        stores = self.generate_stores(options['stores'])
+        self.generate_store_links(options['store_links'], products, stores)
+        self.count_related(products)
+        self.stdout.write(self.style.SUCCESS('Данные сгенерированы'))
+
+    def chunks(self, total: int) -> Iterator[range]:
+        """
+        :param total: количество объектов
+        :return: номера объектов пачками по chunk_size
+        """
+        for start in range(0, total, self.chunk_size):
+            yield range(start, min(start + self.chunk_size, total))
+
+    def bulk_insert(self, model, total: int, build: Callable[[int], object]) -> array:
+        """
+        Вставка total объектов пачками
+
+        :param model: модель
+        :param total: количество объектов
+        :param build: функция, создающая объект по его номеру
+        :return: id созданных объектов в порядке номеров
+        """
+        ids = array('q')
+        for numbers in self.chunks(total):
+            with transaction.atomic():
+                last_id = model.objects.aggregate(last=Max('id'))['last'] or 0
+                model.objects.bulk_create([build(number) for number in numbers])
+                ids.extend(model.objects.filter(id__gt=last_id).order_by('id').values_list(
+                    'id', flat=True))
+            self.stdout.write(f'{model.__name__}: {len(ids)} / {total}')
+        if len(ids) != total:
+            raise CommandError(f'{model.__name__}: создано {len(ids)} вместо {total}, '
+                               'во время генерации в таблицу писал кто-то ещё')
+        return ids
+
+    def bulk_insert_rows(self, model, rows: Iterator[object]) -> int:
+        """
+        Вставка объектов без получения их id
+
+        :param model: модель
+        :param rows: объекты
+        :return: количество вставленных объектов
+        """
+        inserted = 0
+        batch: List[object] = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == self.chunk_size:
+                inserted += self.flush_rows(model, batch, inserted)
+                batch = []
+        if batch:
+            inserted += self.flush_rows(model, batch, inserted)
+        return inserted
+
+    def flush_rows(self, model, batch: List[object], inserted: int) -> int:
+        """
+        :param model: модель
+        :param batch: пачка объектов
+        :param inserted: сколько объектов уже вставлено (для вывода прогресса)
+        :return: количество вставленных объектов
+        """
+        with transaction.atomic():
+            model.objects.bulk_create(batch)
+        self.stdout.write(f'{model.__name__}: {inserted + len(batch)}')
+        return len(batch)
+
+    def insert_values(self, model, fields: Sequence[str], rows: Iterator[tuple]) -> int:
+        """
+        Вставка строк таблицы через executemany, минуя создание объектов
+        моделей: для самых больших таблиц (десятки миллионов строк) ORM
+        тратит на объект больше времени, чем SQLite на его запись.
+        Значения должны быть уже приведены к виду для БД, значения по
+        умолчанию и auto_now_add не применяются
+
+        :param model: модель
+        :param fields: имена полей модели
+        :param rows: кортежи значений в порядке fields
+        :return: количество вставленных строк
+        """
+        quote = connection.ops.quote_name
+        columns = ', '.join(quote(model._meta.get_field(field).column) for field in fields)
+        sql = (f'INSERT INTO {quote(model._meta.db_table)} ({columns}) '
+               f'VALUES ({", ".join(["%s"] * len(fields))})')
+        inserted = 0
+        while True:
+            batch = list(islice(rows, self.chunk_size))
+            if not batch:
+                return inserted
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+            inserted += len(batch)
+            self.stdout.write(f'{model.__name__}: {inserted}')
+
+    def update_values(self, model, fields: Sequence[str], rows: Iterator[tuple]) -> int:
+        """
+        Обновление строк таблицы по id через executemany
+
+        :param model: модель
+        :param fields: имена обновляемых полей модели
+        :param rows: кортежи новых значений в порядке fields, последний элемент - id
+        :return: количество обработанных строк
+        """
+        quote = connection.ops.quote_name
+        columns = [quote(model._meta.get_field(field).column) for field in fields]
+        assignments = ', '.join(f'{column} = %s' for column in columns)
+        sql = f'UPDATE {quote(model._meta.db_table)} SET {assignments} WHERE {quote("id")} = %s'
+        updated = 0
+        while True:
+            batch = list(islice(rows, self.chunk_size))
+            if not batch:
+                return updated
+            with transaction.atomic(), connection.cursor() as cursor:
+                cursor.executemany(sql, batch)
+            updated += len(batch)
+            self.stdout.write(f'{model.__name__}: обновлено {updated}')
+
+    def generate_users(self, total: int) -> array:
+        """
+        :param total: количество пользователей
+        :return: id пользователей
+        """
+        # Хеш пароля считается один раз: войти под сгенерированными пользователями нельзя
+        password = make_password(None)
+        return self.bulk_insert(User, total, lambda number: User(
+            username=f'gen{self.run}_{number}', password=password,
+            email=f'gen{self.run}_{number}@example.com'
+        ))
+
+    def generate_categories(self, total: int) -> array:
+        """
+        :param total: количество категорий
+        :return: id категорий
+        """
+        return self.bulk_insert(ProductCategory, total, lambda number: ProductCategory(
+            name=f'Категория {self.run}-{number}', description='Сгенерированная категория'
+        ))
+
+    def generate_characteristics(self, categories: array,
+                                 per_category: int) -> Dict[int, List[dict]]:
+        """
+        Характеристики категорий: тип выбирается случайно, стратегия
+        сравнения - по типу (строки сравниваются только по рейтингу)
+
+        :return: {id категории: [описание характеристики]}, описание содержит
+            id, тип и параметры генерации значений
+        """
+        specs = []
+        for category_id in categories:
+            for number in range(per_category):
+                value_type = self.random.choice(CharacteristicType.values)
+                if value_type == CharacteristicType.str:
+                    comparator = ComparatorStrategy.RATING
+                elif value_type == CharacteristicType.bool:
+                    comparator = ComparatorStrategy.BIGGER
+                else:
+                    comparator = self.random.choice([ComparatorStrategy.SMALLER,
+                                                     ComparatorStrategy.BIGGER])
+                low = self.random.randint(1, 100)
+                specs.append({
+                    'category_id': category_id,
+                    'name': f'Характеристика {number}',
+                    'value_type': value_type,
+                    'comparator': comparator,
+                    'low': low,
+                    'high': low * self.random.randint(2, 100),
+                    'ladder': [f'Значение {rank}' for rank in range(self.random.randint(3, 8))]
+                    if value_type == CharacteristicType.str else [],
+                })
+
+        def characteristic(number: int) -> CategoryCharacteristic:
+            spec = specs[number]
+            return CategoryCharacteristic(category_id=spec['category_id'], name=spec['name'],
+                                          description='-', value_type=spec['value_type'],
+                                          comparator=spec['comparator'])
+
+        ids = self.bulk_insert(CategoryCharacteristic, len(specs), characteristic)
+        self.bulk_insert_rows(CategoryStringCharacteristicRating, (
+            CategoryStringCharacteristicRating(characteristic_id=characteristic_id, value=value,
+                                               rating=rating)
+            for characteristic_id, spec in zip(ids, specs)
+            for rating, value in enumerate(spec['ladder'], start=1)
+        ))
+
+        by_category: Dict[int, List[dict]] = {}
+        for characteristic_id, spec in zip(ids, specs):
+            spec['id'] = characteristic_id
+            by_category.setdefault(spec['category_id'], []).append(spec)
+        return by_category
+
+    def generate_value(self, spec: dict) -> str:
+        """
+        :param spec: описание характеристики
+        :return: значение характеристики товара в строковом виде
+        """
+        if spec['value_type'] == CharacteristicType.int:
+            return str(self.random.randint(spec['low'], spec['high']))
+        if spec['value_type'] == CharacteristicType.float:
+            return str(round(self.random.uniform(spec['low'], spec['high']), 2))
+        if spec['value_type'] == CharacteristicType.bool:
+            # Characteristic.get_value приводит строку через bool(): 'False' было бы истиной
+            return '1' if self.random.random() < 0.5 else ''
+        return self.random.choice(spec['ladder'])
+
+    def generate_products(self, total: int, categories: array, users: array) -> array:
+        """
+        :param total: количество товаров
+        :param categories: id категорий
+        :param users: id авторов
+        :return: id товаров
+        """
+        # Товар с номером n относится к категории n % len(categories)
+        return self.bulk_insert(Product, total, lambda number: Product(
+            title=f'Товар {self.run}-{number}', description='Сгенерированный товар',
+            category_id=categories[number % len(categories)],
+            author_id=users[self.random.randrange(len(users))],
+        ))
+
+    def generate_product_characteristics(self, products: array, categories: array,
+                                         characteristics: Dict[int, List[dict]]) -> None:
+        """
+        Значения всех характеристик категории для каждого товара
+
+        :param products: id товаров
+        :param categories: id категорий (товар n относится к категории n % len(categories))
+        :param characteristics: описания характеристик по категориям
+        """
+        self.insert_values(ProductCharacteristic, ['product', 'characteristic', 'value'], (
+            (product_id, spec['id'], self.generate_value(spec))
+            for number, product_id in enumerate(products)
+            for spec in characteristics.get(categories[number % len(categories)], [])
+        ))
+
+    def generate_rate_facts(self, total: int, products: array, users: array) -> None:
+        """
+        Оценки: у каждого товара случайное число оценивших (в среднем
+        оставшиеся оценки / оставшиеся товары, так что отклонения не копятся
+        к концу), оценившие выбираются без повторений. Даты оценок
+        распределены по последним RATE_FACT_DAYS дням. Агрегаты рейтингов
+        товаров считаются по ходу генерации и записываются одним проходом
+        """
+        now = timezone.now()
+        aggregates = []
+        adapt = connection.ops.adapt_datetimefield_value
+
+        def facts():
+            remaining = total
+            for number, product_id in enumerate(products):
+                left = len(products) - number
+                mean = remaining / left
+                drawn = int(self.random.expovariate(1 / mean)) if mean else 0
+                count = min(drawn, len(users), remaining)
+                # последние товары добирают остаток, чтобы оценок было ровно total
+                count = max(count, remaining - (left - 1) * len(users))
+                remaining -= count
+                ratings = self.random.choices(RATING_SCALE, RATING_WEIGHTS, k=count)
+                if count:
+                    aggregates.append(self.get_aggregates(product_id, ratings))
+                raters = self.random.sample(range(len(users)), count)
+                for user_number, rating in zip(raters, ratings):
+                    age = timedelta(seconds=self.random.randrange(RATE_FACT_DAYS * 86400))
+                    created_at = now - age
+                    yield users[user_number], product_id, rating, adapt(created_at)
+
+        self.insert_values(ProductRateFact, ['user', 'product', 'rating', 'created_at'], facts())
+        self.update_values(Product, AGGREGATE_FIELDS, iter(aggregates))
+
+    @staticmethod
+    def get_aggregates(product_id: int, ratings: List[int]) -> tuple:
+        """
+        :param product_id: id товара
+        :param ratings: все оценки товара
+        :return: значения AGGREGATE_FIELDS и id товара
+        """
+        rating = sum(ratings) / len(ratings)
+        histogram = [ratings.count(value) for value in RATING_SCALE]
+        return (rating, len(ratings), bayesian_score(rating, len(ratings)), *histogram, product_id)
+
+    def generate_reviews(self, total: int, products: array, categories_count: int,
+                         users: array) -> None:
+        """
+        Обзоры сравнивают два товара одной категории
+        """
+        def reviews():
+            for number in range(total):
+                first = self.random.randrange(len(products))
+                same_category = range(first % categories_count, len(products), categories_count)
+                if len(same_category) < 2:
+                    continue
+                second = first
+                while second == first:
+                    second = self.random.choice(same_category)
+                yield ComparingReview(name=f'Обзор {self.run}-{number}',
+                                      description='Сгенерированный обзор',
+                                      author_id=users[self.random.randrange(len(users))],
+                                      first_id=products[first], second_id=products[second])
+
+        self.bulk_insert_rows(ComparingReview, reviews())
+
+    def generate_stores(self, total: int) -> array:
+        """
+        :param total: количество магазинов
+        :return: id магазинов
+        """
+        return self.bulk_insert(Store, total, lambda number: Store(
+            name=f'Магазин {self.run}-{number}', address=f'Адрес {number}'
+        ))
+
+    def generate_store_links(self, total: int, products: array, stores: array) -> None:
+        """
+        Товары в магазинах: пара (товар, магазин) не повторяется
+        """
+        if not stores:
+            return
+        total = min(total, len(products) * len(stores))
+
+        def links():
+            # раунд r: каждый товар попадает в магазин со сдвигом r,
+            # так что в разных раундах магазины товара различны
+            offsets = [self.random.randrange(len(stores)) for _ in range(len(products))] \
+                if total > len(products) else None
+            order = list(range(len(products)))
+            self.random.shuffle(order)
+            for link in range(total):
+                round_number, position = divmod(link, len(products))
+                number = order[position]
+                offset = offsets[number] if offsets else self.random.randrange(len(stores))
+                yield products[number], stores[(offset + round_number) % len(stores)]
+
+        self.insert_values(StoreProduct, ['product', 'store'], links())
+
+    def count_related(self, products: array) -> None:
+        """
+        Счётчики обзоров и магазинов товаров пачками по диапазонам id
+        """
+        for numbers in self.chunks(len(products)):
+            with transaction.atomic():
+                Product.recount_counters(Product.all_objects.filter(
+                    id__gte=products[numbers[0]], id__lte=products[numbers[-1]]
+                ), ['review_count', 'store_count'])
+            self.stdout.write(f'Счётчики товаров: {numbers[-1] + 1} / {len(products)}')
@@ -0,0 +1,73 @@
+"""
+Импорт каталога товаров из CSV или JSONL
+"""
+
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.models import User, Store
+from main.product_import import FORMATS, ProductImporter, get_format, read_rows
+
+
+class Command(BaseCommand):
+    """
+    Импорт каталога товаров из файла:
+
+        python manage.py import_products products.csv --author manager --store 1
+
+    Формат (CSV или JSONL) определяется по расширению или --format,
+    см. main.product_import.read_rows. Строки с ошибками пропускаются
+    и выводятся с номерами строк файла, остальные импортируются.
+    Если файл не удаётся дочитать (не UTF-8, повреждённый CSV), команда
+    завершается с ошибкой, а строки до этого места остаются импортированными
+    """
+
+    help = 'Импортирует товары из CSV или JSONL пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--author', required=True, help='имя пользователя - автора товаров')
+        parser.add_argument('--store', type=int, default=None,
+                            help='id магазина, в котором товары сразу подтверждены')
+        parser.add_argument('--format', choices=FORMATS, default=None)
+        parser.add_argument('--chunk-size', type=int, default=2000)
+        parser.add_argument('--report', default=None, help='файл для отчёта в JSON')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or get_format(options['path'])
+        if file_format is None:
+            raise CommandError('Не удалось определить формат файла, укажите --format')
+        try:
+            author = User.objects.get(username=options['author'])
+        except User.DoesNotExist as error:
+            raise CommandError(f'Нет пользователя {options["author"]}') from error
+        store = None
+        if options['store'] is not None:
+            store = Store.objects.filter(id=options['store']).first()
+            if store is None:
+                raise CommandError(f'Нет магазина #{options["store"]}')
+
+        importer = ProductImporter(author, store, options['chunk_size'])
+        start = time.monotonic()
+        with open(options['path'], encoding='utf-8-sig', newline='') as file:
+            report = importer.run(read_rows(file, file_format))
+        elapsed = time.monotonic() - start
+
+        for error in report.errors:
+            message = '; '.join(error['errors'])
+            self.stdout.write(self.style.WARNING(f'Строка {error["line"]}: {message}'))
+        if report.failed > len(report.errors):
+            hidden = report.failed - len(report.errors)
+            self.stdout.write(self.style.WARNING(f'... и ещё {hidden} строк с ошибками'))
+        if options['report']:
+            with open(options['report'], 'w', encoding='utf-8') as file:
+                json.dump(report.as_dict(), file, ensure_ascii=False, indent=2)
+        summary = f'Создано товаров: {report.created}, строк с ошибками: {report.failed}, ' \
+                  f'{elapsed:.1f} с'
+        if report.file_error:
+            # уже созданные пачки остаются, повторный запуск создаст их ещё раз
+            raise CommandError(f'{summary}. Импорт прерван на строке {report.file_error["line"]}: '
+                               f'{report.file_error["error"]}')
+        self.stdout.write(self.style.SUCCESS(summary))
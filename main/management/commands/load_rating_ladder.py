@@ -0,0 +1,53 @@
+"""
+Загрузка рейтинговой шкалы строковой характеристики
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from main.models import CategoryCharacteristic, CategoryStringCharacteristicRating
+
+
+class Command(BaseCommand):
+    """
+    Загрузка или перестановка рейтинговой шкалы строковой характеристики
+
+    Значения передаются аргументами либо файлом (одно значение на строку)
+    в порядке возрастания рейтинга:
+
+        python manage.py load_rating_ladder 3 --file materials.txt
+        python manage.py load_rating_ladder 3 пластик металл --reorder
+    """
+
+    help = 'Заменяет рейтинговую шкалу строковой характеристики одной транзакцией'
+
+    def add_arguments(self, parser):
+        parser.add_argument('characteristic_id', type=int)
+        parser.add_argument('values', nargs='*', help='значения по возрастанию рейтинга')
+        parser.add_argument('--file', help='файл со значениями, одно на строку')
+        parser.add_argument('--reorder', action='store_true',
+                            help='только переставить существующие значения')
+
+    def handle(self, *args, **options):
+        try:
+            characteristic = CategoryCharacteristic.objects.get(id=options['characteristic_id'])
+        except CategoryCharacteristic.DoesNotExist as error:
+            raise CommandError('Характеристика не найдена') from error
+
+        values = list(options['values'])
+        if options['file']:
+            with open(options['file'], encoding='utf-8') as ladder_file:
+                values += [line.strip() for line in ladder_file if line.strip()]
+        if not values:
+            raise CommandError('Не указаны значения шкалы')
+
+        try:
+            if options['reorder']:
+                records = CategoryStringCharacteristicRating.reorder_ladder(characteristic, values)
+            else:
+                records = CategoryStringCharacteristicRating.replace_ladder(characteristic, values)
+        except ValueError as error:
+            raise CommandError(str(error)) from error
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Шкала "{characteristic.name}" обновлена: {len(records)} значений'
+        ))
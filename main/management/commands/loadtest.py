@@ -0,0 +1,379 @@
+"""
+Нагрузочный прогон по запущенному серверу с перцентилями времени ответа
+"""
+
+import json
+import math
+import random
+import threading
+import time
+from http.cookiejar import CookieJar
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urlsplit
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import Resolver404, resolve, reverse
+
+from main.models import User, Product, ComparingReview, ProductCategory, RATING_SCALE
+from main.views import CATALOG_SORT_FIELDS
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(values: List[float], rank: int) -> float:
+    """
+    :param values: отсортированные значения
+    :param rank: процентиль (0-100)
+    :return: значение процентиля по методу ближайшего ранга
+    """
+    if not values:
+        return 0.0
+    return values[max(math.ceil(rank / 100 * len(values)) - 1, 0)]
+
+
+class NoRedirectHandler(HTTPRedirectHandler):
+    """
+    Перенаправления не выполняются: каждый запрос замеряется отдельно
+    """
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class Results:
+    """
+    Замеры всех клиентов: время ответа по именам маршрутов
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies: Dict[str, List[float]] = {}
+        self.errors: Dict[str, int] = {}
+
+    def add(self, url_name: str, elapsed: float, success: bool) -> None:
+        """
+        :param url_name: имя маршрута
+        :param elapsed: время ответа в секундах
+        :param success: ответ без ошибки (код меньше 400)
+        """
+        with self._lock:
+            self.latencies.setdefault(url_name, []).append(elapsed)
+            self.errors.setdefault(url_name, 0)
+            if not success:
+                self.errors[url_name] += 1
+
+    def summary(self, duration: float) -> dict:
+        """
+        :param duration: длительность нагрузки в секундах
+        :return: пропускная способность и перцентили времени ответа (мс) по маршрутам
+        """
+        routes = {}
+        with self._lock:
+            for url_name, latencies in sorted(self.latencies.items()):
+                values = sorted(latencies)
+                routes[url_name] = {
+                    'requests': len(values),
+                    'errors': self.errors[url_name],
+                    'rps': round(len(values) / duration, 2),
+                    **{f'p{rank}_ms': round(percentile(values, rank) * 1000, 2)
+                       for rank in PERCENTILES},
+                    'max_ms': round(values[-1] * 1000, 2),
+                }
+        total = sum(route['requests'] for route in routes.values())
+        return {
+            'duration_s': round(duration, 2),
+            'requests': total,
+            'errors': sum(route['errors'] for route in routes.values()),
+            'rps': round(total / duration, 2),
+            'routes': routes,
+        }
+
+
+class Client:
+    """
+    Виртуальный пользователь: свои cookies (сессия и CSRF),
+    каждый запрос записывается в результаты под именем маршрута
+
+    :param base_url: адрес сервера
+    :param results: общие результаты
+    :param timeout: таймаут запроса в секундах
+    """
+
+    def __init__(self, base_url: str, results: Results, timeout: float):
+        self.base_url = base_url.rstrip('/')
+        self.results = results
+        self.timeout = timeout
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies), NoRedirectHandler)
+
+    def get_cookie(self, name: str) -> Optional[str]:
+        """
+        :param name: имя cookie
+        :return: значение cookie (None - cookie нет)
+        """
+        return next((cookie.value for cookie in self.cookies if cookie.name == name), None)
+
+    def request(self, path: str, data: Optional[dict] = None,
+                ajax: bool = False) -> Tuple[int, bytes]:
+        """
+        :param path: путь страницы (с параметрами)
+        :param data: поля формы для POST (токен CSRF добавляется сам)
+        :param ajax: запрос от JavaScript (заголовок X-Requested-With)
+        :return: код ответа и тело
+        """
+        headers = {'User-Agent': 'unicat-loadtest'}
+        if ajax:
+            headers['X-Requested-With'] = 'XMLHttpRequest'
+        body = None
+        if data is not None:
+            token = self.get_cookie('csrftoken') or ''
+            body = urlencode(dict(data, csrfmiddlewaretoken=token)).encode()
+            headers.update({'X-CSRFToken': token, 'Referer': self.base_url + path})
+
+        try:
+            url_name = resolve(urlsplit(path).path).url_name or 'unknown'
+        except Resolver404:
+            url_name = 'unknown'
+
+        request = Request(self.base_url + path, body, headers)
+        start = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=self.timeout) as response:
+                status, content = response.status, response.read()
+        except HTTPError as error:
+            status, content = error.code, error.read()
+        except (URLError, OSError):
+            status, content = 0, b''
+        self.results.add(url_name, time.perf_counter() - start, 0 < status < 400)
+        return status, content
+
+    def login(self, username: str, password: str) -> bool:
+        """
+        :return: удалось ли войти (форма входа перенаправляет после успеха)
+        """
+        login = reverse('login')
+        self.request(login)
+        status, _ = self.request(login, {'username': username, 'password': password})
+        return status == 302
+
+
+class Dataset:
+    """
+    Объекты для сценариев: id товаров, обзоров и категорий и слова
+    из названий товаров для поиска. Берутся из той же БД, с которой
+    работает сервер
+    """
+
+    SAMPLE_SIZE = 1000
+
+    def __init__(self):
+        def sample(queryset) -> List[int]:
+            return list(queryset.values_list('id', flat=True)[:self.SAMPLE_SIZE])
+
+        self.products = sample(Product.objects.order_by('?'))
+        self.reviews = sample(ComparingReview.objects.order_by('?'))
+        self.categories = sample(ProductCategory.objects.all())
+        titles = Product.objects.filter(id__in=self.products[:100]).values_list('title', flat=True)
+        words = {word for title in titles for word in title.split() if len(word) > 2}
+        self.words = sorted(words) or ['a']
+
+
+def browse_catalog(client: Client, data: Dataset, rng: random.Random) -> None:
+    """
+    Каталог, каталог категории с сортировкой и страница товара
+
+    :param client: посетитель
+    :param data: объекты для сценариев
+    :param rng: генератор случайных чисел посетителя
+    """
+    client.request(reverse('catalog'))
+    if data.categories:
+        client.request(reverse('catalog') + '?' + urlencode({
+            'category': rng.choice(data.categories),
+            'sort_filter': rng.choice(sorted(CATALOG_SORT_FIELDS)),
+        }))
+    client.request(reverse('product_page', kwargs={'product_id': rng.choice(data.products)}))
+
+
+def search_as_you_type(client: Client, data: Dataset, rng: random.Random) -> None:
+    """
+    Подсказки поиска на каждую набранную букву, затем результаты поиска
+    """
+    word = rng.choice(data.words)
+    for length in range(1, min(len(word), 5) + 1):
+        client.request(reverse('search') + '?' + urlencode({'input_value': word[:length]}),
+                       ajax=True)
+    client.request(reverse('search_results') + '?' + urlencode({'title': word}))
+
+
+def view_product(client: Client, data: Dataset, rng: random.Random) -> None:
+    """
+    Страница случайного товара
+    """
+    client.request(reverse('product_page', kwargs={'product_id': rng.choice(data.products)}))
+
+
+def rate_product(client: Client, data: Dataset, rng: random.Random) -> None:
+    """
+    Страница товара и оценка товара
+    """
+    path = reverse('product_page', kwargs={'product_id': rng.choice(data.products)})
+    client.request(path)
+    client.request(path, {'rating': rng.choice(RATING_SCALE)})
+
+
+def read_reviews(client: Client, data: Dataset, rng: random.Random) -> None:
+    """
+    Список обзоров, обзор и его оценка (если посетитель вошёл)
+    """
+    client.request(reverse('catalog_reviews'))
+    if data.reviews:
+        path = reverse('comparing_review', kwargs={'rev_id': rng.choice(data.reviews)})
+        client.request(path)
+        if client.get_cookie('sessionid'):
+            client.request(path, {'rating': rng.choice(RATING_SCALE)})
+
+
+# Сценарий: (вес, нужен ли вход, функция)
+SCENARIOS: Dict[str, Tuple[int, bool, Callable[[Client, Dataset, random.Random], None]]] = {
+    'browse_catalog': (35, False, browse_catalog),
+    'search_as_you_type': (20, True, search_as_you_type),
+    'view_product': (25, False, view_product),
+    'rate_product': (10, True, rate_product),
+    'read_reviews': (10, False, read_reviews),
+}
+
+
+class Command(BaseCommand):
+    """
+    Нагрузочный прогон по запущенному серверу:
+
+        python manage.py loadtest --base-url http://127.0.0.1:8000 --clients 20 \
+            --duration 60 --password <пароль>
+
+    Каждый из --clients потоков - отдельный посетитель со своей сессией,
+    выполняющий случайные сценарии с весами из SCENARIOS. Половина
+    посетителей входит под тестовыми пользователями loadtest_<n>
+    (создаются в БД из настроек командой, пароль --password); сценарии,
+    требующие входа, анонимы не выполняют. При DEBUG = False, то есть
+    в рабочей БД, пользователи создаются только с --allow-production.
+    Итог - пропускная способность и p50/p95/p99 времени ответа по именам
+    маршрутов, таблицей и в JSON
+    """
+
+    help = 'Нагружает сервер взвешенными сценариями и выводит перцентили времени ответа'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--clients', type=int, default=10)
+        parser.add_argument('--duration', type=float, default=30, help='секунд')
+        parser.add_argument('--timeout', type=float, default=30, help='таймаут запроса, секунд')
+        parser.add_argument('--password', required=True,
+                            help='пароль тестовых пользователей loadtest_<n>')
+        parser.add_argument('--allow-production', action='store_true',
+                            help='создавать тестовых пользователей при DEBUG = False')
+        parser.add_argument('--anonymous-share', type=float, default=0.5,
+                            help='доля посетителей без входа')
+        parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                            help='выполнять только эти сценарии')
+        parser.add_argument('--json', dest='json_path', default=None,
+                            help='файл для итогов в JSON ("-" - вывести)')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        data = Dataset()
+        if not data.products:
+            raise CommandError('В БД нет товаров: сначала выполните generate_dataset')
+
+        scenarios = {name: SCENARIOS[name] for name in options['scenario'] or SCENARIOS}
+        rng = random.Random(options['seed'])
+        authenticated = [rng.random() >= options['anonymous_share']
+                         for _ in range(options['clients'])]
+        if any(authenticated) and not settings.DEBUG and not options['allow_production']:
+            raise CommandError('DEBUG = False: тестовые пользователи создаются в рабочей БД. '
+                               'Укажите --allow-production или --anonymous-share 1')
+        users = self.ensure_users(sum(authenticated), options['password'])
+
+        results = Results()
+        deadline = time.monotonic() + options['duration']
+        users_iter = iter(users)
+        threads = [
+            threading.Thread(target=self.run_client, daemon=True, args=(
+                options, data, scenarios, results, deadline,
+                next(users_iter) if is_authenticated else None, rng.getrandbits(32),
+            ))
+            for is_authenticated in authenticated
+        ]
+        start = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        summary = results.summary(max(time.monotonic() - start, 1e-9))
+        if options['json_path'] != '-':
+            self.write_table(summary)
+        if options['json_path']:
+            report = json.dumps(summary, ensure_ascii=False, indent=2)
+            if options['json_path'] == '-':
+                self.stdout.write(report)
+            else:
+                with open(options['json_path'], 'w', encoding='utf-8') as file:
+                    file.write(report)
+
+    @staticmethod
+    def ensure_users(count: int, password: str) -> List[str]:
+        """
+        :param count: количество тестовых пользователей
+        :param password: пароль
+        :return: имена пользователей loadtest_<n> с этим паролем
+        """
+        usernames = [f'loadtest_{number}' for number in range(count)]
+        for username in usernames:
+            user, _ = User.objects.get_or_create(username=username)
+            if not user.check_password(password):
+                user.set_password(password)
+                user.save(update_fields=['password'])
+        return usernames
+
+    @staticmethod
+    def run_client(options: dict, data: Dataset, scenarios: dict, results: Results,
+                   deadline: float, username: Optional[str], seed: int) -> None:
+        """
+        Поток посетителя: вход (если задан пользователь) и случайные
+        сценарии до deadline
+
+        :param username: пользователь для входа (None - аноним)
+        :param seed: начальное значение генератора случайных чисел посетителя
+        """
+        client = Client(options['base_url'], results, options['timeout'])
+        if username is not None and not client.login(username, options['password']):
+            username = None
+        rng = random.Random(seed)
+        available = [(weight, run) for weight, needs_login, run in scenarios.values()
+                     if username is not None or not needs_login]
+        if not available:
+            return
+        weights = [weight for weight, _ in available]
+        while time.monotonic() < deadline:
+            rng.choices(available, weights)[0][1](client, data, rng)
+
+    def write_table(self, summary: dict) -> None:
+        """
+        :param summary: итоги прогона (Results.summary)
+        """
+        header = f'{"маршрут":<28}{"запросов":>10}{"ошибок":>8}{"rps":>9}' + ''.join(
+            f'{f"p{rank}, мс":>11}' for rank in PERCENTILES) + f'{"max, мс":>11}'
+        self.stdout.write(header)
+        self.stdout.write('-' * len(header))
+        for url_name, route in summary['routes'].items():
+            latencies = [route[f'p{rank}_ms'] for rank in PERCENTILES] + [route['max_ms']]
+            self.stdout.write(f'{url_name:<28}{route["requests"]:>10}{route["errors"]:>8}'
+                              f'{route["rps"]:>9.2f}'
+                              f'{"".join(f"{latency:>11.2f}" for latency in latencies)}')
+        self.stdout.write('-' * len(header))
+        self.stdout.write(f'Всего: {summary["requests"]} запросов за {summary["duration_s"]} с, '
+                          f'{summary["rps"]} rps, ошибок {summary["errors"]}')
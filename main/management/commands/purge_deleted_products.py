@@ -0,0 +1,37 @@
+"""
+Удаление из БД строк мягко удалённых товаров
+"""
+
+from django.core.management.base import BaseCommand
+
+from main.models import Product
+
+
+class Command(BaseCommand):
+    """
+    Удаление строк мягко удалённых товаров и всех зависимых таблиц
+    пачками: каждая пачка - отдельная короткая транзакция, как у фонового
+    потока PRODUCT_PURGER. Команду можно прервать и перезапустить
+    """
+
+    help = 'Удаляет из БД удалённые товары и их обзоры, оценки, изображения ' \
+           'и характеристики пачками'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=None,
+                            help='строк в пачке (по умолчанию PRODUCT_PURGE_CHUNK_SIZE)')
+        parser.add_argument('--max-chunks', type=int, default=None,
+                            help='ограничить количество пачек за один запуск')
+
+    def handle(self, *args, **options):
+        deleted = chunks = 0
+        while options['max_chunks'] is None or chunks < options['max_chunks']:
+            count = Product.purge_deleted_chunk(options['chunk_size'])
+            if count == 0:
+                break
+            deleted += count
+            chunks += 1
+        remaining = Product.all_objects.filter(deleted_at__isnull=False).count()
+        self.stdout.write(self.style.SUCCESS(
+            f'Удалено строк: {deleted}, пачек: {chunks}, осталось удалённых товаров: {remaining}'
+        ))
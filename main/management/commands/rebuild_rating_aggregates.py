@@ -0,0 +1,164 @@
+"""
+Пересчёт агрегатов рейтинга по фактам оценки
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections, transaction
+from django.db.models import Count, Q, Min, Max, Sum
+
+from main.models import Product, ComparingReview, ProductRateFact, ReviewRateFact, \
+    RATING_SCALE, bayesian_score
+
+AGGREGATE_FIELDS = ['rating', 'user_rated', 'score'] + \
+    [f'rated_{rating}' for rating in RATING_SCALE]
+
+TARGETS = {
+    'products': (Product, ProductRateFact),
+    'reviews': (ComparingReview, ReviewRateFact),
+}
+
+
+def init_worker():
+    """
+    Инициализация процесса-обработчика. Соединения родителя закрываются
+    перед запуском пула, так что каждый процесс открывает свои
+    """
+    django.setup()
+
+
+def compute_range(target: str, id_range: Tuple[int, int], lock: bool = False) -> List[Dict]:
+    """
+    Пересчёт агрегатов для объектов с id в диапазоне [start, end)
+    по рабочим фактам и сводкам архивных
+
+    :param target: 'products' или 'reviews'
+    :param id_range: диапазон id
+    :param lock: заблокировать строки объектов до конца транзакции
+        (select_for_update) до чтения фактов - для пересчёта с записью
+    :return: строки, в которых сохранённые агрегаты расходятся с фактами:
+        {'id': ..., 'old': {...}, 'new': {...}}
+    """
+    model, fact_model = TARGETS[target]
+    target_id = f'{fact_model.TARGET_FIELD}_id'
+    start, end = id_range
+
+    # Агрегаты читаются первыми: с блокировкой параллельная оценка ждёт
+    # конца транзакции и добавляет свою оценку уже к пересчитанным значениям
+    stored = model.objects.filter(id__gte=start, id__lt=end)
+    if lock:
+        stored = stored.select_for_update()
+    stored = list(stored.values('id', *AGGREGATE_FIELDS))
+
+    id_filter = {f'{target_id}__gte': start, f'{target_id}__lt': end}
+    # рабочие факты считаются по значениям, архивные - суммой дневных сводок
+    live = fact_model.objects.filter(**id_filter).values(target_id).annotate(**{
+        f'count_{rating}': Count('id', filter=Q(rating=rating)) for rating in RATING_SCALE
+    })
+    archived = fact_model.ROLLUP_MODEL.objects.filter(**id_filter).values(target_id).annotate(**{
+        f'count_{rating}': Sum(f'rated_{rating}') for rating in RATING_SCALE
+    })
+
+    histograms = {}
+    for rows in (live, archived):
+        for row in rows:
+            histogram = histograms.setdefault(row[target_id], dict.fromkeys(RATING_SCALE, 0))
+            for rating in RATING_SCALE:
+                histogram[rating] += row[f'count_{rating}']
+
+    corrected = []
+    for old in stored:
+        histogram = histograms.get(old['id'], dict.fromkeys(RATING_SCALE, 0))
+        count = sum(histogram.values())
+        rating = sum(value * rated for value, rated in histogram.items()) / count if count else 0.0
+        new = {
+            'rating': rating,
+            'user_rated': count,
+            'score': bayesian_score(rating, count),
+        }
+        new.update({f'rated_{value}': rated for value, rated in histogram.items()})
+        old_values = {field: old[field] for field in AGGREGATE_FIELDS}
+        if any(abs(new[field] - old_values[field]) > 1e-9 for field in AGGREGATE_FIELDS):
+            corrected.append({'id': old['id'], 'old': old_values, 'new': new})
+    return corrected
+
+
+class Command(BaseCommand):
+    """
+    Пересчёт рейтингов товаров и обзоров по фактам оценки.
+    Объекты обрабатываются диапазонами id: для каждого диапазона
+    агрегаты считаются группирующим запросом, а исправления
+    записываются через bulk_update в той же транзакции, что и подсчёт,
+    поэтому оценки, пришедшие во время пересчёта, не перезаписываются.
+    Диапазоны можно проверять в нескольких процессах (--workers): они
+    только находят диапазоны с расхождениями, а пересчёт с записью
+    выполняет основной процесс, чтобы не конкурировать за блокировку SQLite.
+
+    Оценки из буфера попадают в агрегаты только после сброса, поэтому
+    при включённом буфере оценок лучше предварительно выполнить flush_ratings
+    """
+
+    help = 'Пересчитывает агрегаты рейтингов по фактам оценки и сообщает об исправлениях'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='размер диапазона id')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='количество процессов для подсчёта')
+        parser.add_argument('--only', choices=sorted(TARGETS), default=None)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='только показать расхождения')
+
+    def handle(self, *args, **options):
+        targets = [options['only']] if options['only'] else sorted(TARGETS)
+        for target in targets:
+            corrected = self.rebuild(target, options)
+            verb = 'Найдено расхождений' if options['dry_run'] else 'Исправлено'
+            self.stdout.write(self.style.SUCCESS(f'{target}: {verb} {corrected}'))
+
+    def rebuild(self, target: str, options: dict) -> int:
+        """
+        :param target: 'products' или 'reviews'
+        :param options: параметры команды
+        :return: количество расхождений
+        """
+        model, _ = TARGETS[target]
+        bounds = model.objects.aggregate(start=Min('id'), end=Max('id'))
+        if bounds['start'] is None:
+            return 0
+        chunk_size = options['chunk_size']
+        ranges = [(start, start + chunk_size)
+                  for start in range(bounds['start'], bounds['end'] + 1, chunk_size)]
+
+        if options['workers'] > 1:
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options['workers'],
+                                     initializer=init_worker) as executor:
+                results = executor.map(compute_range, [target] * len(ranges), ranges)
+                ranges = [id_range for id_range, rows in zip(ranges, results) if rows]
+        return sum(self.apply(target, id_range, options['dry_run']) for id_range in ranges)
+
+    def apply(self, target: str, id_range: Tuple[int, int], dry_run: bool) -> int:
+        """
+        Пересчёт диапазона и запись исправлений одной транзакцией
+
+        :param target: 'products' или 'reviews'
+        :param id_range: диапазон id
+        :param dry_run: только вывести расхождения
+        :return: количество расхождений
+        """
+        model, _ = TARGETS[target]
+        with transaction.atomic():
+            rows = compute_range(target, id_range, lock=not dry_run)
+            for row in rows:
+                changes = ', '.join(f'{field} {row["old"][field]} -> {row["new"][field]}'
+                                    for field in AGGREGATE_FIELDS
+                                    if row['old'][field] != row['new'][field])
+                self.stdout.write(f'{model.__name__} #{row["id"]}: {changes}')
+            if rows and not dry_run:
+                objects = [model(id=row['id'], **row['new']) for row in rows]
+                model.objects.bulk_update(objects, AGGREGATE_FIELDS)
+        return len(rows)
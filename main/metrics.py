@@ -0,0 +1,303 @@
+"""
+Метрики в текстовом формате Prometheus (страница /metrics)
+
+Метрики хранятся в памяти процесса: при нескольких процессах
+сервера Prometheus опрашивает каждый процесс отдельно
+"""
+
+import hmac
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Sequence, Tuple
+
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache as BaseLocMemCache
+from django.template import TemplateDoesNotExist
+from django.template.backends.django import DjangoTemplates as BaseDjangoTemplates, \
+    Template as BaseTemplate, reraise
+
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200)
+
+REGISTRY: List['Metric'] = []
+
+Sample = Tuple[str, Dict[str, str], float]
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    """
+    :param labels: метки
+    :return: метки в формате {name="value",...}
+    """
+    if not labels:
+        return ''
+    escaped = (
+        str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        for value in labels.values()
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in zip(labels, escaped)) + '}'
+
+
+class Metric:
+    """
+    Метрика с набором меток
+
+    :param name: имя метрики
+    :param documentation: описание
+    :param labelnames: имена меток
+    """
+
+    type = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def get_key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        """
+        :param labels: метки {имя: значение}
+        :return: значения меток в порядке labelnames
+        """
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> Iterable[Sample]:
+        """
+        :return: значения метрики: (суффикс имени, метки, значение)
+        """
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        """
+        :return: строки метрики в текстовом формате Prometheus
+        """
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for suffix, labels, value in self.samples():
+            lines.append(f'{self.name}{suffix}{format_labels(labels)} {value:g}')
+        return lines
+
+
+class Counter(Metric):
+    """
+    Монотонно растущий счётчик
+    """
+
+    type = 'counter'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        """
+        :param amount: на сколько увеличить счётчик
+        :param labels: метки
+        """
+        key = self.get_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield '_total', dict(zip(self.labelnames, key)), value
+
+
+class Histogram(Metric):
+    """
+    Гистограмма с фиксированными границами корзин
+
+    :param buckets: верхние границы корзин по возрастанию
+    """
+
+    type = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+        self._values: Dict[Tuple[str, ...], List[float]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        """
+        :param value: наблюдаемое значение
+        :param labels: метки
+        """
+        key = self.get_key(labels)
+        with self._lock:
+            # счётчики корзин (без +Inf), сумма и количество
+            counts = self._values.setdefault(key, [0] * len(self.buckets) + [0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    def samples(self) -> Iterable[Sample]:
+        with self._lock:
+            values = {key: list(counts) for key, counts in self._values.items()}
+        for key, counts in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, counts):
+                yield '_bucket', dict(labels, le=f'{bound:g}'), count
+            yield '_bucket', dict(labels, le='+Inf'), counts[-1]
+            yield '_sum', labels, counts[-2]
+            yield '_count', labels, counts[-1]
+
+
+class Gauge(Metric):
+    """
+    Значение, вычисляемое в момент опроса
+
+    :param callback: функция, возвращающая {значения меток: значение}
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str],
+                 callback: Callable[[], Dict[Tuple[str, ...], float]]):
+        super().__init__(name, documentation, labelnames)
+        self.callback = callback
+
+    def samples(self) -> Iterable[Sample]:
+        for key, value in self.callback().items():
+            yield '', dict(zip(self.labelnames, key)), value
+
+
+def can_read_metrics(request) -> bool:
+    """
+    Метрики видны модераторам и по заголовку Authorization: Bearer <METRICS_TOKEN>
+    (bearer_token в настройках Prometheus). Адреса из METRICS_ALLOWED_IPS
+    пускаются без токена, список пуст по умолчанию: за обратным прокси
+    REMOTE_ADDR у всех запросов - адрес прокси
+
+    :param request: объект с деталями запроса
+    :return: можно ли показать метрики
+    """
+    if request.user.is_staff:
+        return True
+    token = settings.METRICS_TOKEN
+    header = request.headers.get('Authorization', '')
+    if token and hmac.compare_digest(header, f'Bearer {token}'):
+        return True
+    return request.META.get('REMOTE_ADDR') in settings.METRICS_ALLOWED_IPS
+
+
+def render_metrics() -> str:
+    """
+    :return: все метрики в текстовом формате Prometheus
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+REQUEST_DURATION = Histogram('unicat_http_request_duration_seconds',
+                             'Время обработки запроса', ['url_name', 'method'])
+REQUESTS = Counter('unicat_http_requests', 'Количество запросов',
+                   ['url_name', 'method', 'status'])
+DB_QUERIES = Histogram('unicat_db_queries_per_request', 'Количество запросов к БД на запрос',
+                       ['url_name'], buckets=QUERY_COUNT_BUCKETS)
+DB_DURATION = Histogram('unicat_db_duration_seconds', 'Время запросов к БД на запрос',
+                        ['url_name'])
+TEMPLATE_DURATION = Histogram('unicat_template_render_seconds', 'Время отрисовки шаблона',
+                              ['template'])
+CACHE_REQUESTS = Counter('unicat_cache_requests', 'Обращения к кэшу', ['cache', 'result'])
+
+
+def get_cache_hit_ratio() -> Dict[Tuple[str, ...], float]:
+    """
+    :return: доля попаданий по кэшам {(кэш,): доля}
+    """
+    totals: Dict[str, List[float]] = {}
+    for _, labels, value in CACHE_REQUESTS.samples():
+        hits_and_total = totals.setdefault(labels['cache'], [0, 0])
+        hits_and_total[0] += value if labels['result'] == 'hit' else 0
+        hits_and_total[1] += value
+    return {(cache,): hits / total for cache, (hits, total) in totals.items() if total}
+
+
+def get_buffer_sizes() -> Dict[Tuple[str, ...], float]:
+    """
+    :return: количество записей, ещё не сброшенных в БД, по буферам {(буфер,): записей}
+    """
+    from main.models import PendingProductRating, PendingReviewRating
+    from main.view_counter import VIEW_COUNTER
+
+    return {
+        ('views',): VIEW_COUNTER.size(),
+        ('product_ratings',): PendingProductRating.objects.count(),
+        ('review_ratings',): PendingReviewRating.objects.count(),
+    }
+
+
+def get_unique_visitors() -> Dict[Tuple[str, ...], float]:
+    """
+    Скетч берётся из счётчика просмотров процесса, а не собирается
+    из всех дневных скетчей на каждый опрос
+
+    :return: {('today',): оценка уникальных посетителей за сегодня}
+    """
+    from main.view_counter import VIEW_COUNTER
+
+    return {('today',): VIEW_COUNTER.visitors_today().count()}
+
+
+Gauge('unicat_cache_hit_ratio', 'Доля попаданий в кэш', ['cache'], get_cache_hit_ratio)
+Gauge('unicat_buffer_pending', 'Записи в буферах, ещё не сброшенные в БД', ['buffer'],
+      get_buffer_sizes)
+Gauge('unicat_unique_visitors', 'Уникальные посетители товаров (оценка HyperLogLog)', ['period'],
+      get_unique_visitors)
+
+
+class LocMemCache(BaseLocMemCache):
+    """
+    Кэш в памяти процесса с учётом попаданий и промахов
+    """
+
+    _missing = object()
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self.location = name or 'default'
+
+    def get(self, key, default=None, version=None):
+        value = super().get(key, self._missing, version)
+        hit = value is not self._missing
+        CACHE_REQUESTS.inc(cache=self.location, result='hit' if hit else 'miss')
+        return value if hit else default
+
+
+class Template(BaseTemplate):
+    """
+    Шаблон с замером времени отрисовки
+    """
+
+    def render(self, context=None, request=None):
+        start = time.perf_counter()
+        try:
+            return super().render(context, request)
+        finally:
+            TEMPLATE_DURATION.observe(time.perf_counter() - start,
+                                      template=self.template.name or 'string')
+
+
+class DjangoTemplates(BaseDjangoTemplates):
+    """
+    Шаблонизатор Django с замером времени отрисовки шаблонов страниц
+    (вложенные через include шаблоны входят во время страницы)
+    """
+
+    def from_string(self, template_code):
+        return Template(self.engine.from_string(template_code), self)
+
+    def get_template(self, template_name):
+        try:
+            return Template(self.engine.get_template(template_name), self)
+        except TemplateDoesNotExist as exc:
+            reraise(exc, self)
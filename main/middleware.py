@@ -0,0 +1,232 @@
+"""
+Промежуточные обработчики запросов
+"""
+
+import cProfile
+import logging
+import threading
+import time
+from contextlib import ExitStack
+from typing import Dict, Optional
+
+from django.conf import settings
+from django.db import connections
+
+from main.db import use_primary, reset_primary, track_writes, has_written
+from main.flusher import is_flushing
+from main.metrics import REQUEST_DURATION, REQUESTS, DB_QUERIES, DB_DURATION
+from main.profiling import should_profile, save_profile
+from main.slow_queries import QueryTimer, SlowQueryRecorder
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(Exception):
+    """
+    Страница сделала больше запросов к БД (или потратила на них больше
+    времени), чем разрешено QUERY_BUDGETS
+    """
+
+
+class QueryStats(QueryTimer):
+    """
+    Счётчик запросов к БД для connection.execute_wrapper. Запросы сброса
+    буферов, выполненного прямо в запросе, считаются отдельно: обычно
+    сброс идёт в фоновом потоке и страница за него не платит
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.time = 0.0
+        self.flush_count = 0
+
+    def on_query(self, query: tuple, elapsed: float) -> None:
+        if is_flushing():
+            self.flush_count += 1
+        else:
+            self.count += 1
+            self.time += elapsed
+
+
+def get_query_budget(url_name: Optional[str]) -> Dict[str, float]:
+    """
+    :param url_name: имя маршрута
+    :return: {'queries': количество запросов, 'time_ms': время запросов в мс}
+    """
+    budget = dict(settings.QUERY_BUDGET_DEFAULT)
+    budget.update(settings.QUERY_BUDGETS.get(url_name, {}))
+    return budget
+
+
+def check_query_budget(url_name: Optional[str], stats: QueryStats) -> None:
+    """
+    Сравнение запросов страницы с её бюджетом. Превышение пишется в лог,
+    а при QUERY_BUDGET_ACTION = 'raise' превышение числа запросов выбрасывает
+    исключение (время зависит от машины, поэтому только пишется в лог)
+
+    :param url_name: имя маршрута
+    :param stats: запросы, сделанные при обработке страницы
+    :raises QueryBudgetExceeded: превышено число запросов и QUERY_BUDGET_ACTION = 'raise'
+    """
+    budget = get_query_budget(url_name)
+    time_ms = stats.time * 1000
+    too_many = stats.count > budget['queries']
+    if not too_many and time_ms <= budget['time_ms']:
+        return
+
+    message = (f'Страница {url_name}: {stats.count} запросов за {time_ms:.1f} мс, '
+               f'бюджет {budget["queries"]} запросов за {budget["time_ms"]} мс')
+    if stats.flush_count:
+        message += f' (и {stats.flush_count} запросов сброса буферов)'
+    if too_many and settings.QUERY_BUDGET_ACTION == 'raise':
+        raise QueryBudgetExceeded(message)
+    logger.warning(message)
+
+
+class QueryBudgetMiddleware:
+    """
+    Проверка бюджета запросов к БД для каждой страницы (см. QUERY_BUDGETS).
+    Учитываются запросы ко всем подключениям, сделанные внутри обработки
+    запроса, включая отрисовку шаблона
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.QUERY_BUDGET_ACTION:
+            return self.get_response(request)
+
+        stats = QueryStats()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        if match is not None and match.url_name:
+            check_query_budget(match.url_name, stats)
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Профилирование запроса cProfile по заголовку X-Profile-Token или
+    для случайной доли запросов (см. main.profiling). Одновременно
+    профилируется не больше одного запроса в процессе: профилировщик
+    замедляет обработку, а параллельные профили смешивались бы
+    """
+
+    _lock = threading.Lock()
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not should_profile(request) or not self._lock.acquire(blocking=False):
+            return self.get_response(request)
+
+        try:
+            profiler = cProfile.Profile()
+            start = time.perf_counter()
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+            elapsed = time.perf_counter() - start
+        finally:
+            self._lock.release()
+
+        try:
+            save_profile(profiler, request, elapsed)
+        except OSError:
+            logger.exception('Не удалось сохранить профиль запроса %s', request.path)
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Учёт времени обработки, количества и времени запросов к БД
+    для каждой страницы (см. main.metrics)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        start = time.perf_counter()
+        status = 500
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(stats))
+                response = self.get_response(request)
+            status = response.status_code
+            return response
+        finally:
+            match = request.resolver_match
+            url_name = match.url_name if match is not None and match.url_name else 'unknown'
+            REQUEST_DURATION.observe(time.perf_counter() - start,
+                                     url_name=url_name, method=request.method)
+            REQUESTS.inc(url_name=url_name, method=request.method, status=status)
+            DB_QUERIES.observe(stats.count, url_name=url_name)
+            DB_DURATION.observe(stats.time, url_name=url_name)
+
+
+class SlowQueryMiddleware:
+    """
+    Запись медленных запросов к БД в журнал (см. main.slow_queries)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.SLOW_QUERY_THRESHOLD_MS is None:
+            return self.get_response(request)
+
+        recorder = SlowQueryRecorder(request)
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(recorder))
+            return self.get_response(request)
+
+
+class ReplicaStickinessMiddleware:
+    """
+    Чтение своих записей при репликах (см. main.db.ReadReplicaRouter):
+    после запроса с записью в БД (или любого POST) посетитель получает
+    cookie REPLICA_STICKY_COOKIE и REPLICA_STICKY_SECONDS читает
+    только из основной БД. Подделка cookie лишь переводит чтение
+    посетителя в основную БД
+    """
+
+    SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS', 'TRACE')
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+
+        try:
+            sticky = float(request.COOKIES.get(settings.REPLICA_STICKY_COOKIE, 0)) > time.time()
+        except ValueError:
+            sticky = False
+        primary_token = use_primary(sticky)
+        writes_token = track_writes()
+        try:
+            response = self.get_response(request)
+        finally:
+            wrote = has_written(writes_token)
+            reset_primary(primary_token)
+
+        if wrote or request.method not in self.SAFE_METHODS:
+            response.set_cookie(settings.REPLICA_STICKY_COOKIE,
+                                str(int(time.time() + settings.REPLICA_STICKY_SECONDS)),
+                                max_age=settings.REPLICA_STICKY_SECONDS, httponly=True,
+                                samesite='Lax')
+        return response
@@ -0,0 +1,38 @@
+# Generated by Django 4.0.2 on 2026-10-19 13:44
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def remove_duplicate_facts(apps, schema_editor):
+    """
+    Оставляем только первую оценку пользователя, иначе ограничение не создастся
+    """
+    for model_name, target in (('ProductRateFact', 'product'), ('ReviewRateFact', 'review')):
+        model = apps.get_model('main', model_name)
+        duplicates = model.objects.values('user', target).annotate(
+            first_id=Min('id'), facts=Count('id')
+        ).filter(facts__gt=1)
+        for duplicate in duplicates:
+            model.objects.filter(
+                user=duplicate['user'], **{target: duplicate[target]}
+            ).exclude(id=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0023_updatingviews_product_views'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_facts, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='productratefact',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_product_rate_fact'),
+        ),
+        migrations.AddConstraint(
+            model_name='reviewratefact',
+            constraint=models.UniqueConstraint(fields=('user', 'review'), name='unique_review_rate_fact'),
+        ),
+    ]
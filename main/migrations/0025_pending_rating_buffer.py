@@ -0,0 +1,43 @@
+# Generated by Django 4.0.2 on 2026-10-19 13:46
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0024_rate_fact_unique_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingReviewRating',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('review', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.comparingreview')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PendingProductRating',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating', models.IntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.product')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='pendingreviewrating',
+            constraint=models.UniqueConstraint(fields=('user', 'review'), name='unique_pending_review_rating'),
+        ),
+        migrations.AddConstraint(
+            model_name='pendingproductrating',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_pending_product_rating'),
+        ),
+    ]
@@ -0,0 +1,103 @@
+# Generated by Django 4.0.2 on 2026-10-19 13:47
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def fill_histograms(apps, schema_editor):
+    """
+    Гистограммы по существующим фактам и байесовская оценка по текущему рейтингу
+    """
+    weight = settings.RATING_PRIOR_WEIGHT
+    for model_name, fact_name, target in (('Product', 'ProductRateFact', 'product'),
+                                          ('ComparingReview', 'ReviewRateFact', 'review')):
+        model = apps.get_model('main', model_name)
+        fact_model = apps.get_model('main', fact_name)
+        histograms = {}
+        for row in fact_model.objects.values(target, 'rating').annotate(rated=Count('id')):
+            if 1 <= row['rating'] <= 5:
+                histograms.setdefault(row[target], {})[f'rated_{row["rating"]}'] = row['rated']
+
+        objects = list(model.objects.all())
+        for obj in objects:
+            for field, rated in histograms.get(obj.id, {}).items():
+                setattr(obj, field, rated)
+            if obj.user_rated:
+                obj.score = (weight * settings.RATING_PRIOR_MEAN + obj.rating * obj.user_rated) \
+                    / (weight + obj.user_rated)
+        model.objects.bulk_update(
+            objects, ['rated_1', 'rated_2', 'rated_3', 'rated_4', 'rated_5', 'score'],
+            batch_size=500
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0025_pending_rating_buffer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comparingreview',
+            name='rated_1',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comparingreview',
+            name='rated_2',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comparingreview',
+            name='rated_3',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comparingreview',
+            name='rated_4',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comparingreview',
+            name='rated_5',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='comparingreview',
+            name='score',
+            field=models.FloatField(db_index=True, default=0.0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rated_1',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rated_2',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rated_3',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rated_4',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rated_5',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='score',
+            field=models.FloatField(db_index=True, default=0.0),
+        ),
+        migrations.RunPython(fill_histograms, migrations.RunPython.noop),
+    ]
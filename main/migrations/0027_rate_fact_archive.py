@@ -0,0 +1,116 @@
+# Generated by Django 4.0.2 on 2026-10-19 13:49
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models import OuterRef, Subquery
+
+
+def fill_created_at(apps, schema_editor):
+    """
+    Время существующих оценок неизвестно. Вместо времени миграции им ставится
+    время создания товара или обзора - самое раннее, когда оценка могла появиться:
+    так старые оценки не выглядят свежими и архивируются по возрасту,
+    а не все разом через --older-than-days дней после миграции
+    """
+    for fact_name, target_name, target_field in (('ProductRateFact', 'Product', 'product'),
+                                                 ('ReviewRateFact', 'ComparingReview', 'review')):
+        targets = apps.get_model('main', target_name).objects.filter(pk=OuterRef(target_field))
+        apps.get_model('main', fact_name).objects.update(
+            created_at=Subquery(targets.values('created_at')[:1])
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0026_rating_histogram_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productratefact',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='reviewratefact',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, db_index=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(fill_created_at, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='UserRatingSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archived_product_rates', models.IntegerField(default=0)),
+                ('archived_review_rates', models.IntegerField(default=0)),
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ReviewRatingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('rated_1', models.IntegerField(default=0)),
+                ('rated_2', models.IntegerField(default=0)),
+                ('rated_3', models.IntegerField(default=0)),
+                ('rated_4', models.IntegerField(default=0)),
+                ('rated_5', models.IntegerField(default=0)),
+                ('review', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.comparingreview')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ProductRatingRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('rated_1', models.IntegerField(default=0)),
+                ('rated_2', models.IntegerField(default=0)),
+                ('rated_3', models.IntegerField(default=0)),
+                ('rated_4', models.IntegerField(default=0)),
+                ('rated_5', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedReviewRateFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating', models.IntegerField()),
+                ('created_at', models.DateTimeField()),
+                ('review', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.comparingreview')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedProductRateFact',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rating', models.IntegerField()),
+                ('created_at', models.DateTimeField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.product')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='reviewratingrollup',
+            constraint=models.UniqueConstraint(fields=('review', 'day'), name='unique_review_rating_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='productratingrollup',
+            constraint=models.UniqueConstraint(fields=('product', 'day'), name='unique_product_rating_rollup'),
+        ),
+        migrations.AddConstraint(
+            model_name='archivedreviewratefact',
+            constraint=models.UniqueConstraint(fields=('user', 'review'), name='unique_archived_review_rate_fact'),
+        ),
+        migrations.AddConstraint(
+            model_name='archivedproductratefact',
+            constraint=models.UniqueConstraint(fields=('user', 'product'), name='unique_archived_product_rate_fact'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 4.0.2 on 2026-10-19 13:52
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def seed_daily_views(apps, schema_editor):
+    """
+    Product.views до этой миграции - просмотры за день из UpdatingViews.
+    Переносим их в дневную сводку за этот день
+    """
+    updating_views = apps.get_model('main', 'UpdatingViews').objects.first()
+    if updating_views is None:
+        return
+    day = timezone.localtime(updating_views.update).date()
+    product_model = apps.get_model('main', 'Product')
+    daily_views_model = apps.get_model('main', 'ProductDailyViews')
+    daily_views_model.objects.bulk_create([
+        daily_views_model(product_id=product_id, day=day, views=views)
+        for product_id, views in product_model.objects.filter(views__gt=0).values_list('id', 'views')
+    ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0027_rate_fact_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductDailyViews',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('views', models.IntegerField(default=0)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.product')),
+            ],
+        ),
+        migrations.RunPython(seed_daily_views, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='UpdatingViews',
+        ),
+        migrations.AddConstraint(
+            model_name='productdailyviews',
+            constraint=models.UniqueConstraint(fields=('product', 'day'), name='unique_product_daily_views'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.0.2 on 2026-10-19 13:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0028_product_daily_views'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingLandmark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('landmark', models.DateTimeField()),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TrendingProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.FloatField(default=0.0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.productcategory')),
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, to='main.product')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='trendingproduct',
+            index=models.Index(fields=['-score'], name='trending_score_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='trendingproduct',
+            index=models.Index(fields=['category', '-score'], name='trending_category_score_idx'),
+        ),
+    ]
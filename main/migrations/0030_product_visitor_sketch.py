@@ -0,0 +1,27 @@
+# Generated by Django 4.0.2 on 2026-10-19 13:56
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0029_trending_products'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductVisitorSketch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('registers', models.BinaryField()),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='main.product')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='productvisitorsketch',
+            constraint=models.UniqueConstraint(fields=('product', 'day'), name='unique_product_visitor_sketch'),
+        ),
+    ]
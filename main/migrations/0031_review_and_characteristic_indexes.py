@@ -0,0 +1,25 @@
+# Generated by Django 4.0.2 on 2026-10-19 14:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0030_product_visitor_sketch'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comparingreview',
+            index=models.Index(fields=['first', 'created_at'], name='review_first_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='comparingreview',
+            index=models.Index(fields=['second', 'created_at'], name='review_second_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productcharacteristic',
+            index=models.Index(fields=['product', 'characteristic'], name='product_characteristic_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.0.2 on 2026-10-19 14:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0031_review_and_characteristic_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='comparingreview',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='deleted_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(condition=models.Q(('deleted_at__isnull', False)), fields=['deleted_at'], name='product_deleted_idx'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.0.2 on 2026-10-19 14:43
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+
+
+def fill_counters(apps, schema_editor):
+    """
+    Счётчики и первое изображение существующих товаров (как Product.recount_counters;
+    исторические модели без SoftDeleteManager, поэтому скрытые обзоры исключаются явно)
+    """
+    product_model = apps.get_model('main', 'Product')
+    image_model = apps.get_model('main', 'ProductImage')
+    reviews = apps.get_model('main', 'ComparingReview').objects.filter(deleted_at__isnull=True)
+
+    def count(queryset, field):
+        return Coalesce(Subquery(
+            queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(
+                count=Count('pk')).values('count')
+        ), 0)
+
+    product_model.objects.update(
+        image_count=count(image_model.objects.all(), 'product'),
+        review_count=count(reviews, 'first') + count(reviews, 'second'),
+        store_count=count(apps.get_model('main', 'StoreProduct').objects.all(), 'product'),
+        primary_image=Coalesce(Subquery(
+            image_model.objects.filter(product=OuterRef('pk')).order_by('id').values('image')[:1]
+        ), Value('')),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0032_product_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='image_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='primary_image',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='review_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='store_count',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -1,15 +1,148 @@
 from __future__ import annotations
 
-from datetime import datetime
-from typing import Optional, List
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta
+from typing import Optional, List, Sequence, Tuple, Union, Dict, Iterable
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import AbstractUser
-from django.db import models, transaction
-from django.db.models import UniqueConstraint, QuerySet, Q
+from django.core.cache import cache
+from django.db import models, transaction, IntegrityError
+from django.db.models import UniqueConstraint, QuerySet, Q, F, ExpressionWrapper, FloatField, Sum, \
+    OuterRef, Subquery, Count, Value, Prefetch
+from django.db.models.functions import Coalesce, NullIf
 from django.templatetags.static import static
+from django.utils import timezone
 
 from main.characteristic import CharacteristicType, ComparatorStrategy, Characteristic
+from main.flusher import PeriodicFlusher
+from main.hyperloglog import HyperLogLog
+
+
+RATING_SCALE = range(1, 6)
+# Бонусы за создание карточки товара и сравнительного обзора
+PRODUCT_BONUS = 10
+REVIEW_BONUS = 5
+
+
+def bayesian_score(rating: float, count: int) -> float:
+    """
+    Байесовская оценка: средний рейтинг, притянутый к RATING_PRIOR_MEAN
+    с весом RATING_PRIOR_WEIGHT "виртуальных" оценок. Один голос "5"
+    не обгонит 4.8 по двум тысячам голосов
+
+    :param rating: средняя оценка
+    :param count: количество оценок
+    :return: оценка для сортировки (0 - оценок нет)
+    """
+    if count == 0:
+        return 0.0
+    weight = settings.RATING_PRIOR_WEIGHT
+    return (weight * settings.RATING_PRIOR_MEAN + rating * count) / (weight + count)
+
+
+def rating_aggregate_update(histogram: Dict[int, int]) -> dict:
+    """
+    Выражения для QuerySet.update(), добавляющие к агрегатам товара или обзора
+    новые оценки: средний рейтинг, число оценок, гистограмму и байесовскую
+    оценку. Вычисляются на стороне БД одним UPDATE
+
+    :param histogram: количество новых оценок по значениям {оценка: количество}
+    :return: аргументы для update()
+    """
+    count = sum(histogram.values())
+    total = sum(rating * rated for rating, rated in histogram.items())
+    weight = settings.RATING_PRIOR_WEIGHT
+    prior = weight * settings.RATING_PRIOR_MEAN
+    update = {
+        'rating': ExpressionWrapper(
+            (F('rating') * F('user_rated') + total) / (F('user_rated') + count),
+            output_field=FloatField()
+        ),
+        'user_rated': F('user_rated') + count,
+        'score': ExpressionWrapper(
+            (F('rating') * F('user_rated') + total + prior) / (F('user_rated') + count + weight),
+            output_field=FloatField()
+        )
+    }
+    for rating, rated in histogram.items():
+        update[f'rated_{rating}'] = F(f'rated_{rating}') + rated
+    return update
+
+
+class SoftDeleteManager(models.Manager):
+    """
+    Менеджер по умолчанию для моделей с мягким удалением: удалённые
+    записи (deleted_at заполнено) не попадают ни в один список.
+    Все записи - через all_objects
+    """
+
+    def get_queryset(self):
+        """
+        :return: записи без удалённых
+        """
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+def get_cascade_plan(model, lookup: str = '') -> List[Tuple[type, str]]:
+    """
+    Модели, записи которых удаляются каскадно (CASCADE) вместе с записью model
+
+    :param model: удаляемая модель
+    :param lookup: путь от model до корневой удаляемой модели
+    :return: пары (модель, путь до корневой модели), дочерние раньше родительских
+    """
+    plan = []
+    for relation in model._meta.related_objects:
+        if relation.on_delete is not models.CASCADE:
+            continue
+        path = f'{relation.field.name}__{lookup}' if lookup else relation.field.name
+        plan += get_cascade_plan(relation.related_model, path)
+        plan.append((relation.related_model, path))
+    return plan
+
+
+class AtomicSaveModel(models.Model):
+    """
+    Сохранение в транзакции вместе с обработчиками post_save: связанные
+    записи товара (изображения, обзоры, подтверждения) и счётчики товара
+    в main.signals записываются вместе или не записываются вовсе.
+    Удаление Django и так выполняет в транзакции вместе с post_delete
+    """
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        with transaction.atomic(savepoint=False):
+            super().save(*args, **kwargs)
+
+
+class RatedModel(models.Model):
+    """
+    Гистограмма оценок и байесовская оценка для сортировки.
+    Поддерживаются путём записи оценок (rating_aggregate_update)
+
+    :param rated_1: количество оценок "1" (аналогично rated_2 ... rated_5)
+    :param score: байесовская оценка (bayesian_score)
+    """
+
+    rated_1 = models.IntegerField(default=0)
+    rated_2 = models.IntegerField(default=0)
+    rated_3 = models.IntegerField(default=0)
+    rated_4 = models.IntegerField(default=0)
+    rated_5 = models.IntegerField(default=0)
+    score = models.FloatField(default=0.0, db_index=True)
+
+    class Meta:
+        abstract = True
+
+    def get_rating_histogram(self) -> Dict[int, int]:
+        """
+        :return: количество оценок по значениям {оценка: количество}
+        """
+        return {rating: getattr(self, f'rated_{rating}') for rating in RATING_SCALE}
 
 
 class User(AbstractUser):
@@ -38,21 +171,81 @@ class User(AbstractUser):
 
     def get_all_rated_products(self):
         """
-            :return: Все оцененные товары
+            :return: Все оцененные товары, включая оценки из архива (кроме удалённых)
         """
-        return [fact.product for fact in self.get_all_product_rate_facts()]
+        # select_related обходит SoftDeleteManager, удалённые товары отсекаются явно
+        archived = ArchivedProductRateFact.objects.filter(
+            user=self, product__deleted_at__isnull=True).select_related('product')
+        facts = self.get_all_product_rate_facts().filter(
+            product__deleted_at__isnull=True).select_related('product')
+        return [fact.product for fact in facts] + [fact.product for fact in archived]
 
     def get_all_rated_reviews(self):
         """
-            :return: Все оцененные обзоры
+            :return: Все оцененные обзоры, включая оценки из архива (кроме удалённых)
+        """
+        archived = ArchivedReviewRateFact.objects.filter(
+            user=self, review__deleted_at__isnull=True).select_related('review')
+        facts = self.get_all_review_rate_facts().filter(
+            review__deleted_at__isnull=True).select_related('review')
+        return [fact.review for fact in facts] + [fact.review for fact in archived]
+
+    def get_product_rate_count(self) -> int:
+        """
+            :return: Количество оценок товаров: рабочие факты плюс счётчик архива
+        """
+        summary = UserRatingSummary.objects.filter(user=self).first()
+        archived = summary.archived_product_rates if summary else 0
+        return self.get_all_product_rate_facts().count() + archived
+
+    @staticmethod
+    def get_identity_cache_key(user_id: int) -> str:
         """
-        return [fact.review for fact in self.get_all_review_rate_facts()]
+        :param user_id: id пользователя
+        :return: ключ кэша аватара и роли пользователя
+        """
+        return f'user_identity:{user_id}'
 
-    def is_store_manager(self):
+    def get_identity(self) -> dict:
+        """
+        Аватар и магазин пользователя. Запоминаются на объекте (то есть
+        на время запроса) и кэшируются для пользователя до изменения
+        аватара или представительства магазина (см. main.signals)
+
+        :return: {'avatar': url аватара, 'store_id': id магазина или None}
+        """
+        if getattr(self, '_identity', None) is None:
+            key = User.get_identity_cache_key(self.id)
+            identity = cache.get(key)
+            if identity is None:
+                avatar = self.useravatar_set.first()
+                identity = {
+                    'avatar': avatar.image.url if avatar is not None
+                    else static(UserAvatar.get_default_avatar_path()),
+                    'store_id': StoreManager.objects.filter(user=self).values_list(
+                        'store_id', flat=True).first(),
+                }
+                cache.set(key, identity)
+            self._identity = identity
+        return self._identity
+
+    @staticmethod
+    def invalidate_identity(user_id: int) -> None:
+        """
+        Сброс кэша аватара и роли. Сбрасываем сразу и ещё раз после
+        коммита, чтобы параллельный запрос не успел закэшировать старое значение
+
+        :param user_id: id пользователя
+        """
+        key = User.get_identity_cache_key(user_id)
+        cache.delete(key)
+        transaction.on_commit(lambda: cache.delete(key))
+
+    def is_store_manager(self) -> bool:
         """
             :return: Является ли пользователь представителем магазина
         """
-        return StoreManager.objects.filter(user_id=self)
+        return self.get_identity()['store_id'] is not None
 
     def get_store(self):
         """
@@ -63,69 +256,121 @@ class User(AbstractUser):
         if not self.is_store_manager():
             raise PermissionError('Пользователь не является представителем магазина')
 
-        store_manager = StoreManager.objects.filter(user_id=self)[0]
-        store = store_manager.store
-        return store
+        if getattr(self, '_store', None) is None:
+            self._store = Store.objects.get(id=self.get_identity()['store_id'])
+        return self._store
 
     def has_already_rated(self, model_object):
         """
         Проверяет, оуенен ли уже товар пользователем
+        (в том числе оценкой, ещё не перенесённой из буфера)
 
         :param model_object: проверяемый продукт
         """
+        return self.get_rating(model_object) is not None
+
+    def get_rating(self, model_object) -> Optional[int]:
+        """
+        Оценка пользователя, включая ещё не перенесённую из буфера,
+        чтобы пользователь сразу видел свою оценку
+
+        :param model_object: продукт или обзор
+        :return: оценка или None
+        """
         if isinstance(model_object, Product):
-            return ProductRateFact.objects.filter(user=self, product=model_object).count() > 0
-        if isinstance(model_object, ComparingReview):
-            return ReviewRateFact.objects.filter(user=self, review=model_object).count() > 0
+            lookups = [(ProductRateFact, 'product'), (PendingProductRating, 'product'),
+                       (ArchivedProductRateFact, 'product')]
+        elif isinstance(model_object, ComparingReview):
+            lookups = [(ReviewRateFact, 'review'), (PendingReviewRating, 'review'),
+                       (ArchivedReviewRateFact, 'review')]
+        else:
+            return None
+
+        for model, field in lookups:
+            rating = model.objects.filter(
+                user=self, **{field: model_object}
+            ).values_list('rating', flat=True).first()
+            if rating is not None:
+                return rating
         return None
 
-    def rate(self, model_object, rating):
+    def rate(self, model_object, rating) -> bool:
         """
-        Оценивание продукта пользователем
+        Оценивание продукта пользователем.
+
+        Проверка и вставка факта оценки - одна операция: повторную оценку
+        отсекает уникальный индекс (user, product|review). Рейтинг и число
+        оценок пересчитываются одним UPDATE на стороне БД, поэтому
+        параллельные оценки не теряются.
+        При включённом RATING_BUFFER_ENABLED оценка попадает в буфер
+        и переносится в факты фоновым потоком
 
-        :param model_object: продукт
+        :param model_object: продукт или обзор
         :param rating: оценка
+        :return: была ли учтена оценка (False - пользователь уже оценивал)
         """
+        if rating not in RATING_SCALE:
+            raise ValueError('Оценка должна быть от 1 до 5')
+        if settings.RATING_BUFFER_ENABLED:
+            return PendingRating.enqueue(self, model_object, rating)
 
-        model_object.user_rated += 1
-        model_object.rating = ((model_object.rating * model_object.user_rated) + rating) / model_object.user_rated
-        model_object.save()
+        if isinstance(model_object, Product):
+            fact = ProductRateFact(user=self, product=model_object, rating=rating)
+        else:
+            fact = ReviewRateFact(user=self, review=model_object, rating=rating)
+
+        try:
+            with transaction.atomic():
+                fact.save()
+                # Проверка архива после вставки: вставка уже держит блокировку
+                # записи, и параллельная архивация не проскочит между ними
+                if type(fact).is_archived(self, model_object):
+                    raise IntegrityError('Оценка пользователя уже в архиве')
+                type(model_object).objects.filter(pk=model_object.pk).update(
+                    **rating_aggregate_update({rating: 1})
+                )
+                if isinstance(model_object, Product):
+                    TrendingProduct.add_events(
+                        {model_object.id: settings.TRENDING_WEIGHTS['rating']}
+                    )
+        except IntegrityError:
+            return False
 
-        fact = ProductRateFact(user=self,
-                               product=model_object,
-                               rating=rating
-                               ) \
-        if isinstance(model_object, Product) \
-        else ReviewRateFact(user=self, review=model_object, rating=rating)
-        fact.save()
+        model_object.refresh_from_db(fields=['rating', 'user_rated'])
+        return True
 
     def get_avatar(self):
         """
-        Получение аватара пользователя
+        Получение аватара пользователя.
+        Если аватарки нет, ставит изображение по умолчанию
 
         :return: изображение
         """
+        return self.get_identity()['avatar']
+
+    def add_bonuses(self, amount: int) -> None:
+        """
+        Начисление бонусов одним UPDATE: параллельные начисления
+        не перезаписывают друг друга, остальные поля не сохраняются
 
-        if self.useravatar_set.count() == 0:
-            """
-            Если аватарки нет, ставит изображение по умолчанию
-            """
-            return static(UserAvatar.get_default_avatar_path())
-        return self.useravatar_set.first().image.url
+        :param amount: количество бонусов
+        """
+        User.objects.filter(id=self.id).update(bonuses=F('bonuses') + amount)
+        self.bonuses += amount
 
-    def product_bonuses(self):
+    def product_bonuses(self, count: int = 1):
         """
-        Получение пользователем бонусов за создание карточки товара
+        Получение пользователем бонусов за создание карточек товаров
+
+        :param count: количество созданных товаров
         """
-        self.bonuses += 10
-        self.save()
+        self.add_bonuses(PRODUCT_BONUS * count)
 
     def review_bonuses(self):
         """
         Получение пользователем бонусов за создание сравнительного обзора
         """
-        self.bonuses += 5
-        self.save()
+        self.add_bonuses(REVIEW_BONUS)
 
 
 class UserAvatar(models.Model):
@@ -179,7 +424,7 @@ class ProductCategory(models.Model):
         return self.name
 
 
-class Product(models.Model):
+class Product(RatedModel):
     """
     Модель товара
 
@@ -191,9 +436,23 @@ class Product(models.Model):
     :param user_rated: оценка пользователя
     :param created_at: дата появления на сайте
     :param color: цвет(по умолчанию желтый)
+    :param views: просмотры за всё время (по дням - ProductDailyViews)
+    :param score: байесовская оценка для сортировки (см. RatedModel)
+    :param deleted_at: время удаления (см. soft_delete)
+    :param image_count: количество изображений
+    :param review_count: количество обзоров с товаром
+    :param store_count: количество магазинов, подтвердивших товар
+    :param primary_image: путь первого изображения ('' - изображений нет)
+
+    Счётчики и первое изображение обновляются вместе со связанными
+    записями (main.signals, массовые пути - сами), поэтому карточке и
+    странице товара не нужны запросы к изображениям, обзорам и магазинам
 
     """
 
+    # Удалённых товаров за раз в purge_deleted_chunk
+    PURGE_PRODUCTS = 100
+
     author = models.ForeignKey(to=User, on_delete=models.CASCADE)
     category = models.ForeignKey(to=ProductCategory, on_delete=models.CASCADE)
     title = models.CharField(max_length=300)
@@ -203,6 +462,21 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     color = models.CharField(max_length=10, default='#FFFF00')
     views = models.IntegerField(default=0)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+    image_count = models.IntegerField(default=0)
+    review_count = models.IntegerField(default=0)
+    store_count = models.IntegerField(default=0)
+    primary_image = models.CharField(max_length=100, blank=True, default='')
+
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            # частичный индекс: в нём только удалённые, ещё не вычищенные товары
+            models.Index(fields=['deleted_at'], name='product_deleted_idx',
+                         condition=Q(deleted_at__isnull=False)),
+        ]
 
     def __str__(self):
         """
@@ -211,28 +485,185 @@ class Product(models.Model):
         """
         return self.title
 
+    def soft_delete(self) -> None:
+        """
+        Удаление товара: товар и обзоры с ним сразу скрываются из всех
+        списков (SoftDeleteManager), а строки товара и всех зависимых
+        таблиц удаляются потом небольшими пачками в фоне
+        (PRODUCT_PURGER, команда purge_deleted_products), чтобы не держать
+        блокировку записи на время каскадного удаления. Поток очистки
+        запускается в процессе, удалившем товар, и завершается, когда
+        удалять больше нечего
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            Product.all_objects.filter(id=self.id).update(deleted_at=now)
+            reviews = ComparingReview.objects.filter(Q(first=self) | Q(second=self))
+            compared = {product_id for pair in reviews.values_list('first_id', 'second_id')
+                        for product_id in pair}
+            reviews.update(deleted_at=now)
+            Product.recount_counters(Product.all_objects.filter(id__in=compared - {self.id}),
+                                     ['review_count'])
+            TrendingProduct.objects.filter(product=self).delete()
+        self.deleted_at = now
+        # поток очистки должен увидеть удаление, даже если вызов обёрнут
+        # во внешнюю транзакцию
+        transaction.on_commit(PRODUCT_PURGER.start)
+
+    @staticmethod
+    def purge_deleted_chunk(chunk_size: Optional[int] = None) -> int:
+        """
+        Удаление одной пачки строк удалённых товаров в отдельной транзакции:
+        сначала зависимые строки (от самых глубоких по get_cascade_plan),
+        когда их не осталось - сами товары
+
+        :param chunk_size: строк в пачке (по умолчанию PRODUCT_PURGE_CHUNK_SIZE)
+        :return: количество удалённых строк, 0 - удалять нечего
+        """
+        chunk_size = chunk_size or settings.PRODUCT_PURGE_CHUNK_SIZE
+        product_ids = list(Product.all_objects.filter(deleted_at__isnull=False).order_by(
+            'id').values_list('id', flat=True)[:Product.PURGE_PRODUCTS])
+        if not product_ids:
+            return 0
+
+        for model, path in get_cascade_plan(Product):
+            ids = list(model._base_manager.filter(**{f'{path}__in': product_ids}).values_list(
+                'pk', flat=True)[:chunk_size])
+            if ids:
+                with transaction.atomic():
+                    deleted, _ = model._base_manager.filter(pk__in=ids).delete()
+                return deleted
+
+        with transaction.atomic():
+            deleted, _ = Product.all_objects.filter(id__in=product_ids).delete()
+        return deleted
+
+    @staticmethod
+    def get_counter_expressions() -> Dict[str, object]:
+        """
+        :return: выражения для пересчёта счётчиков и первого изображения
+            товара по связанным таблицам (подзапросы по индексам внешних ключей)
+        """
+        def count(queryset: QuerySet, field: str):
+            return Coalesce(Subquery(
+                queryset.filter(**{field: OuterRef('pk')}).order_by().values(field).annotate(
+                    count=Count('pk')).values('count')
+            ), 0)
+
+        reviews = ComparingReview.objects.all()
+        return {
+            'image_count': count(ProductImage.objects.all(), 'product'),
+            'review_count': count(reviews, 'first') + count(reviews, 'second'),
+            'store_count': count(StoreProduct.objects.all(), 'product'),
+            'primary_image': Coalesce(Subquery(
+                ProductImage.objects.filter(product=OuterRef('pk')).order_by('id')
+                .values('image')[:1]
+            ), Value('')),
+        }
+
+    @staticmethod
+    def recount_counters(products: QuerySet, fields: Optional[List[str]] = None) -> int:
+        """
+        Пересчёт счётчиков одним UPDATE (после массовых вставок и для проверки)
+
+        :param products: товары
+        :param fields: какие поля пересчитать (None - все из get_counter_expressions)
+        :return: количество обновлённых товаров
+        """
+        expressions = Product.get_counter_expressions()
+        return products.update(**{field: expressions[field] for field in fields or expressions})
+
+    @staticmethod
+    def change_counter(product_ids: Iterable[int], field: str, delta: int) -> None:
+        """
+        :param product_ids: id товаров
+        :param field: image_count, review_count или store_count
+        :param delta: прирост
+        """
+        Product.all_objects.filter(id__in=product_ids).update(**{field: F(field) + delta})
+
+    @staticmethod
+    def image_added(image: ProductImage) -> None:
+        """
+        Учёт нового изображения: счётчик и, если первого изображения
+        ещё нет, первое изображение - одним UPDATE
+        """
+        Product.all_objects.filter(id=image.product_id).update(
+            image_count=F('image_count') + 1,
+            primary_image=Coalesce(NullIf(F('primary_image'), Value('')),
+                                   Value(image.image.name or '')),
+        )
+
+    @staticmethod
+    def image_removed(image: ProductImage) -> None:
+        """
+        Учёт удалённого изображения (вызывается после DELETE): счётчик
+        и первое из оставшихся изображений - одним UPDATE
+        """
+        Product.all_objects.filter(id=image.product_id).update(
+            image_count=F('image_count') - 1,
+            primary_image=Product.get_counter_expressions()['primary_image'],
+        )
+
+    def get_primary_image(self) -> str:
+        """
+        :return: адрес первого изображения товара или изображения по умолчанию
+        """
+        if not self.primary_image:
+            return static(ProductImage.get_default_image_path())
+        return ProductImage._meta.get_field('image').storage.url(self.primary_image)
+
     def get_reviews_with_product(self):
         """
         Находим все обзоры, в которых участвует данный товар
         """
+        if not self.review_count:
+            return ComparingReview.objects.none()
         return ComparingReview.objects.filter(Q(first=self) | Q(second=self)
                                               ).order_by('-created_at')
 
-    def get_comparable_products(self):
+    def get_comparable_products(self, count: Optional[int] = None):
         """
         Находим все товары, которые сравнивались с данным в обзорах
+
+        :param count: сколько последних обзоров взять (None - все)
         """
-        reviews = self.get_reviews_with_product()
+        if not self.review_count:
+            return []
+        reviews = self.get_reviews_with_product().select_related('first', 'second', 'author')
+        if count is not None:
+            # Запрос с OR сортирует все обзоры товара во временном B-дереве.
+            # Два запроса по индексам (first, created_at) и (second, created_at)
+            # читают не больше count строк каждый, остаётся слить их
+            latest = ComparingReview.objects.select_related('first', 'second', 'author') \
+                .order_by('-created_at')
+            merged = {review.id: review for review in latest.filter(first=self)[:count]}
+            merged.update((review.id, review) for review in latest.filter(second=self)[:count])
+            reviews = sorted(merged.values(), key=lambda review: review.created_at, reverse=True)
         comparing_products = []
-        for review in reviews:
+        for review in reviews[:count]:
             comparing_products.append(
                 {
-                    'product': review.first if review.second == self else review.second,
+                    'product': review.first if review.second_id == self.id else review.second,
                     'review': review
                 }
             )
         return comparing_products
 
+    @staticmethod
+    def with_card_data(products: QuerySet) -> QuerySet:
+        """
+        Подгрузка всего, что показывает карточка товара: категория - тем же запросом,
+        изображения карусели - одним запросом на страницу; подтверждение карточка
+        берёт из поля товара store_count
+
+        :param products: товары
+        :return: товары с подгруженными связями
+        """
+        return products.select_related('category').prefetch_related(
+            Prefetch('productimage_set', queryset=ProductImage.objects.order_by('id'))
+        )
+
     @staticmethod
     def compare_products(product1: Product, product2: Product):
         """
@@ -274,13 +705,10 @@ class Product(models.Model):
             if characteristic.comparator != ComparatorStrategy.RATING:
                 comparator = comparator_cls(p1_char, p2_char)
             else:
-                characteristic_rating = CategoryStringCharacteristicRating.objects.filter(
-                    characteristic=characteristic
-                ).order_by('rating')
                 comparator = comparator_cls(
                     p1_char,
                     p2_char,
-                    [{'value': item.value, 'rating': item.rating} for item in characteristic_rating]
+                    CategoryStringCharacteristicRating.get_ladder(characteristic)
                 )
             compare = comparator.compare()
             result['comparation'][characteristic.name] = {
@@ -289,12 +717,29 @@ class Product(models.Model):
         return result
 
     def save_product_characteristics(self, request):
-        characteristics = CategoryCharacteristic.objects.filter(category=self.category)
-        for index, value in enumerate(characteristics):
-            char = ProductCharacteristic(characteristic=value,
-                                         product=self,
-                                         value=request.POST.get(f'form-{index}-value'))
-            char.save()
+        """
+        Сохранение характеристик из формы добавления товара (formset
+        goods_create_form) одним INSERT. Значения проверяются по типам
+        характеристик до записи
+
+        :param request: запрос с полями form-<номер>-value
+        :raises ValueError: в args - ошибки по характеристикам, ничего не записано
+        """
+        characteristics = []
+        errors = []
+        category_characteristics = CategoryCharacteristic.objects.filter(category=self.category_id)
+        for index, characteristic in enumerate(category_characteristics):
+            try:
+                value = characteristic.clean_value(request.POST.get(f'form-{index}-value'))
+            except ValueError as error:
+                errors.append(f'{characteristic.name}: {error}')
+                continue
+            characteristics.append(
+                ProductCharacteristic(characteristic=characteristic, product=self, value=value)
+            )
+        if errors:
+            raise ValueError(*errors)
+        ProductCharacteristic.objects.bulk_create(characteristics)
 
     def is_confirmed(self):
         """
@@ -302,16 +747,17 @@ class Product(models.Model):
 
         :return: Подтвержден ли продукт
         """
-        return StoreProduct.objects.filter(product=self)
+        return self.store_count > 0
 
     def get_images(self) -> List[str]:
         """
 
         :return: изображения товара
         """
-        if self.productimage_set.count() == 0:
-            return [static(ProductImage.get_default_image_path())]
-        return [record.image.url for record in self.productimage_set.all()]
+        if not self.image_count:
+            return [self.get_primary_image()]
+        images = [record.image.url for record in self.productimage_set.all()]
+        return images or [self.get_primary_image()]
 
     def get_stores(self):
         """
@@ -320,11 +766,8 @@ class Product(models.Model):
         :return: магазины или None
         """
 
-        if self.is_confirmed():
-            store_product = self.is_confirmed()
-            stores = [product.store for product in store_product]
-            return stores
-        return None
+        stores = [product.store for product in self.storeproduct_set.select_related('store')]
+        return stores or None
 
     def get_characteristic_value_by_name(self, name):
         """
@@ -336,7 +779,7 @@ class Product(models.Model):
         return self.productcharacteristic_set.get(characteristic__name=name)
 
 
-class ProductImage(models.Model):
+class ProductImage(AtomicSaveModel):
     """
     Модель изображения товара
 
@@ -376,6 +819,14 @@ class CategoryCharacteristic(models.Model):
     comparator = models.IntegerField(choices=ComparatorStrategy.choices,
                                      default=ComparatorStrategy.SMALLER)
 
+    def clean_value(self, value: object) -> str:
+        """
+        :param value: значение характеристики товара из формы или файла
+        :return: значение для хранения (см. CharacteristicType.clean_value)
+        :raises ValueError: значение не соответствует типу характеристики
+        """
+        return CharacteristicType.clean_value(self.value_type, value)
+
     def __str__(self):
         return f'Характеристика "{self.name}". ' \
                f'Тип: "{CharacteristicType.get_name_by_value(self.value_type)}". ' \
@@ -408,21 +859,149 @@ class CategoryStringCharacteristicRating(models.Model):
     def __repr__(self):
         return str(self)
 
+    @staticmethod
+    def get_ladder_cache_key(characteristic_id: int) -> str:
+        """
+        :param characteristic_id: id характеристики
+        :return: ключ кэша рейтинговой шкалы характеристики
+        """
+        return f'rating_ladder:{characteristic_id}'
+
+    @staticmethod
+    def get_ladder(characteristic: CategoryCharacteristic) -> List[dict]:
+        """
+        Рейтинговая шкала характеристики в формате RatingComparator.
+        Шкала кэшируется и сбрасывается при любом её изменении
+
+        :param characteristic: строковая характеристика
+        :return: список словарей {'value': ..., 'rating': ...}, упорядоченный по рейтингу
+        """
+        key = CategoryStringCharacteristicRating.get_ladder_cache_key(characteristic.id)
+        ladder = cache.get(key)
+        if ladder is None:
+            ladder = list(CategoryStringCharacteristicRating.objects.filter(
+                characteristic=characteristic
+            ).order_by('rating').values('value', 'rating'))
+            cache.set(key, ladder)
+        return ladder
+
+    @staticmethod
+    def invalidate_ladder(characteristic: CategoryCharacteristic) -> None:
+        """
+        Сброс кэша шкалы. Сбрасываем сразу и ещё раз после коммита,
+        чтобы параллельный запрос не успел закэшировать старую шкалу
+
+        :param characteristic: характеристика, шкала которой изменилась
+        """
+        key = CategoryStringCharacteristicRating.get_ladder_cache_key(characteristic.id)
+        cache.delete(key)
+        transaction.on_commit(lambda: cache.delete(key))
+
+    @staticmethod
+    def clean_ladder(ladder: Sequence[Union[str, Tuple[str, int]]]) -> List[Tuple[str, int]]:
+        """
+        Проверка новой шкалы до записи в БД
+
+        :param ladder: значения по возрастанию рейтинга либо пары (значение, рейтинг)
+        :return: список пар (значение, рейтинг)
+        """
+        entries = []
+        for position, item in enumerate(ladder, start=1):
+            if isinstance(item, str):
+                entries.append((item, position))
+            else:
+                value, rating = item
+                entries.append((value, int(rating)))
+
+        values = [value for value, _ in entries]
+        ratings = [rating for _, rating in entries]
+        if any(not value for value in values):
+            raise ValueError('Значение шкалы не может быть пустым')
+        if len(set(values)) != len(values):
+            raise ValueError('Значения в шкале должны быть уникальными')
+        if any(rating < 1 for rating in ratings):
+            raise ValueError('Рейтинг должен быть положительным числом')
+        if len(set(ratings)) != len(ratings):  # unique_votefact
+            raise ValueError('Рейтинги в шкале должны быть уникальными')
+        return entries
+
+    @staticmethod
+    @transaction.atomic
+    def replace_ladder(characteristic: CategoryCharacteristic,
+                       ladder: Sequence[Union[str, Tuple[str, int]]]
+                       ) -> List[CategoryStringCharacteristicRating]:
+        """
+        Полная замена шкалы характеристики одной транзакцией
+
+        :param characteristic: строковая характеристика
+        :param ladder: значения по возрастанию рейтинга либо пары (значение, рейтинг)
+        :return: созданные записи шкалы
+        """
+        if characteristic.value_type != CharacteristicType.str:
+            raise ValueError('Only string characteristics allowed')
+        entries = CategoryStringCharacteristicRating.clean_ladder(ladder)
+
+        # Удаляем старую шкалу целиком, иначе промежуточные
+        # состояния нарушат unique_votefact
+        CategoryStringCharacteristicRating.objects.filter(characteristic=characteristic).delete()
+        created = CategoryStringCharacteristicRating.objects.bulk_create([
+            CategoryStringCharacteristicRating(characteristic=characteristic,
+                                               value=value,
+                                               rating=rating)
+            for value, rating in entries
+        ])
+        CategoryStringCharacteristicRating.invalidate_ladder(characteristic)
+        return created
+
+    @staticmethod
+    def reorder_ladder(characteristic: CategoryCharacteristic,
+                       values: Sequence[str]) -> List[CategoryStringCharacteristicRating]:
+        """
+        Перестановка существующих значений шкалы
+
+        :param characteristic: строковая характеристика
+        :param values: все текущие значения шкалы в новом порядке
+        :return: записи шкалы
+        """
+        current = CategoryStringCharacteristicRating.objects.filter(
+            characteristic=characteristic
+        ).values_list('value', flat=True)
+        if sorted(current) != sorted(values):
+            raise ValueError('Новый порядок должен содержать ровно текущие значения шкалы')
+        return CategoryStringCharacteristicRating.replace_ladder(characteristic, values)
+
     @staticmethod
     @transaction.atomic  # <--- Если приложение умрёт в функции -
     # мы не приведём БД в неконсистентное состояние
     def insert_new_rating(rating_list: QuerySet,
                           characteristic: CategoryCharacteristic,
                           rating: int) -> CategoryStringCharacteristicRating:
+        """
+        Вставка значения в шкалу со сдвигом рейтингов не ниже rating
+
+        :param rating_list: текущая шкала характеристики
+        :param characteristic: характеристика
+        :param rating: рейтинг нового значения
+        :return: новая запись шкалы
+        """
         rating_list = rating_list.filter(rating__gte=rating).order_by('-rating')
         for entry in rating_list:
             entry.rating += 1
             entry.save()
-        return CategoryStringCharacteristicRating.objects.create(
+        record = CategoryStringCharacteristicRating.objects.create(
             characteristic=characteristic, rating=rating
         )
+        CategoryStringCharacteristicRating.invalidate_ladder(characteristic)
+        return record
 
     def add_new(self, characteristic: CategoryCharacteristic, rating: Optional[int] = None):
+        """
+        Добавление значения в шкалу строковой характеристики
+
+        :param characteristic: характеристика
+        :param rating: рейтинг значения (None - в конец шкалы)
+        :return: новая запись шкалы
+        """
         # Если пустой рейтинг - ставим в конец
         if characteristic.value_type != CharacteristicType.str:
             raise ValueError('Only string characteristics allowed')
@@ -432,17 +1011,19 @@ class CategoryStringCharacteristicRating(models.Model):
         )
 
         if rating_list.count() == 0:
-            return CategoryStringCharacteristicRating.objects.create(
+            record = CategoryStringCharacteristicRating.objects.create(
                 characteristic=characteristic, rating=1
             )
-
-        if rating is None:
+        elif rating is None:
             max_rating = rating_list.order_by('-rating').first().rating
-            return CategoryStringCharacteristicRating.objects.create(
+            record = CategoryStringCharacteristicRating.objects.create(
                 characteristic=characteristic, rating=max_rating + 1
             )
+        else:
+            return self.insert_new_rating(rating_list, characteristic, rating)
 
-        return self.insert_new_rating(rating_list, characteristic, rating)
+        CategoryStringCharacteristicRating.invalidate_ladder(characteristic)
+        return record
 
 
 class ProductCharacteristic(models.Model):
@@ -458,6 +1039,11 @@ class ProductCharacteristic(models.Model):
     characteristic = models.ForeignKey(to=CategoryCharacteristic, on_delete=models.CASCADE)
     value = models.CharField(max_length=300)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'characteristic'], name='product_characteristic_idx'),
+        ]
+
     def __str__(self):
         return f'Характеристика продукта: {self.characteristic.name}: {self.value}'
 
@@ -496,7 +1082,7 @@ class StoreManager(models.Model):
     store = models.ForeignKey(to=Store, on_delete=models.CASCADE)
 
 
-class StoreProduct(models.Model):
+class StoreProduct(AtomicSaveModel):
     """
     Модель товара в магазине
 
@@ -528,8 +1114,41 @@ class Application(models.Model):
     agreement = models.FileField(upload_to='agreements')
     status = models.CharField(max_length=300, default='under consideration')
 
+    PENDING_STATUS = 'under consideration'
+    PENDING_COUNT_CACHE_KEY = 'pending_applications_count'
+
+    @staticmethod
+    def get_pending() -> QuerySet:
+        """
+        :return: заявки на рассмотрении
+        """
+        return Application.objects.filter(status=Application.PENDING_STATUS)
+
+    @staticmethod
+    def get_pending_count() -> int:
+        """
+        Количество заявок на рассмотрении для меню модератора.
+        Кэшируется и сбрасывается при создании и рассмотрении заявки
+
+        :return: количество заявок
+        """
+        count = cache.get(Application.PENDING_COUNT_CACHE_KEY)
+        if count is None:
+            count = Application.get_pending().count()
+            cache.set(Application.PENDING_COUNT_CACHE_KEY, count)
+        return count
+
+    @staticmethod
+    def invalidate_pending_count() -> None:
+        """
+        Сброс кэша количества заявок. Сбрасываем сразу и ещё раз после
+        коммита, чтобы параллельный запрос не успел закэшировать старое значение
+        """
+        cache.delete(Application.PENDING_COUNT_CACHE_KEY)
+        transaction.on_commit(lambda: cache.delete(Application.PENDING_COUNT_CACHE_KEY))
+
 
-class ComparingReview(models.Model):
+class ComparingReview(AtomicSaveModel, RatedModel):
     """
     Модель сравнения товаров
 
@@ -543,6 +1162,8 @@ class ComparingReview(models.Model):
     :param rating: оценки
     :param user_rated: пользовательская оценка
     :param created_at: дата создания сравнения
+    :param score: байесовская оценка для сортировки (см. RatedModel)
+    :param deleted_at: время удаления (обзор скрывается вместе с удалённым товаром)
 
     """
 
@@ -555,30 +1176,250 @@ class ComparingReview(models.Model):
     rating = models.FloatField(default=0.0)
     user_rated = models.IntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
+    deleted_at = models.DateTimeField(null=True, blank=True)
+
+    objects = SoftDeleteManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['first', 'created_at'], name='review_first_created_idx'),
+            models.Index(fields=['second', 'created_at'], name='review_second_created_idx'),
+        ]
 
     def get_images(self):
+        """
+        :return: первые изображения обоих товаров обзора
+        """
         return {
-            'first': self.first.get_images()[0],
-            'second': self.second.get_images()[0]
+            'first': self.first.get_primary_image(),
+            'second': self.second.get_primary_image()
         }
 
+    @staticmethod
+    def with_list_data(reviews: QuerySet) -> QuerySet:
+        """
+        Подгрузка товаров для списка обзоров одним запросом
+        (изображения - primary_image товаров)
+
+        :param reviews: обзоры
+        :return: обзоры с подгруженными связями
+        """
+        return reviews.select_related('first__category', 'second')
 
-class ProductRateFact(models.Model):
+
+class RateFact(models.Model):
     """
-    Модель оценки товара пользователем
+    Общая часть фактов оценки. Старые факты переносятся в архив (ARCHIVE_MODEL)
+    с дневными сводками (ROLLUP_MODEL) и счётчиками пользователя (UserRatingSummary),
+    чтобы рабочие таблицы фактов не росли бесконечно
 
     :param user: оценивший пользователь
-    :param product: оцененный товар
     :param rating: пользовательская оценка
+    :param created_at: время оценки
+    """
+
+    TARGET_FIELD = None
+    ARCHIVE_MODEL = None
+    ROLLUP_MODEL = None
+    SUMMARY_FIELD = None
+
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE)
+    rating = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        abstract = True
 
+    @classmethod
+    def is_archived(cls, user: User, model_object) -> bool:
+        """
+        :return: есть ли оценка пользователя в архиве
+        """
+        return cls.ARCHIVE_MODEL.objects.filter(
+            user=user, **{cls.TARGET_FIELD: model_object}
+        ).exists()
+
+    @classmethod
+    def archive_chunk(cls, before: datetime, chunk_size: int) -> int:
+        """
+        Перенос в архив одной пачки фактов старше before: факты копируются
+        в архивную таблицу, добавляются в дневные сводки и счётчики
+        пользователей и удаляются из рабочей таблицы одной транзакцией
+
+        :param before: граница по времени оценки
+        :param chunk_size: размер пачки
+        :return: количество перенесённых фактов
+        """
+        target_id = f'{cls.TARGET_FIELD}_id'
+        with transaction.atomic():
+            chunk = list(cls.objects.filter(created_at__lt=before).order_by('id')[:chunk_size])
+            if not chunk:
+                return 0
+
+            cls.ARCHIVE_MODEL.objects.bulk_create([
+                cls.ARCHIVE_MODEL(user_id=fact.user_id, rating=fact.rating,
+                                  created_at=fact.created_at,
+                                  **{target_id: getattr(fact, target_id)})
+                for fact in chunk
+            ], ignore_conflicts=True)
+
+            rollups = defaultdict(Counter)
+            users = Counter()
+            for fact in chunk:
+                day = fact.created_at.date()
+                rollups[(getattr(fact, target_id), day)][f'rated_{fact.rating}'] += 1
+                users[fact.user_id] += 1
+
+            for (object_id, day), histogram in rollups.items():
+                lookup = {target_id: object_id, 'day': day}
+                updated = cls.ROLLUP_MODEL.objects.filter(**lookup).update(
+                    **{field: F(field) + count for field, count in histogram.items()}
+                )
+                if not updated:
+                    cls.ROLLUP_MODEL.objects.create(**histogram, **lookup)
+
+            for user_id, count in users.items():
+                summary, _ = UserRatingSummary.objects.get_or_create(user_id=user_id)
+                UserRatingSummary.objects.filter(pk=summary.pk).update(
+                    **{cls.SUMMARY_FIELD: F(cls.SUMMARY_FIELD) + count}
+                )
+
+            cls.objects.filter(id__in=[fact.id for fact in chunk]).delete()
+        return len(chunk)
+
+
+class ArchivedProductRateFact(models.Model):
+    """
+    Архив оценок товаров
+
+    :param user: оценивший пользователь
+    :param product: оцененный товар
+    :param rating: пользовательская оценка
+    :param created_at: время оценки
     """
 
     user = models.ForeignKey(to=User, on_delete=models.CASCADE)
     product = models.ForeignKey(to=Product, on_delete=models.CASCADE)
     rating = models.IntegerField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['user', 'product'], name='unique_archived_product_rate_fact')
+        ]
+
+
+class ArchivedReviewRateFact(models.Model):
+    """
+    Архив оценок обзоров
+
+    :param user: оценивший пользователь
+    :param review: оцененный обзор
+    :param rating: пользовательская оценка
+    :param created_at: время оценки
+    """
+
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE)
+    review = models.ForeignKey(to=ComparingReview, on_delete=models.CASCADE)
+    rating = models.IntegerField()
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['user', 'review'], name='unique_archived_review_rate_fact')
+        ]
+
+
+class RatingRollup(models.Model):
+    """
+    Дневная гистограмма архивных оценок. Архивные факты в агрегатах
+    учитываются по этим сводкам (rebuild_rating_aggregates), а сами
+    факты нужны только для проверки повторной оценки и профиля
+
+    :param day: день оценки
+    :param rated_1: количество оценок "1" (аналогично rated_2 ... rated_5)
+    """
+
+    day = models.DateField()
+    rated_1 = models.IntegerField(default=0)
+    rated_2 = models.IntegerField(default=0)
+    rated_3 = models.IntegerField(default=0)
+    rated_4 = models.IntegerField(default=0)
+    rated_5 = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+
+class ProductRatingRollup(RatingRollup):
+    """
+    Дневная сводка архивных оценок товара
+
+    :param product: товар
+    """
+
+    product = models.ForeignKey(to=Product, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['product', 'day'], name='unique_product_rating_rollup')
+        ]
+
+
+class ReviewRatingRollup(RatingRollup):
+    """
+    Дневная сводка архивных оценок обзора
+
+    :param review: обзор
+    """
+
+    review = models.ForeignKey(to=ComparingReview, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['review', 'day'], name='unique_review_rating_rollup')
+        ]
+
+
+class UserRatingSummary(models.Model):
+    """
+    Счётчики архивных оценок пользователя, чтобы профиль не считал архив
+
+    :param user: пользователь
+    :param archived_product_rates: количество оценок товаров в архиве
+    :param archived_review_rates: количество оценок обзоров в архиве
+    """
+
+    user = models.OneToOneField(to=User, on_delete=models.CASCADE)
+    archived_product_rates = models.IntegerField(default=0)
+    archived_review_rates = models.IntegerField(default=0)
+
+
+class ProductRateFact(RateFact):
+    """
+    Модель оценки товара пользователем
+
+    :param user: оценивший пользователь
+    :param product: оцененный товар
+    :param rating: пользовательская оценка
+
+    """
+
+    TARGET_FIELD = 'product'
+    ARCHIVE_MODEL = ArchivedProductRateFact
+    ROLLUP_MODEL = ProductRatingRollup
+    SUMMARY_FIELD = 'archived_product_rates'
+
+    product = models.ForeignKey(to=Product, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['user', 'product'], name='unique_product_rate_fact')
+        ]
 
 
-class ReviewRateFact(models.Model):
+class ReviewRateFact(RateFact):
     """
     Модель обзора сравнения на товар пользователем
 
@@ -588,10 +1429,407 @@ class ReviewRateFact(models.Model):
 
     """
 
-    user = models.ForeignKey(to=User, on_delete=models.CASCADE)
+    TARGET_FIELD = 'review'
+    ARCHIVE_MODEL = ArchivedReviewRateFact
+    ROLLUP_MODEL = ReviewRatingRollup
+    SUMMARY_FIELD = 'archived_review_rates'
+
     review = models.ForeignKey(to=ComparingReview, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['user', 'review'], name='unique_review_rate_fact')
+        ]
+
+
+class ProductDailyViews(models.Model):
+    """
+    Просмотры товара за день. Просмотры за сегодня, неделю и месяц -
+    выборка по уникальному ключу (product, day), без ежедневного сброса
+
+    :param product: товар
+    :param day: день (по локальному времени сайта)
+    :param views: количество просмотров
+    """
+
+    product = models.ForeignKey(to=Product, on_delete=models.CASCADE)
+    day = models.DateField()
+    views = models.IntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['product', 'day'], name='unique_product_daily_views')
+        ]
+
+    @staticmethod
+    def get_views(product: Product) -> Dict[str, int]:
+        """
+        Просмотры товара за сегодня, 7 и 30 дней одним запросом
+
+        :param product: товар
+        :return: {'today': ..., 'week': ..., 'month': ...}
+        """
+        today = timezone.localdate()
+        periods = {'today': 1, 'week': 7, 'month': 30}
+        views = ProductDailyViews.objects.filter(
+            product=product, day__gt=today - timedelta(days=max(periods.values()))
+        ).aggregate(**{
+            name: Sum('views', filter=Q(day__gt=today - timedelta(days=days)))
+            for name, days in periods.items()
+        })
+        return {name: value or 0 for name, value in views.items()}
+
+
+class ProductVisitorSketch(models.Model):
+    """
+    Уникальные посетители товара за день в виде скетча HyperLogLog
+    (256 байт на товар и день вместо списка посетителей).
+    Уникальные за неделю и месяц - объединение дневных скетчей
+
+    :param product: товар
+    :param day: день (по локальному времени сайта)
+    :param registers: регистры скетча
+    """
+
+    product = models.ForeignKey(to=Product, on_delete=models.CASCADE)
+    day = models.DateField()
+    registers = models.BinaryField()
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['product', 'day'], name='unique_product_visitor_sketch')
+        ]
+
+    def get_sketch(self) -> HyperLogLog:
+        """
+        :return: скетч посетителей из регистров строки
+        """
+        return HyperLogLog(bytes(self.registers))
+
+    @staticmethod
+    def get_day_total(day: date) -> HyperLogLog:
+        """
+        :param day: день
+        :return: объединение скетчей всех товаров за день
+        """
+        registers = ProductVisitorSketch.objects.filter(day=day).values_list('registers',
+                                                                             flat=True)
+        return HyperLogLog.merge(HyperLogLog(bytes(row)) for row in registers)
+
+    @staticmethod
+    def get_uniques(product: Product, pending: Optional[HyperLogLog] = None) -> Dict[str, int]:
+        """
+        Уникальные посетители товара за сегодня, 7 и 30 дней одним запросом
+
+        :param product: товар
+        :param pending: ещё не записанный в БД сегодняшний скетч
+        :return: {'today': ..., 'week': ..., 'month': ...}
+        """
+        today = timezone.localdate()
+        periods = {'today': 1, 'week': 7, 'month': 30}
+        sketches = {name: HyperLogLog() for name in periods}
+        if pending is not None:
+            for sketch in sketches.values():
+                sketch.update(pending)
+
+        rows = ProductVisitorSketch.objects.filter(
+            product=product, day__gt=today - timedelta(days=max(periods.values()))
+        )
+        for row in rows:
+            day_sketch = row.get_sketch()
+            for name, days in periods.items():
+                if row.day > today - timedelta(days=days):
+                    sketches[name].update(day_sketch)
+        return {name: sketch.count() for name, sketch in sketches.items()}
+
+
+class PendingRating(models.Model):
+    """
+    Буфер оценок: оценка сразу записывается сюда, а фоновый поток
+    переносит пачку оценок в факты и обновляет агрегат каждого
+    товара/обзора одним UPDATE за интервал.
+    Уникальность (user, объект) проверяется и в буфере, и в фактах
+
+    :param user: оценивший пользователь
+    :param rating: пользовательская оценка
+    :param created_at: время оценки
+    """
+
+    FACT_MODEL = None
+    TARGET_FIELD = None
+
+    user = models.ForeignKey(to=User, on_delete=models.CASCADE)
     rating = models.IntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        abstract = True
+
+    @staticmethod
+    def get_buffer_model(model_object) -> type:
+        """
+        :param model_object: продукт или обзор
+        :return: модель буфера для этого объекта
+        """
+        if isinstance(model_object, Product):
+            return PendingProductRating
+        return PendingReviewRating
+
+    @staticmethod
+    def enqueue(user: User, model_object, rating: int) -> bool:
+        """
+        Постановка оценки в буфер
+
+        :param user: оценивший пользователь
+        :param model_object: продукт или обзор
+        :param rating: оценка
+        :return: принята ли оценка (False - пользователь уже оценивал)
+        """
+        buffer_model = PendingRating.get_buffer_model(model_object)
+        target = {buffer_model.TARGET_FIELD: model_object}
+        try:
+            with transaction.atomic():
+                # Сначала вставка: она берёт блокировку записи, поэтому
+                # проверка фактов ниже не разойдётся с параллельным сбросом
+                buffer_model.objects.create(user=user, rating=rating, **target)
+                fact_model = buffer_model.FACT_MODEL
+                if fact_model.objects.filter(user=user, **target).exists() \
+                        or fact_model.is_archived(user, model_object):
+                    raise IntegrityError('Пользователь уже оценил объект')
+        except IntegrityError:
+            return False
+
+        RATING_FLUSHER.start()
+        return True
+
+    @classmethod
+    def flush(cls, batch_size: Optional[int] = None) -> int:
+        """
+        Перенос одной пачки оценок из буфера в факты
+
+        :param batch_size: размер пачки (по умолчанию RATING_BUFFER_BATCH_SIZE)
+        :return: количество обработанных записей буфера
+        """
+        batch_size = batch_size or settings.RATING_BUFFER_BATCH_SIZE
+        target_id = f'{cls.TARGET_FIELD}_id'
+        with transaction.atomic():
+            batch = list(cls.objects.order_by('id')[:batch_size])
+            if not batch:
+                return 0
+
+            existing = set()
+            for fact_model in (cls.FACT_MODEL, cls.FACT_MODEL.ARCHIVE_MODEL):
+                existing.update(fact_model.objects.filter(
+                    user_id__in={item.user_id for item in batch},
+                    **{f'{target_id}__in': {getattr(item, target_id) for item in batch}}
+                ).values_list('user_id', target_id))
+            accepted = [item for item in batch
+                        if (item.user_id, getattr(item, target_id)) not in existing]
+
+            cls.FACT_MODEL.objects.bulk_create([
+                cls.FACT_MODEL(user_id=item.user_id, rating=item.rating,
+                               **{target_id: getattr(item, target_id)})
+                for item in accepted
+            ])
+
+            histograms = defaultdict(Counter)
+            for item in accepted:
+                histograms[getattr(item, target_id)][item.rating] += 1
+            target_model = cls.FACT_MODEL._meta.get_field(cls.TARGET_FIELD).related_model
+            for object_id, histogram in histograms.items():
+                target_model.objects.filter(pk=object_id).update(
+                    **rating_aggregate_update(histogram)
+                )
+            if target_model is Product:
+                TrendingProduct.add_events({
+                    product_id: sum(histogram.values()) * settings.TRENDING_WEIGHTS['rating']
+                    for product_id, histogram in histograms.items()
+                })
+
+            cls.objects.filter(id__in=[item.id for item in batch]).delete()
+        return len(batch)
+
+    @staticmethod
+    def flush_all() -> int:
+        """
+        Перенос всех накопленных оценок
+
+        :return: количество обработанных записей буфера
+        """
+        flushed = 0
+        for buffer_model in (PendingProductRating, PendingReviewRating):
+            while True:
+                count = buffer_model.flush()
+                flushed += count
+                if count == 0:
+                    break
+        return flushed
+
+
+class PendingProductRating(PendingRating):
+    """
+    Буфер оценок товаров
+
+    :param product: оцененный товар
+    """
+
+    FACT_MODEL = ProductRateFact
+    TARGET_FIELD = 'product'
+
+    product = models.ForeignKey(to=Product, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['user', 'product'], name='unique_pending_product_rating')
+        ]
+
+
+class PendingReviewRating(PendingRating):
+    """
+    Буфер оценок обзоров
+
+    :param review: оцененный обзор
+    """
+
+    FACT_MODEL = ReviewRateFact
+    TARGET_FIELD = 'review'
+
+    review = models.ForeignKey(to=ComparingReview, on_delete=models.CASCADE)
+
+    class Meta:
+        constraints = [
+            UniqueConstraint(fields=['user', 'review'], name='unique_pending_review_rating')
+        ]
+
+
+RATING_FLUSHER = PeriodicFlusher('ratings', PendingRating.flush_all,
+                                 'RATING_BUFFER_FLUSH_INTERVAL')
+PRODUCT_PURGER = PeriodicFlusher('product-purge', Product.purge_deleted_chunk,
+                                 'PRODUCT_PURGE_INTERVAL', stop_when_idle=True)
+
+
+class TrendingLandmark(models.Model):
+    """
+    Точка отсчёта для счёта популярности (см. TrendingProduct).
+    В таблице одна запись
+
+    :param landmark: момент, относительно которого хранятся веса событий
+    """
+
+    landmark = models.DateTimeField()
+
+
+class TrendingProduct(models.Model):
+    """
+    Популярность товара с экспоненциальным затуханием.
+
+    Хранится не затухающий счёт, а сумма весов событий, умноженных на
+    2 ** ((t - landmark) / период полураспада): порядок товаров по такой
+    сумме совпадает с порядком по затухшему счёту в любой момент, поэтому
+    старые значения не нужно пересчитывать - каждое событие это один
+    UPDATE score = score + w. Чтобы множитель не переполнился, точка
+    отсчёта периодически сдвигается (rebase)
+
+    :param product: товар
+    :param category: категория товара (для топа по категории одним индексным запросом)
+    :param score: счёт популярности
+    """
+
+    REBASE_EXPONENT = 64
 
-class UpdatingViews(models.Model):
-    update = models.DateTimeField()
+    product = models.OneToOneField(to=Product, on_delete=models.CASCADE)
+    category = models.ForeignKey(to=ProductCategory, on_delete=models.CASCADE)
+    score = models.FloatField(default=0.0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-score'], name='trending_score_idx'),
+            models.Index(fields=['category', '-score'], name='trending_category_score_idx'),
+        ]
+
+    @staticmethod
+    def get_exponent(landmark: datetime, moment: datetime) -> float:
+        """
+        :return: число периодов полураспада между landmark и moment
+        """
+        half_life = timedelta(hours=settings.TRENDING_HALF_LIFE_HOURS)
+        return (moment - landmark) / half_life
+
+    @staticmethod
+    def get_landmark() -> datetime:
+        """
+        Текущая точка отсчёта (сдвигается, если множитель стал слишком большим).
+        Вызывается в транзакции, которая потом пишет счета: запись точки
+        блокируется до конца транзакции, и параллельный rebase не изменит
+        её между чтением и записью счетов
+
+        :return: текущая точка отсчёта
+        """
+        now = timezone.now()
+        landmark, _ = TrendingLandmark.objects.select_for_update().get_or_create(
+            id=1, defaults={'landmark': now})
+        if TrendingProduct.get_exponent(landmark.landmark, now) > TrendingProduct.REBASE_EXPONENT:
+            TrendingProduct.rebase(landmark.landmark, now)
+            return TrendingLandmark.objects.get(id=1).landmark
+        return landmark.landmark
+
+    @staticmethod
+    @transaction.atomic
+    def rebase(landmark: datetime, moment: datetime) -> bool:
+        """
+        Сдвиг точки отсчёта: все счета делятся на накопившийся множитель,
+        совсем затухшие товары удаляются из таблицы. Точка сдвигается
+        условным UPDATE: если другой процесс уже сдвинул её, счета не
+        делятся второй раз
+
+        :param landmark: прочитанная точка отсчёта
+        :param moment: новая точка отсчёта
+        :return: выполнен ли сдвиг (False - точку уже сдвинули)
+        """
+        if TrendingLandmark.objects.filter(id=1, landmark=landmark).update(landmark=moment) != 1:
+            return False
+        factor = 2 ** -TrendingProduct.get_exponent(landmark, moment)
+        TrendingProduct.objects.update(score=F('score') * factor)
+        TrendingProduct.objects.filter(score__lt=settings.TRENDING_MIN_SCORE).delete()
+        return True
+
+    @staticmethod
+    def add_events(weights: Dict[int, float]) -> None:
+        """
+        Учёт событий (просмотров, оценок, обзоров) товаров
+
+        :param weights: суммарный вес событий {id товара: вес}
+        """
+        weights = {product_id: weight for product_id, weight in weights.items() if weight}
+        if not weights:
+            return
+        with transaction.atomic():
+            landmark = TrendingProduct.get_landmark()
+            factor = 2 ** TrendingProduct.get_exponent(landmark, timezone.now())
+            TrendingProduct.objects.bulk_create([
+                TrendingProduct(product_id=product_id, category_id=category_id)
+                for product_id, category_id in Product.objects.filter(
+                    id__in=weights
+                ).values_list('id', 'category_id')
+            ], ignore_conflicts=True)
+
+            by_weight = defaultdict(list)
+            for product_id, weight in weights.items():
+                by_weight[weight].append(product_id)
+            for weight, product_ids in by_weight.items():
+                TrendingProduct.objects.filter(product_id__in=product_ids).update(
+                    score=F('score') + weight * factor
+                )
+
+    @staticmethod
+    def get_top(category: Optional[ProductCategory] = None,
+                count: Optional[int] = None) -> QuerySet:
+        """
+        :param category: категория (None - по всем товарам)
+        :param count: размер топа (по умолчанию TRENDING_TOP_SIZE)
+        :return: самые популярные сейчас товары
+        """
+        trending = TrendingProduct.objects.select_related('product')
+        if category is not None:
+            trending = trending.filter(category=category)
+        return trending.order_by('-score')[:count or settings.TRENDING_TOP_SIZE]
@@ -0,0 +1,378 @@
+"""
+Массовый импорт товаров из CSV и JSONL (команда import_products и страница
+product_import). Файл читается построчно, категории и характеристики
+загружаются один раз, товары, их характеристики и изображения пишутся
+bulk_create пачками, каждая пачка - в своей транзакции
+"""
+
+import csv
+import json
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, TextIO, Tuple, Union
+
+from django.db import transaction
+
+from main.characteristic import ComparatorStrategy, CharacteristicType
+from main.models import User, Store, StoreProduct, Product, ProductCategory, \
+    ProductCharacteristic, ProductImage, CategoryCharacteristic, CategoryStringCharacteristicRating
+
+FORMATS = ('csv', 'jsonl')
+# Столбцы CSV с полями товара, остальные столбцы - характеристики
+PRODUCT_COLUMNS = ('title', 'description', 'category', 'color', 'images')
+IMAGE_SEPARATOR = '|'
+COLOR = re.compile(r'^#[0-9a-fA-F]{6}$')
+# Сколько ошибок хранить в отчёте (считаются все)
+MAX_REPORTED_ERRORS = 1000
+# Файл декодируется потоком, поэтому номер строки с ошибкой кодировки приблизительный
+ENCODING_ERROR = 'Файл должен быть в кодировке UTF-8, строки начиная с этой не прочитаны'
+
+Row = Union[dict, ValueError]
+# Проверенная строка: несохранённый товар, пары (id характеристики, значение), пути изображений
+CleanRow = Tuple[Product, List[Tuple[int, str]], List[str]]
+
+
+class FileError(ValueError):
+    """
+    Файл дальше не читается (не та кодировка, повреждённый CSV).
+    Строки до ошибки импортируются, остальные - нет
+    """
+
+
+class RowError(ValueError):
+    """
+    Ошибки одной строки файла
+
+    :param errors: сообщения об ошибках
+    """
+
+    def __init__(self, errors: List[str]):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+def get_format(filename: str) -> Optional[str]:
+    """
+    :param filename: имя файла
+    :return: формат по расширению или None
+    """
+    extension = filename.rsplit('.', 1)[-1].lower()
+    if extension == 'json':
+        return 'jsonl'
+    return extension if extension in FORMATS else None
+
+
+def read_rows(stream: TextIO, file_format: str) -> Iterator[Tuple[int, Row]]:
+    """
+    Построчное чтение файла. Строки приводятся к одному виду:
+    {'title', 'description', 'category', 'color', 'images': [...], 'characteristics': {...}}
+
+    CSV: столбцы PRODUCT_COLUMNS, изображения через IMAGE_SEPARATOR,
+    остальные столбцы - значения характеристик по названию.
+    JSONL: объект на строку, characteristics - словарь, images - список
+
+    :param stream: текстовый поток
+    :param file_format: 'csv' или 'jsonl'
+    :return: пары (номер строки, строка или ошибка разбора); на FileError чтение заканчивается
+    """
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        # строка, на которой закончилась предыдущая запись: line_num при ошибке
+        # в зависимости от версии Python указывает на неё или на строку с ошибкой
+        last_line = 0
+        try:
+            for row in reader:
+                last_line = reader.line_num
+                if None in row:
+                    yield reader.line_num, ValueError('Значений больше, чем столбцов')
+                    continue
+                images = row.get('images') or ''
+                yield reader.line_num, {
+                    'title': row.get('title'),
+                    'description': row.get('description'),
+                    'category': row.get('category'),
+                    'color': row.get('color'),
+                    'images': [image for image in images.split(IMAGE_SEPARATOR) if image.strip()],
+                    'characteristics': {name: value for name, value in row.items()
+                                        if name not in PRODUCT_COLUMNS},
+                }
+        except csv.Error as error:
+            yield max(reader.line_num, last_line + 1), FileError(f'Некорректный CSV: {error}')
+        except UnicodeDecodeError:
+            yield last_line + 1, FileError(ENCODING_ERROR)
+    elif file_format == 'jsonl':
+        line_number = 0
+        try:
+            for line_number, line in enumerate(stream, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError as error:
+                    yield line_number, ValueError(f'Некорректный JSON: {error.msg}')
+                    continue
+                if not isinstance(row, dict):
+                    yield line_number, ValueError('Ожидается JSON-объект')
+                    continue
+                yield line_number, row
+        except UnicodeDecodeError:
+            yield line_number + 1, FileError(ENCODING_ERROR)
+    else:
+        raise ValueError(f'Неизвестный формат: {file_format}')
+
+
+class ImportReport:
+    """
+    Итог импорта: количество созданных товаров, ошибки по строкам
+    (первые MAX_REPORTED_ERRORS) и ошибка, на которой остановилось чтение файла
+    """
+
+    def __init__(self):
+        self.created = 0
+        self.failed = 0
+        self.errors: List[dict] = []
+        self.file_error: Optional[dict] = None
+
+    def add_error(self, line: int, errors: List[str]) -> None:
+        """
+        :param line: номер строки файла
+        :param errors: ошибки строки (в отчёт попадают первые MAX_REPORTED_ERRORS строк)
+        """
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line, 'errors': errors})
+
+    def as_dict(self) -> dict:
+        """
+        :return: отчёт для JSON
+        """
+        return {'created': self.created, 'failed': self.failed, 'errors': self.errors,
+                'file_error': self.file_error}
+
+
+class ProductImporter:
+    """
+    Импорт товаров. Строка с ошибкой не создаётся и попадает в отчёт,
+    остальные строки импортируются. Товар должен иметь значения всех
+    характеристик своей категории: страницы товара и сравнения их ожидают.
+    Изображения - пути к уже загруженным файлам относительно MEDIA_ROOT.
+    Бонусы за товары (User.product_bonuses) при импорте не начисляются
+
+    :param author: автор товаров
+    :param store: магазин, в котором товары сразу подтверждены (None - без подтверждения)
+    :param chunk_size: товаров в одной транзакции
+    :param category_ids: загрузить только эти категории (None - все)
+    """
+
+    def __init__(self, author: User, store: Optional[Store] = None, chunk_size: int = 2000,
+                 category_ids: Optional[List[int]] = None):
+        self.author = author
+        self.store = store
+        self.chunk_size = chunk_size
+        self.report = ImportReport()
+
+        categories = ProductCategory.objects.all()
+        characteristics = CategoryCharacteristic.objects.all()
+        ladders = CategoryStringCharacteristicRating.objects.all()
+        if category_ids is not None:
+            categories = categories.filter(id__in=category_ids)
+            characteristics = characteristics.filter(category__in=category_ids)
+            ladders = ladders.filter(characteristic__category__in=category_ids)
+
+        self.category_ids = set()
+        self.categories_by_name: Dict[str, int] = {}
+        # названия категорий не уникальны: такие категории указываются по id
+        self.ambiguous_names = set()
+        for category_id, name in categories.values_list('id', 'name'):
+            self.category_ids.add(category_id)
+            if name in self.categories_by_name:
+                self.ambiguous_names.add(name)
+            self.categories_by_name[name] = category_id
+
+        self.characteristics: Dict[int, Dict[str, CategoryCharacteristic]] = defaultdict(dict)
+        for characteristic in characteristics:
+            self.characteristics[characteristic.category_id][characteristic.name] = characteristic
+
+        self.ladders: Dict[int, set] = defaultdict(set)
+        for characteristic_id, value in ladders.values_list('characteristic_id', 'value'):
+            self.ladders[characteristic_id].add(value)
+
+    def run(self, rows: Iterable[Tuple[int, Row]]) -> ImportReport:
+        """
+        :param rows: строки из read_rows
+        :return: отчёт, в том числе частичный, если файл прочитан не до конца
+        """
+        chunk = []
+        for line, row in rows:
+            if isinstance(row, FileError):
+                self.report.file_error = {'line': line, 'error': str(row)}
+                break
+            try:
+                chunk.append(self.clean_row(row))
+            except RowError as error:
+                self.report.add_error(line, error.errors)
+                continue
+            if len(chunk) >= self.chunk_size:
+                self.write_chunk(chunk)
+                chunk = []
+        if chunk:
+            self.write_chunk(chunk)
+        return self.report
+
+    def clean_category(self, value: object) -> int:
+        """
+        :param value: id или название категории
+        :return: id категории
+        :raises ValueError: категории нет
+        """
+        text = '' if value is None else str(value).strip()
+        if text.isdigit() and int(text) in self.category_ids:
+            return int(text)
+        if text in self.ambiguous_names:
+            raise ValueError(f'Несколько категорий с названием "{text}", укажите id')
+        if text in self.categories_by_name:
+            return self.categories_by_name[text]
+        raise ValueError(f'Неизвестная категория "{text}"')
+
+    def clean_row(self, row: Row) -> CleanRow:
+        """
+        :param row: строка из read_rows
+        :return: несохранённый товар, пары (id характеристики, значение), пути изображений
+        :raises RowError: ошибки строки
+        """
+        if isinstance(row, ValueError):
+            raise RowError([str(row)])
+        errors = []
+
+        title = str(row.get('title') or '').strip()
+        if not title:
+            errors.append('Не указано название')
+        elif len(title) > Product._meta.get_field('title').max_length:
+            errors.append('Слишком длинное название')
+
+        color = str(row.get('color') or '').strip() or Product._meta.get_field('color').default
+        if not COLOR.match(color):
+            errors.append(f'Цвет должен быть в формате #RRGGBB, получено "{color}"')
+
+        category_id = None
+        try:
+            category_id = self.clean_category(row.get('category'))
+        except ValueError as error:
+            errors.append(str(error))
+
+        values = []
+        raw_values = row.get('characteristics') or {}
+        if not isinstance(raw_values, dict):
+            errors.append('characteristics должен быть объектом')
+        elif category_id is not None:
+            expected = self.characteristics[category_id]
+            for name in raw_values:
+                if name not in expected:
+                    errors.append(f'У категории нет характеристики "{name}"')
+            for name, characteristic in expected.items():
+                if name not in raw_values:
+                    errors.append(f'Не указана характеристика "{name}"')
+                    continue
+                try:
+                    value = characteristic.clean_value(raw_values[name])
+                except ValueError as error:
+                    errors.append(f'{name}: {error}')
+                    continue
+                ladder = self.ladders.get(characteristic.id)
+                is_ladder = characteristic.comparator == ComparatorStrategy.RATING \
+                    and characteristic.value_type == CharacteristicType.str
+                if is_ladder and ladder and value not in ladder:
+                    errors.append(f'{name}: значения "{value}" нет в рейтинговой шкале')
+                    continue
+                values.append((characteristic.id, value))
+
+        images = row.get('images') or []
+        if not isinstance(images, list):
+            errors.append('images должен быть списком')
+            images = []
+        images = [str(image).strip() for image in images]
+        max_length = ProductImage._meta.get_field('image').max_length
+        for image in images:
+            if image.startswith('/') or '..' in image.split('/') or len(image) > max_length:
+                errors.append(f'Недопустимый путь изображения "{image}"')
+
+        if errors:
+            raise RowError(errors)
+        # счётчики товара заполняются сразу: bulk_create не вызывает сигналы
+        product = Product(author=self.author, category_id=category_id, title=title,
+                          description=str(row.get('description') or ''), color=color,
+                          image_count=len(images), primary_image=images[0] if images else '',
+                          store_count=int(self.store is not None))
+        return product, values, images
+
+    def write_chunk(self, chunk: List[CleanRow]) -> List[Product]:
+        """
+        Запись пачки: товары, затем их характеристики, изображения
+        и подтверждение магазином (id товаров возвращает bulk_create)
+
+        :param chunk: строки из clean_row
+        :return: созданные товары
+        """
+        with transaction.atomic():
+            products = Product.objects.bulk_create([product for product, _, _ in chunk])
+            ProductCharacteristic.objects.bulk_create([
+                ProductCharacteristic(product_id=product.id, characteristic_id=characteristic_id,
+                                      value=value)
+                for product, (_, values, _) in zip(products, chunk)
+                for characteristic_id, value in values
+            ])
+            ProductImage.objects.bulk_create([
+                ProductImage(product_id=product.id, image=image)
+                for product, (_, _, images) in zip(products, chunk)
+                for image in images
+            ])
+            if self.store is not None:
+                StoreProduct.objects.bulk_create([
+                    StoreProduct(product_id=product.id, store=self.store) for product in products
+                ])
+        self.report.created += len(chunk)
+        return products
+
+
+class ProductBatchError(ValueError):
+    """
+    Ошибки в товарах пачки create_products
+
+    :param errors: [{'index': номер товара в пачке, 'errors': [сообщения]}]
+    """
+
+    def __init__(self, errors: List[dict]):
+        super().__init__(f'Ошибки в {len(errors)} товарах')
+        self.errors = errors
+
+
+def create_products(author: User, category_id: int, items: List[object]) -> List[Product]:
+    """
+    Создание пачки товаров одной категории: все товары проверяются,
+    и если ошибок нет, записываются одной транзакцией вместе с
+    характеристиками и изображениями, а бонусы автору начисляются
+    одним UPDATE. Поля товара - как у строки JSONL (см. read_rows),
+    категория берётся из аргумента
+
+    :param author: автор товаров
+    :param category_id: id категории
+    :param items: товары
+    :return: созданные товары
+    :raises ProductBatchError: хотя бы один товар не прошёл проверку, ничего не записано
+    """
+    importer = ProductImporter(author, chunk_size=len(items), category_ids=[category_id])
+    rows = []
+    errors = []
+    for index, item in enumerate(items):
+        try:
+            if not isinstance(item, dict):
+                raise RowError(['Ожидается JSON-объект'])
+            rows.append(importer.clean_row(dict(item, category=category_id)))
+        except RowError as error:
+            errors.append({'index': index, 'errors': error.errors})
+    if errors:
+        raise ProductBatchError(errors)
+    with transaction.atomic():
+        products = importer.write_chunk(rows)
+        author.product_bonuses(len(products))
+    return products
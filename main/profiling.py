@@ -0,0 +1,132 @@
+"""
+Профилирование отдельных запросов (см. ProfilingMiddleware)
+"""
+
+import cProfile
+import hmac
+import json
+import os
+import pstats
+import random
+import time
+from typing import List, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+
+def should_profile(request) -> bool:
+    """
+    Профилируется запрос с заголовком X-Profile-Token, совпадающим
+    с PROFILING_TOKEN, и доля PROFILING_SAMPLE_RATE остальных запросов
+
+    :param request: объект с деталями запроса
+    :return: нужно ли профилировать запрос
+    """
+    token = settings.PROFILING_TOKEN
+    header = request.headers.get('X-Profile-Token')
+    if token and header and hmac.compare_digest(header, token):
+        return True
+    return random.random() < settings.PROFILING_SAMPLE_RATE
+
+
+def get_top_functions(profiler: cProfile.Profile, count: int) -> List[dict]:
+    """
+    :param profiler: завершённый профиль
+    :param count: количество функций
+    :return: функции с наибольшим накопленным временем
+    """
+    stats = pstats.Stats(profiler).sort_stats('cumulative')
+    top = []
+    for function in stats.fcn_list[:count]:
+        _, calls, total_time, cumulative_time, _ = stats.stats[function]
+        top.append({
+            'function': pstats.func_std_string(function),
+            'calls': calls,
+            'tottime_ms': round(total_time * 1000, 2),
+            'cumtime_ms': round(cumulative_time * 1000, 2),
+        })
+    return top
+
+
+def save_profile(profiler: cProfile.Profile, request, elapsed: float) -> str:
+    """
+    Запись профиля в PROFILING_DIR: сам профиль (.prof, открывается
+    pstats/snakeviz) и сводка (.json) для страницы профилей.
+    Хранятся только PROFILING_KEEP последних профилей
+
+    :param profiler: завершённый профиль
+    :param request: объект с деталями запроса
+    :param elapsed: время обработки запроса в секундах
+    :return: имя профиля
+    """
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    match = request.resolver_match
+    url_name = match.url_name if match is not None and match.url_name else 'unknown'
+    name = f'{time.time_ns()}_{url_name}'
+
+    profiler.dump_stats(os.path.join(settings.PROFILING_DIR, f'{name}.prof'))
+    summary = {
+        'name': name,
+        'url_name': url_name,
+        'method': request.method,
+        'path': request.path,
+        'elapsed_ms': round(elapsed * 1000, 2),
+        'created_at': timezone.now().isoformat(),
+        'top': get_top_functions(profiler, settings.PROFILING_TOP_FUNCTIONS),
+    }
+    with open(os.path.join(settings.PROFILING_DIR, f'{name}.json'), 'w', encoding='utf-8') as file:
+        json.dump(summary, file, ensure_ascii=False)
+
+    rotate_profiles()
+    return name
+
+
+def get_profile_names() -> List[str]:
+    """
+    :return: имена сохранённых профилей, от старых к новым
+    """
+    if not os.path.isdir(settings.PROFILING_DIR):
+        return []
+    return sorted(file_name[:-len('.json')] for file_name in os.listdir(settings.PROFILING_DIR)
+                  if file_name.endswith('.json'))
+
+
+def rotate_profiles() -> None:
+    """
+    Удаление профилей сверх PROFILING_KEEP последних
+    """
+    names = get_profile_names()
+    for name in names[:max(len(names) - settings.PROFILING_KEEP, 0)]:
+        for extension in ('.json', '.prof'):
+            try:
+                os.remove(os.path.join(settings.PROFILING_DIR, name + extension))
+            except FileNotFoundError:
+                pass
+
+
+def get_slowest_profiles(count: int) -> List[dict]:
+    """
+    :param count: количество профилей
+    :return: сводки самых медленных из сохранённых профилей
+    """
+    summaries = []
+    for name in get_profile_names():
+        try:
+            path = os.path.join(settings.PROFILING_DIR, f'{name}.json')
+            with open(path, encoding='utf-8') as file:
+                summaries.append(json.load(file))
+        except (FileNotFoundError, ValueError):
+            # профиль удалён ротацией или ещё дописывается
+            continue
+    return sorted(summaries, key=lambda summary: summary['elapsed_ms'], reverse=True)[:count]
+
+
+def get_profile_path(name: str) -> Optional[str]:
+    """
+    :param name: имя профиля
+    :return: путь к файлу профиля или None, если такого профиля нет
+    """
+    if name not in get_profile_names():
+        return None
+    return os.path.join(settings.PROFILING_DIR, f'{name}.prof')
@@ -0,0 +1,101 @@
+"""
+Сброс кэшей и счётчиков товаров при изменении моделей и настройка
+новых соединений с БД
+"""
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from main.db import apply_sqlite_pragmas
+from main.models import Application, User, UserAvatar, StoreManager, Product, ProductImage, \
+    StoreProduct, ComparingReview
+
+
+@receiver(post_save, sender=Application)
+@receiver(post_delete, sender=Application)
+def invalidate_pending_applications(sender, **kwargs):
+    """
+    Заявка создана, рассмотрена или удалена - количество заявок в меню модератора устарело
+    """
+    Application.invalidate_pending_count()
+
+
+@receiver(post_save, sender=UserAvatar)
+@receiver(post_delete, sender=UserAvatar)
+@receiver(post_save, sender=StoreManager)
+@receiver(post_delete, sender=StoreManager)
+def invalidate_user_identity(sender, instance, **kwargs):
+    """
+    Изменился аватар или представительство магазина - кэш пользователя устарел
+    """
+    User.invalidate_identity(instance.user_id)
+
+
+@receiver(post_save, sender=ProductImage)
+def count_added_image(sender, instance, created, **kwargs):
+    """
+    Новое изображение товара - счётчик и первое изображение товара
+    """
+    if created:
+        Product.image_added(instance)
+
+
+@receiver(post_delete, sender=ProductImage)
+def count_removed_image(sender, instance, **kwargs):
+    """
+    Удалено изображение - счётчик и первое изображение товара
+    """
+    Product.image_removed(instance)
+
+
+@receiver(post_save, sender=StoreProduct)
+def count_added_store(sender, instance, created, **kwargs):
+    """
+    Магазин подтвердил товар - счётчик магазинов товара
+    """
+    if created:
+        Product.change_counter([instance.product_id], 'store_count', 1)
+
+
+@receiver(post_delete, sender=StoreProduct)
+def count_removed_store(sender, instance, **kwargs):
+    """
+    Магазин убрал товар - счётчик магазинов товара
+    """
+    Product.change_counter([instance.product_id], 'store_count', -1)
+
+
+@receiver(post_save, sender=ComparingReview)
+def count_added_review(sender, instance, created, **kwargs):
+    """
+    Новый обзор - счётчики обзоров обоих товаров
+    """
+    if created:
+        Product.change_counter({instance.first_id, instance.second_id}, 'review_count', 1)
+
+
+@receiver(post_delete, sender=ComparingReview)
+def count_removed_review(sender, instance, **kwargs):
+    """
+    Удалённый обзор - счётчики обзоров обоих товаров. Обзор, скрытый
+    вместе с удалённым товаром, из счётчиков уже вычтен (Product.soft_delete)
+    """
+    if instance.deleted_at is None:
+        Product.change_counter({instance.first_id, instance.second_id}, 'review_count', -1)
+
+
+@receiver(connection_created)
+def configure_sqlite_connection(sender, connection, **kwargs):
+    """
+    Новое соединение с SQLite - выполняем SQLITE_PRAGMAS. Курсор берётся
+    у самого соединения sqlite3, минуя обёртки Django: служебные PRAGMA
+    не должны попадать в бюджеты запросов, метрики и журнал
+    """
+    if connection.vendor == 'sqlite':
+        cursor = connection.connection.cursor()
+        try:
+            apply_sqlite_pragmas(cursor, settings.SQLITE_PRAGMAS)
+        finally:
+            cursor.close()
@@ -0,0 +1,171 @@
+"""
+Журнал медленных запросов к БД с планом выполнения
+"""
+
+import os
+import re
+import threading
+import time
+import traceback
+from collections import deque
+from typing import List, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+# Полный просмотр таблицы: "SCAN main_product" (старые SQLite - "SCAN TABLE main_product"),
+# но не "SCAN main_product USING INDEX ..."
+FULL_SCAN = re.compile(r'^SCAN (TABLE )?\w+$')
+
+STACK_DEPTH = 6
+
+
+class SlowQueryLog:
+    """
+    Последние SLOW_QUERY_LOG_SIZE медленных запросов процесса
+    """
+
+    def __init__(self):
+        self._entries = deque()
+        self._lock = threading.Lock()
+
+    def add(self, entry: dict) -> None:
+        """
+        :param entry: запись о запросе, самые старые записи сверх размера журнала удаляются
+        """
+        with self._lock:
+            self._entries.append(entry)
+            while len(self._entries) > settings.SLOW_QUERY_LOG_SIZE:
+                self._entries.popleft()
+
+    def entries(self) -> List[dict]:
+        """
+        :return: записи журнала, от новых к старым
+        """
+        with self._lock:
+            return list(reversed(self._entries))
+
+    def clear(self) -> None:
+        """
+        Очистка журнала
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+SLOW_QUERY_LOG = SlowQueryLog()
+
+# Флаг "сейчас выполняется EXPLAIN" для потока: запрос плана сам проходит
+# через execute_wrapper и не должен попадать в журнал
+_explaining = threading.local()
+
+
+def is_explaining() -> bool:
+    """
+    :return: выполняется ли сейчас в потоке служебный EXPLAIN журнала
+        (такие запросы не учитываются ни в журнале, ни в бюджетах и метриках)
+    """
+    return getattr(_explaining, 'active', False)
+
+
+def is_project_frame(filename: str) -> bool:
+    """
+    :param filename: файл кадра стека
+    :return: относится ли кадр к коду проекта (а не к Django, библиотекам или самому журналу)
+    """
+    if not filename.startswith(settings.BASE_DIR) or 'site-packages' in filename:
+        return False
+    return not filename.endswith(('slow_queries.py', 'middleware.py'))
+
+
+def get_stack_summary() -> List[str]:
+    """
+    :return: последние кадры стека из кода проекта (без Django и библиотек)
+    """
+    frames = [frame for frame in traceback.extract_stack()[:-3] if is_project_frame(frame.filename)]
+    return [f'{os.path.relpath(frame.filename, settings.BASE_DIR)}:{frame.lineno} in {frame.name}'
+            for frame in frames[-STACK_DEPTH:]]
+
+
+def explain(connection, sql: str, params) -> Optional[List[str]]:
+    """
+    :param connection: подключение, в котором выполнялся запрос
+    :param sql: запрос
+    :param params: параметры запроса
+    :return: строки плана выполнения (None для других СУБД или при ошибке)
+    """
+    if connection.vendor != 'sqlite':
+        return None
+    _explaining.active = True
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return [row[-1] for row in cursor.fetchall()]
+    except Exception:  # pylint: disable=broad-except
+        # план - вспомогательная информация, запрос пользователя уже выполнен
+        return None
+    finally:
+        _explaining.active = False
+
+
+class QueryTimer:
+    """
+    Основа execute_wrapper, замеряющего время запросов к БД: наследники
+    получают каждый замеренный запрос в on_query. Служебные EXPLAIN
+    журнала не замеряются
+    """
+
+    def __call__(self, execute, sql, params, many, context):
+        if is_explaining():
+            return execute(sql, params, many, context)
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.on_query((sql, params, many, context), time.perf_counter() - start)
+
+    def on_query(self, query: tuple, elapsed: float) -> None:
+        """
+        :param query: аргументы execute_wrapper (sql, params, many, context)
+        :param elapsed: время выполнения в секундах
+        """
+        raise NotImplementedError
+
+
+class SlowQueryRecorder(QueryTimer):
+    """
+    execute_wrapper, записывающий запросы дольше SLOW_QUERY_THRESHOLD_MS
+    в журнал вместе со страницей, стеком и планом выполнения
+
+    :param request: запрос, при обработке которого выполняются запросы к БД
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+    def on_query(self, query: tuple, elapsed: float) -> None:
+        elapsed_ms = elapsed * 1000
+        if elapsed_ms >= settings.SLOW_QUERY_THRESHOLD_MS:
+            self.record(query, elapsed_ms)
+
+    def record(self, query: tuple, elapsed_ms: float) -> None:
+        """
+        Запись запроса в журнал вместе со страницей, стеком и планом
+
+        :param query: аргументы execute_wrapper (sql, params, many, context)
+        :param elapsed_ms: время выполнения в мс
+        """
+        sql, params, many, context = query
+        match = self.request.resolver_match
+        plan = None if many else explain(context['connection'], sql, params)
+        SLOW_QUERY_LOG.add({
+            'created_at': timezone.now().isoformat(),
+            'url_name': match.url_name if match is not None and match.url_name else 'unknown',
+            'path': self.request.path,
+            'time_ms': round(elapsed_ms, 2),
+            'sql': sql,
+            'params': [str(param) for param in params] if params and not many else [],
+            'stack': get_stack_summary(),
+            'plan': plan,
+            'full_scan': any(FULL_SCAN.match(step) for step in plan or []),
+        })
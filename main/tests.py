@@ -2,10 +2,43 @@
 Тесты сайта, направленные на выявление и исправление багов и других логических ошибок
 """
 
-from django.test import TestCase, Client, tag
-from django.urls import reverse
+import contextvars
+import csv
+import json
+import os
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
 
-from main.models import User
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection, connections, transaction
+from django.test.utils import CaptureQueriesContext
+from django.test import TestCase, TransactionTestCase, LiveServerTestCase, Client, tag, \
+    override_settings
+from django.urls import reverse, get_resolver, URLPattern
+from django.utils import timezone
+
+from main.models import User, CategoryCharacteristic, CategoryStringCharacteristicRating, \
+    Product, ProductRateFact, PendingRating, PendingProductRating, bayesian_score, \
+    ArchivedProductRateFact, ProductRatingRollup, ProductDailyViews, TrendingProduct, \
+    TrendingLandmark, \
+    ProductVisitorSketch, Application, Store, StoreManager, UserAvatar, ProductImage, \
+    StoreProduct, ComparingReview, ReviewRateFact, ProductCategory, ProductCharacteristic
+from main.characteristic import CharacteristicType
+from main.db import apply_sqlite_pragmas, ReadReplicaRouter, use_primary, reset_primary
+from main.flusher import PeriodicFlusher
+from main.hyperloglog import HyperLogLog
+from main.management.commands.advise_indexes import get_candidates
+from main.middleware import QueryStats, QueryBudgetExceeded, check_query_budget
+from main.product_import import ProductImporter
+from main.profiling import get_profile_names
+from main.slow_queries import SLOW_QUERY_LOG
+from main.view_counter import ViewCounter, VIEW_COUNTER
 
 
 class UserTestCase(TestCase):
@@ -207,6 +240,24 @@ class ProductViewTestCase(TestCase):
         self.assertEqual(str(messages[0]), 'Благодарим за оценку!')
         self.assertEqual(response.context['product'].user_rated, 1)
 
+    def test_invalid_rating_rejected(self):
+        """
+        Проверка, что оценка вне шкалы или не число не ломает страницы товара и обзора
+
+        """
+        self.client.force_login(User.objects.get(username='petya'))
+        review = ComparingReview.objects.create(name='Обзор', author_id=1, first_id=1, second_id=1)
+        pages = [reverse('product_page', kwargs={'product_id': 1}),
+                 reverse('comparing_review', kwargs={'rev_id': review.id})]
+        for page in pages:
+            for rating in ('6', '0', '-1', 'abc', '4.5'):
+                response = self.client.post(page, {'rating': rating})
+                self.assertEqual(response.status_code, 200)
+                messages = list(response.context['messages'])
+                self.assertEqual(str(messages[0]), 'Оценка должна быть от 1 до 5')
+        self.assertEqual(Product.objects.get(id=1).user_rated, 0)
+        self.assertEqual(ComparingReview.objects.get(id=review.id).user_rated, 0)
+
     def test_no_authorized_user_rates(self):
         """
         Проверка оценки товара незарегестрированным пользователем
@@ -226,3 +277,1638 @@ class ProductViewTestCase(TestCase):
         response = self.client.get(reverse('product_page', kwargs={'product_id': 2}))
         self.assertContains(response, 'Категория', status_code=200)
         self.assertContains(response, 'Наушники', status_code=200)
+
+
+class RatingLadderTestCase(TestCase):
+    """
+    Класс тестов рейтинговых шкал строковых характеристик
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'category_characteristics.json'
+    ]
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.characteristic = CategoryCharacteristic.objects.get(id=3)
+
+    def test_replace_ladder(self):
+        """
+        Проверка полной замены шкалы
+
+        """
+        CategoryStringCharacteristicRating.replace_ladder(self.characteristic,
+                                                          ['пластик', 'металл'])
+        CategoryStringCharacteristicRating.replace_ladder(self.characteristic,
+                                                          ['дерево', 'пластик', 'металл'])
+        ladder = CategoryStringCharacteristicRating.get_ladder(self.characteristic)
+        self.assertEqual([item['value'] for item in ladder], ['дерево', 'пластик', 'металл'])
+        self.assertEqual([item['rating'] for item in ladder], [1, 2, 3])
+
+    def test_replace_ladder_duplicates(self):
+        """
+        Проверка отказа при нарушении уникальности до записи в БД
+
+        """
+        CategoryStringCharacteristicRating.replace_ladder(self.characteristic, ['пластик'])
+        with self.assertRaises(ValueError):
+            CategoryStringCharacteristicRating.replace_ladder(
+                self.characteristic, [('металл', 1), ('дерево', 1)]
+            )
+        ladder = CategoryStringCharacteristicRating.get_ladder(self.characteristic)
+        self.assertEqual(ladder, [{'value': 'пластик', 'rating': 1}])
+
+    def test_reorder_ladder_invalidates_cache(self):
+        """
+        Проверка перестановки шкалы командой и сброса кэша
+
+        """
+        CategoryStringCharacteristicRating.replace_ladder(self.characteristic,
+                                                          ['пластик', 'металл'])
+        CategoryStringCharacteristicRating.get_ladder(self.characteristic)
+        call_command('load_rating_ladder', self.characteristic.id, 'металл', 'пластик',
+                     '--reorder', stdout=StringIO())
+        ladder = CategoryStringCharacteristicRating.get_ladder(self.characteristic)
+        self.assertEqual(ladder[0], {'value': 'металл', 'rating': 1})
+        with self.assertRaises(CommandError):
+            call_command('load_rating_ladder', self.characteristic.id, 'дерево',
+                         '--reorder', stdout=StringIO())
+
+
+class ConcurrentRatingTestCase(TransactionTestCase):
+    """
+    Класс тестов параллельного оценивания одного товара
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json'
+    ]
+
+    THREADS = 16
+
+    def setUp(self) -> None:
+        self.product = Product.objects.get(id=1)
+        self.users = [User.objects.create(username=f'rater{index}')
+                      for index in range(self.THREADS)]
+
+    def test_concurrent_rates(self):
+        """
+        Проверка, что параллельные оценки не теряются и не дублируются:
+        каждый пользователь дважды оценивает один и тот же товар
+
+        """
+        barrier = threading.Barrier(self.THREADS)
+        results = []
+
+        def worker(user, rating):
+            try:
+                barrier.wait()
+                product = Product.objects.get(id=self.product.id)
+                results.append(user.rate(product, rating))
+                results.append(user.rate(product, rating))
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(user, index % 5 + 1))
+                   for index, user in enumerate(self.users)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.product.refresh_from_db()
+        expected = sum(index % 5 + 1 for index in range(self.THREADS)) / self.THREADS
+        self.assertEqual(results.count(True), self.THREADS)
+        self.assertEqual(ProductRateFact.objects.filter(product=self.product).count(),
+                         self.THREADS)
+        self.assertEqual(self.product.user_rated, self.THREADS)
+        self.assertAlmostEqual(self.product.rating, expected)
+
+
+@override_settings(RATING_BUFFER_ENABLED=True, RATING_BUFFER_FLUSH_INTERVAL=0)
+class RatingBufferTestCase(TestCase):
+    """
+    Класс тестов буфера оценок
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json',
+        'product_rate_facts.json'
+    ]
+
+    def setUp(self) -> None:
+        self.vasya = User.objects.get(username='vasya')
+        self.petya = User.objects.get(username='petya')
+        self.product = Product.objects.get(id=1)
+
+    def test_rating_visible_before_flush(self):
+        """
+        Проверка, что оценка из буфера сразу видна пользователю,
+        но агрегат товара обновляется только при сбросе
+
+        """
+        self.assertTrue(self.petya.rate(self.product, 4))
+        self.assertFalse(self.petya.rate(self.product, 5))
+        self.assertEqual(self.petya.get_rating(self.product), 4)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.user_rated, 0)
+
+        self.client.force_login(self.petya)
+        response = self.client.get(reverse('product_page', kwargs={'product_id': 1}))
+        self.assertEqual(response.context['user_rating'], 4)
+
+    def test_flush_batches_aggregates(self):
+        """
+        Проверка переноса пачки оценок одним обновлением агрегата
+
+        """
+        self.petya.rate(self.product, 4)
+        self.vasya.rate(self.product, 2)
+        self.assertFalse(self.vasya.rate(Product.objects.get(id=2), 3))
+
+        call_command('flush_ratings', stdout=StringIO())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.user_rated, 2)
+        self.assertAlmostEqual(self.product.rating, 3.0)
+        self.assertEqual(PendingProductRating.objects.count(), 0)
+        self.assertFalse(self.petya.rate(self.product, 1))
+
+    def test_flush_skips_existing_facts(self):
+        """
+        Проверка, что сброс не дублирует уже существующий факт оценки
+
+        """
+        PendingProductRating.objects.create(user=self.vasya, product_id=2, rating=1)
+        PendingRating.flush_all()
+        self.assertEqual(ProductRateFact.objects.filter(user=self.vasya, product_id=2).count(), 1)
+        self.assertEqual(Product.objects.get(id=2).user_rated, 0)
+
+
+class RatingScoreTestCase(TestCase):
+    """
+    Класс тестов гистограммы оценок и байесовской оценки
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json'
+    ]
+
+    def test_histogram_and_score(self):
+        """
+        Проверка инкрементального обновления гистограммы и оценки
+
+        """
+        product = Product.objects.get(id=1)
+        User.objects.get(username='vasya').rate(product, 5)
+        User.objects.get(username='petya').rate(product, 3)
+        product.refresh_from_db()
+        self.assertEqual(product.get_rating_histogram(), {1: 0, 2: 0, 3: 1, 4: 0, 5: 1})
+        self.assertAlmostEqual(product.score, bayesian_score(4.0, 2))
+
+    def test_invalid_rating(self):
+        """
+        Проверка отказа при оценке вне шкалы
+
+        """
+        with self.assertRaises(ValueError):
+            User.objects.get(username='vasya').rate(Product.objects.get(id=1), 6)
+
+    def test_catalog_sorted_by_score(self):
+        """
+        Проверка, что единственная пятёрка не обгоняет много высоких оценок
+
+        """
+        Product.objects.filter(id=2).update(rating=5.0, user_rated=1, score=bayesian_score(5.0, 1))
+        Product.objects.filter(id=3).update(rating=4.8, user_rated=2000,
+                                            score=bayesian_score(4.8, 2000))
+        response = self.client.get(reverse('catalog'), {'sort_filter': 'rating'})
+        self.assertEqual([product.id for product in response.context['products']], [3, 2, 1])
+        response = self.client.get(reverse('catalog'), {'sort_filter': 'title; --'})
+        self.assertEqual(response.status_code, 404)
+
+
+class RateFactArchiveTestCase(TestCase):
+    """
+    Класс тестов архивации фактов оценки
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json',
+        'product_rate_facts.json'
+    ]
+
+    def setUp(self) -> None:
+        self.vasya = User.objects.get(username='vasya')
+        call_command('archive_rate_facts', '--older-than-days', '30', '--chunk-size', '1',
+                     stdout=StringIO())
+
+    def test_facts_moved_to_archive(self):
+        """
+        Проверка переноса фактов в архив, сводки и счётчики пользователя
+
+        """
+        self.assertEqual(ProductRateFact.objects.count(), 0)
+        self.assertEqual(ArchivedProductRateFact.objects.count(), 2)
+        rollup = ProductRatingRollup.objects.get(product_id=2)
+        self.assertEqual([rollup.rated_1, rollup.rated_4, rollup.rated_5], [0, 0, 1])
+        self.assertEqual(self.vasya.userratingsummary.archived_product_rates, 2)
+
+    def test_rebuild_reads_rollups(self):
+        """
+        Проверка, что пересчёт агрегатов учитывает архивные оценки по сводкам,
+        не читая архивные факты
+
+        """
+        ArchivedProductRateFact.objects.all().delete()
+        call_command('rebuild_rating_aggregates', stdout=StringIO())
+        product = Product.objects.get(id=2)
+        self.assertEqual((product.rating, product.user_rated, product.rated_5), (5.0, 1, 1))
+
+    def test_queries_see_archive(self):
+        """
+        Проверка, что профиль и повторная оценка учитывают архив
+
+        """
+        self.assertEqual(self.vasya.get_product_rate_count(), 2)
+        self.assertEqual(len(self.vasya.get_all_rated_products()), 2)
+        self.assertEqual(self.vasya.get_rating(Product.objects.get(id=2)), 5)
+        self.assertFalse(self.vasya.rate(Product.objects.get(id=2), 1))
+        self.assertEqual(Product.objects.get(id=2).user_rated, 0)
+
+
+class RebuildRatingAggregatesTestCase(TestCase):
+    """
+    Класс тестов пересчёта агрегатов рейтинга по фактам
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json',
+        'product_rate_facts.json'
+    ]
+
+    def test_rebuild_fixes_drift(self):
+        """
+        Проверка исправления разошедшихся агрегатов: в фикстурах
+        есть факты оценки, а рейтинги товаров нулевые
+
+        """
+        Product.objects.filter(id=1).update(rating=4.0, user_rated=3)
+        out = StringIO()
+        call_command('rebuild_rating_aggregates', '--chunk-size', '2', stdout=out)
+        self.assertIn('Product #1', out.getvalue())
+        self.assertIn('Product #2', out.getvalue())
+
+        product = Product.objects.get(id=2)
+        self.assertEqual((product.rating, product.user_rated, product.rated_5), (5.0, 1, 1))
+        self.assertAlmostEqual(product.score, bayesian_score(5.0, 1))
+        self.assertEqual(Product.objects.get(id=1).user_rated, 0)
+
+        out = StringIO()
+        call_command('rebuild_rating_aggregates', '--dry-run', stdout=out)
+        self.assertNotIn('Product #', out.getvalue())
+
+
+class ViewCounterTestCase(TestCase):
+    """
+    Класс тестов отложенной записи просмотров
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json'
+    ]
+
+    def test_product_page_counts_views(self):
+        """
+        Проверка учёта просмотров страницы товара в общем счётчике и за день
+
+        """
+        self.client.get(reverse('product_page', kwargs={'product_id': 1}))
+        response = self.client.get(reverse('product_page', kwargs={'product_id': 1}))
+        self.assertEqual(response.context['views'], {'today': 2, 'week': 2, 'month': 2})
+        self.assertEqual(Product.objects.get(id=1).views, 2)
+        self.assertEqual(ProductDailyViews.objects.get(product_id=1).views, 2)
+
+    def test_old_days_not_reset(self):
+        """
+        Проверка, что просмотры прошлых дней попадают в неделю и месяц,
+        но не в сегодняшние
+
+        """
+        today = timezone.localdate()
+        ProductDailyViews.objects.create(product_id=1, day=today - timedelta(days=3), views=5)
+        ProductDailyViews.objects.create(product_id=1, day=today - timedelta(days=20), views=7)
+        ProductDailyViews.objects.create(product_id=1, day=today - timedelta(days=40), views=9)
+        views = ProductDailyViews.get_views(Product.objects.get(id=1))
+        self.assertEqual(views, {'today': 0, 'week': 5, 'month': 12})
+
+    @override_settings(TRENDING_WEIGHTS={'view': 0, 'rating': 5, 'review': 10})
+    def test_write_groups_increments(self):
+        """
+        Проверка, что сброс делает один UPDATE на каждое значение прироста:
+        проверка товаров, вставка сводок и по два UPDATE сводок и счётчиков
+        (популярность отключена нулевым весом, она проверяется отдельно)
+
+        """
+        today = timezone.localdate()
+        with self.assertNumQueries(6):
+            ViewCounter.write({(1, today): 2, (2, today): 2, (3, today): 1})
+        self.assertEqual(list(Product.objects.order_by('id').values_list('views', flat=True)),
+                         [2, 2, 1])
+        ViewCounter.write({(3, today): 1})
+        self.assertEqual(ProductDailyViews.objects.get(product_id=3, day=today).views, 2)
+
+    def test_size_kept_with_pending(self):
+        """
+        Проверка, что количество незаписанных просмотров растёт при учёте
+        и обнуляется сбросом
+
+        """
+        counter = ViewCounter()
+        for product_id in (1, 1, 2):
+            counter.record(product_id)
+        self.assertEqual(counter.size(), 3)
+        self.assertEqual(counter.flush(), 3)
+        self.assertEqual(counter.size(), 0)
+        self.assertEqual(Product.objects.get(id=1).views, 2)
+
+    def test_catalog_sorted_by_views_today(self):
+        """
+        Проверка сортировки каталога по просмотрам за сегодня
+
+        """
+        today = timezone.localdate()
+        ProductDailyViews.objects.create(product_id=2, day=today, views=3)
+        ProductDailyViews.objects.create(product_id=3, day=today - timedelta(days=1), views=10)
+        response = self.client.get(reverse('catalog'), {'sort_filter': 'views'})
+        self.assertEqual(response.context['products'][0].id, 2)
+
+
+class TrendingProductTestCase(TestCase):
+    """
+    Класс тестов популярности товаров с затуханием
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json'
+    ]
+
+    def test_recent_events_outweigh_old(self):
+        """
+        Проверка, что событие период полураспада назад весит вдвое меньше нового
+
+        """
+        TrendingLandmark.objects.create(id=1, landmark=timezone.now() - timedelta(hours=24))
+        TrendingProduct.add_events({1: 10})
+        TrendingLandmark.objects.filter(id=1).update(landmark=timezone.now() - timedelta(hours=48))
+        TrendingProduct.add_events({2: 10})
+        first = TrendingProduct.objects.get(product_id=1).score
+        second = TrendingProduct.objects.get(product_id=2).score
+        self.assertAlmostEqual(second / first, 2, places=3)
+        self.assertEqual([item.product_id for item in TrendingProduct.get_top()], [2, 1])
+
+    def test_rebase_keeps_order(self):
+        """
+        Проверка сдвига точки отсчёта: порядок сохраняется, затухшие товары удаляются
+
+        """
+        old = timezone.now() - timedelta(hours=24 * (TrendingProduct.REBASE_EXPONENT + 1))
+        TrendingLandmark.objects.create(id=1, landmark=old)
+        TrendingProduct.objects.create(product_id=1, category_id=1, score=2.0 ** 60)
+        TrendingProduct.objects.create(product_id=2, category_id=1, score=1.0)
+        TrendingProduct.add_events({3: 1})
+        self.assertGreater(TrendingLandmark.objects.get(id=1).landmark, old)
+        self.assertEqual(list(TrendingProduct.objects.order_by('-score').values_list(
+            'product_id', flat=True)), [3, 1])
+
+    def test_rebase_applied_once(self):
+        """
+        Проверка, что сдвиг по устаревшей точке отсчёта (её уже сдвинул
+        другой процесс) не делит счета второй раз
+
+        """
+        old = timezone.now() - timedelta(hours=24 * (TrendingProduct.REBASE_EXPONENT + 1))
+        TrendingLandmark.objects.create(id=1, landmark=old)
+        TrendingProduct.objects.create(product_id=1, category_id=1, score=2.0 ** 70)
+        moment = timezone.now()
+        self.assertTrue(TrendingProduct.rebase(old, moment))
+        score = TrendingProduct.objects.get(product_id=1).score
+        self.assertFalse(TrendingProduct.rebase(old, moment + timedelta(hours=1)))
+        self.assertEqual(TrendingProduct.objects.get(product_id=1).score, score)
+        self.assertEqual(TrendingLandmark.objects.get(id=1).landmark, moment)
+
+    def test_view_and_rating_feed_trending(self):
+        """
+        Проверка, что просмотры и оценки учитываются в популярности и
+        топ показывается в каталоге
+
+        """
+        self.client.get(reverse('product_page', kwargs={'product_id': 2}))
+        User.objects.get(id=1).rate(Product.objects.get(id=3), 5)
+        response = self.client.get(reverse('catalog'))
+        self.assertEqual([item.product_id for item in response.context['trending']], [3, 2])
+
+
+class UniqueVisitorsTestCase(TestCase):
+    """
+    Класс тестов подсчёта уникальных посетителей
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json'
+    ]
+
+    def test_sketch_estimate(self):
+        """
+        Проверка точности оценки и объединения скетчей
+
+        """
+        first, second = HyperLogLog(), HyperLogLog()
+        for index in range(5000):
+            first.add(f'visitor{index}')
+            second.add(f'visitor{index + 2500}')
+        self.assertAlmostEqual(first.count(), 5000, delta=5000 * 0.2)
+        merged = HyperLogLog.merge([first, second])
+        self.assertAlmostEqual(merged.count(), 7500, delta=7500 * 0.2)
+        self.assertEqual(bytes(HyperLogLog(bytes(merged))), bytes(merged))
+
+        small = HyperLogLog()
+        for value in ('a', 'b', 'c', 'a'):
+            small.add(value)
+        self.assertEqual(small.count(), 3)
+
+    def test_product_page_counts_uniques(self):
+        """
+        Проверка, что повторные просмотры одного посетителя не увеличивают
+        количество уникальных, а дни объединяются в неделю
+
+        """
+        sketch = HyperLogLog()
+        sketch.add('user:2')
+        ProductVisitorSketch.objects.create(product_id=1,
+                                            day=timezone.localdate() - timedelta(days=2),
+                                            registers=bytes(sketch))
+        self.client.get(reverse('product_page', kwargs={'product_id': 1}))
+        response = self.client.get(reverse('product_page', kwargs={'product_id': 1}))
+        self.assertEqual(response.context['views']['today'], 2)
+        self.assertEqual(response.context['uniques'], {'today': 1, 'week': 2, 'month': 2})
+
+        self.client.force_login(User.objects.get(id=1))
+        response = self.client.get(reverse('product_page', kwargs={'product_id': 1}))
+        self.assertEqual(response.context['uniques']['today'], 2)
+        self.assertEqual(ProductVisitorSketch.objects.filter(product_id=1).count(), 2)
+
+    def test_visitors_today_kept_in_memory(self):
+        """
+        Проверка, что скетч всех товаров за сегодня загружается из БД один раз,
+        а дальше пополняется при записи скетчей
+
+        """
+        sketch = HyperLogLog()
+        sketch.add('user:1')
+        ProductVisitorSketch.objects.create(product_id=2, day=timezone.localdate(),
+                                            registers=bytes(sketch))
+        with self.settings(UNIQUE_VISITORS_RELOAD_INTERVAL=0):
+            self.assertEqual(VIEW_COUNTER.visitors_today().count(), 1)
+
+        self.client.get(reverse('product_page', kwargs={'product_id': 1}))
+        with self.assertNumQueries(0):
+            self.assertEqual(VIEW_COUNTER.visitors_today().count(), 2)
+
+
+class ModerationContextTestCase(TestCase):
+    """
+    Класс тестов кэширования количества заявок в меню модератора
+    """
+    fixtures = [
+        'users.json',
+    ]
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.staff = User.objects.get(id=1)
+        self.staff.is_staff = True
+        self.staff.save()
+
+    def create_application(self) -> Application:
+        """
+        :return: новая заявка на магазин
+        """
+        return Application.objects.create(user=User.objects.get(id=2), email='store@example.com',
+                                          store_name='Магазин', store_address='Адрес',
+                                          agreement='agreements/agreement.pdf')
+
+    def test_anonymous_page_skips_applications(self):
+        """
+        Проверка, что для обычных посетителей заявки не запрашиваются
+
+        """
+        self.create_application()
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('index'))
+        self.assertFalse(any('main_application' in query['sql'] for query in queries))
+
+    def test_pending_count_cached_and_invalidated(self):
+        """
+        Проверка, что количество кэшируется и сбрасывается при создании
+        и рассмотрении заявки
+
+        """
+        self.assertEqual(Application.get_pending_count(), 0)
+        application = self.create_application()
+        self.assertEqual(Application.get_pending_count(), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(Application.get_pending_count(), 1)
+
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('catalog'))
+        self.assertContains(response, reverse('applications'))
+
+        self.client.get(reverse('application_reject', kwargs={'app_id': application.id}))
+        self.assertEqual(Application.get_pending_count(), 0)
+        response = self.client.get(reverse('catalog'))
+        self.assertNotContains(response, reverse('applications'))
+
+
+class UserIdentityCacheTestCase(TestCase):
+    """
+    Класс тестов кэширования аватара и роли пользователя
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json'
+    ]
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.user = User.objects.get(id=2)
+
+    def test_page_skips_identity_queries(self):
+        """
+        Проверка, что после первого запроса аватар и роль берутся из кэша
+
+        """
+        self.client.force_login(self.user)
+        self.client.get(reverse('catalog'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('product_page', kwargs={'product_id': 1}))
+        tables = ('main_useravatar', 'main_storemanager')
+        self.assertFalse(any(table in query['sql'] for query in queries for table in tables))
+
+    def test_identity_invalidated(self):
+        """
+        Проверка сброса кэша при назначении представителем магазина и смене аватара
+
+        """
+        self.assertFalse(self.user.is_store_manager())
+        self.assertEqual(self.user.get_avatar(), User.objects.get(id=2).get_avatar())
+
+        store = Store.objects.create(name='Магазин')
+        StoreManager.objects.create(store=store, user=self.user)
+        UserAvatar.objects.create(user=self.user, image='avatars/new.png')
+        user = User.objects.get(id=2)
+        self.assertIs(user.is_store_manager(), True)
+        self.assertEqual(user.get_store(), store)
+        self.assertTrue(user.get_avatar().endswith('avatars/new.png'))
+
+
+@tag('budget')
+class QueryBudgetTestCase(TestCase):
+    """
+    Обход всех страниц из simple_votings/urls.py на двух объёмах данных:
+    количество запросов не должно зависеть от количества данных,
+    а бюджет QUERY_BUDGETS проверяется QueryBudgetMiddleware
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'category_characteristics.json',
+        'products.json',
+        'product_characteristics.json',
+        'product_images.json',
+        'stores.json',
+        'store_managers.json',
+    ]
+
+    # Значения параметров маршрутов
+    ROUTE_KWARGS = {
+        'product_id': 1,
+        'cat_id': 1,
+        'category_id': 1,
+        'char_id': 1,
+        'rev_id': 1,
+        'user_id': 3,
+        'app_id': 1,
+        'name': 'missing',
+    }
+    # GET-параметры ajax-маршрутов
+    ROUTE_QUERY = {
+        'search': {'input_value': 'a'},
+        'review_selector_change': {'product_id': 1},
+        'review_add': {'first_id': 1},
+    }
+    # ajax-маршруты, принимающие только POST
+    POST_ROUTES = {
+        'product_add_image': {},
+        'remove_image': {'product': 3, 'image_id': 2},
+    }
+    SCALES = (1, 4)
+
+    def setUp(self) -> None:
+        cache.clear()
+        self.manager = User.objects.get(id=3)
+        self.manager.is_staff = True
+        self.manager.save()
+        Application.objects.create(user=User.objects.get(id=2), email='store@example.com',
+                                   store_name='Магазин', store_address='Адрес',
+                                   agreement='agreements/agreement.pdf')
+        self.created = 0
+
+    def grow_dataset(self, scale: int) -> None:
+        """
+        Дополнение данных до scale частей: на каждую часть 10 товаров
+        с картинками, магазином, оценками и обзорами
+
+        :param scale: количество частей
+        """
+        categories = list(ProductCategory.objects.all())
+        users = list(User.objects.all())
+        store = Store.objects.first()
+        for index in range(self.created, scale * 10):
+            product = Product.objects.create(title=f'Товар {index}', category=categories[index % 2],
+                                             author=users[0],
+                                             description='Описание')
+            ProductImage.objects.bulk_create([
+                ProductImage(product=product, image='product_images/x.jpg') for _ in range(2)
+            ])
+            StoreProduct.objects.create(product=product, store=store)
+            for user in users:
+                user.rate(product, index % 5 + 1)
+            review = ComparingReview.objects.create(name=f'Обзор {index}', author=users[0],
+                                                    first=product, second=Product.objects.get(id=1))
+            ReviewRateFact.objects.create(user=users[1], review=review, rating=4)
+        self.created = scale * 10
+
+    def get_routes(self):
+        """
+        :return: [(имя маршрута, url)] всех именованных страниц проекта
+        """
+        routes = []
+        for pattern in get_resolver().url_patterns:
+            if isinstance(pattern, URLPattern) and pattern.name:
+                kwargs = {name: self.ROUTE_KWARGS[name] for name in pattern.pattern.converters}
+                routes.append((pattern.name, reverse(pattern.name, kwargs=kwargs)))
+        return routes
+
+    def measure(self) -> dict:
+        """
+        Запрос всех страниц; изменения, сделанные страницей, откатываются
+
+        :return: {имя маршрута: количество запросов}
+        """
+        cache.clear()
+        counts = {}
+        for name, url in self.get_routes():
+            self.client.force_login(self.manager)
+            with transaction.atomic():
+                with CaptureQueriesContext(connection) as queries:
+                    if name in self.POST_ROUTES:
+                        self.client.post(url, self.POST_ROUTES[name],
+                                         HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+                    else:
+                        self.client.get(url, self.ROUTE_QUERY.get(name, {}),
+                                        HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+                counts[name] = len(queries)
+                transaction.set_rollback(True)
+        return counts
+
+    def test_query_count_independent_of_data_size(self):
+        """
+        Проверка, что ни одна страница не делает запросов на каждый товар/обзор
+
+        """
+        results = []
+        for scale in self.SCALES:
+            self.grow_dataset(scale)
+            results.append(self.measure())
+        for name, count in results[0].items():
+            with self.subTest(route=name):
+                self.assertEqual(results[-1][name], count)
+
+    @override_settings(QUERY_BUDGET_ACTION='raise', QUERY_BUDGETS={'catalog': {'time_ms': 0}})
+    def test_time_budget_only_logged(self):
+        """
+        Проверка, что превышение времени только пишется в лог: оно зависит от машины
+
+        """
+        with self.assertLogs('main.middleware', 'WARNING'):
+            self.assertEqual(self.client.get(reverse('catalog')).status_code, 200)
+
+    @override_settings(QUERY_BUDGET_ACTION='raise', QUERY_BUDGETS={'index': {'queries': 1}})
+    def test_flush_not_counted(self):
+        """
+        Проверка, что запросы сброса буфера в запросе не входят в бюджет страницы
+
+        """
+        stats = QueryStats()
+        flusher = PeriodicFlusher('test', User.objects.count, 'TEST_FLUSH_INTERVAL')
+        with connection.execute_wrapper(stats):
+            User.objects.count()
+            flusher.flush_safely()
+            flusher.flush_safely()
+        self.assertEqual((stats.count, stats.flush_count), (1, 2))
+        check_query_budget('index', stats)
+        stats.count += 1
+        with self.assertRaises(QueryBudgetExceeded):
+            check_query_budget('index', stats)
+
+
+class ProfilingTestCase(TestCase):
+    """
+    Класс тестов профилирования запросов
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json'
+    ]
+
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(PROFILING_TOKEN='secret',
+                                                   PROFILING_DIR=self.directory.name,
+                                                   PROFILING_KEEP=2)
+        self.settings_override.enable()
+
+    def tearDown(self) -> None:
+        self.settings_override.disable()
+        self.directory.cleanup()
+
+    def test_profile_by_token(self):
+        """
+        Проверка, что профилируются только запросы с верным токеном
+        и хранятся только последние профили
+
+        """
+        self.client.get(reverse('catalog'))
+        self.client.get(reverse('catalog'), HTTP_X_PROFILE_TOKEN='wrong')
+        self.assertEqual(get_profile_names(), [])
+
+        for _ in range(3):
+            self.client.get(reverse('catalog'), HTTP_X_PROFILE_TOKEN='secret')
+        names = get_profile_names()
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all(name.endswith('_catalog') for name in names))
+
+    def test_profiles_page_for_staff(self):
+        """
+        Проверка страницы профилей: список с функциями и скачивание только для модератора
+
+        """
+        self.client.get(reverse('product_page', kwargs={'product_id': 1}),
+                        HTTP_X_PROFILE_TOKEN='secret')
+        name = get_profile_names()[0]
+
+        self.client.force_login(User.objects.get(id=2))
+        with self.assertRaises(PermissionError):
+            self.client.get(reverse('profiles'))
+
+        self.client.force_login(User.objects.get(id=1))
+        response = self.client.get(reverse('profiles'))
+        profile = response.context['profiles'][0]
+        self.assertEqual(profile['url_name'], 'product_page')
+        self.assertTrue(profile['top'])
+        response = self.client.get(reverse('profile_download', kwargs={'name': name}))
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(reverse('profile_download', kwargs={'name': '..'}))
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(METRICS_TOKEN='secret', METRICS_ALLOWED_IPS=[],
+                   UNIQUE_VISITORS_RELOAD_INTERVAL=0)
+class MetricsTestCase(TestCase):
+    """
+    Класс тестов страницы метрик
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json'
+    ]
+
+    def get_sample(self, text: str, sample: str) -> float:
+        """
+        :param text: ответ страницы метрик
+        :param sample: имя метрики с метками
+        :return: значение метрики
+        """
+        for line in text.splitlines():
+            if line.startswith(sample + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        self.fail(f'Нет метрики {sample}')
+
+    def test_metrics_exposed(self):
+        """
+        Проверка метрик времени страниц, запросов к БД, шаблонов, кэша и буферов
+
+        """
+        auth = {'HTTP_AUTHORIZATION': 'Bearer secret'}
+        text = self.client.get(reverse('metrics'), **auth).content.decode()
+        before = self.get_sample(text, 'unicat_http_request_duration_seconds_count'
+                                       '{url_name="catalog",method="GET"}') \
+            if 'url_name="catalog",method="GET"' in text else 0
+        self.client.force_login(User.objects.get(id=2))
+        self.client.get(reverse('catalog'))
+        self.client.get(reverse('product_page', kwargs={'product_id': 1}))
+
+        response = self.client.get(reverse('metrics'), **auth)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertEqual(self.get_sample(text, 'unicat_http_request_duration_seconds_count'
+                                               '{url_name="catalog",method="GET"}'), before + 1)
+        self.assertGreater(self.get_sample(text, 'unicat_db_queries_per_request_sum'
+                                                 '{url_name="catalog"}'), 0)
+        self.assertGreater(self.get_sample(text, 'unicat_template_render_seconds_count'
+                                                 '{template="pages/catalog/catalog_page.html"}'), 0)
+        self.assertIn('unicat_cache_requests_total{cache="default",result="hit"}', text)
+        self.assertEqual(self.get_sample(text, 'unicat_buffer_pending{buffer="views"}'), 0)
+        self.assertEqual(self.get_sample(text, 'unicat_unique_visitors{period="today"}'), 1)
+
+    def test_metrics_hidden(self):
+        """
+        Проверка, что метрики недоступны без токена, в том числе с адреса
+        прокси, и доступны модераторам и адресам из явного списка
+
+        """
+        url = reverse('metrics')
+        self.assertEqual(self.client.get(url, REMOTE_ADDR='127.0.0.1').status_code, 404)
+        response = self.client.get(url, HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 404)
+        with self.settings(METRICS_TOKEN=''):
+            self.assertEqual(self.client.get(url, HTTP_AUTHORIZATION='Bearer ').status_code, 404)
+        with self.settings(METRICS_ALLOWED_IPS=['10.0.0.1']):
+            self.assertEqual(self.client.get(url, REMOTE_ADDR='10.0.0.1').status_code, 200)
+        self.client.force_login(User.objects.get(id=2))
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(User.objects.get(id=1))
+        self.assertEqual(self.client.get(url).status_code, 200)
+
+
+@override_settings(SLOW_QUERY_THRESHOLD_MS=0)
+class SlowQueryLogTestCase(TestCase):
+    """
+    Класс тестов журнала медленных запросов
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json'
+    ]
+
+    def setUp(self) -> None:
+        SLOW_QUERY_LOG.clear()
+
+    def test_queries_recorded_with_plan(self):
+        """
+        Проверка записи запросов со страницей, стеком и планом,
+        полный просмотр таблицы отмечается, а сами EXPLAIN не записываются
+
+        """
+        self.client.get(reverse('catalog_reviews'))
+        entries = SLOW_QUERY_LOG.entries()
+        self.assertTrue(entries)
+        self.assertTrue(all(entry['url_name'] == 'catalog_reviews' for entry in entries))
+        self.assertFalse(any(entry['sql'].startswith('EXPLAIN') for entry in entries))
+        scan = next(entry for entry in entries if 'FROM "main_comparingreview"' in entry['sql'])
+        self.assertTrue(scan['full_scan'])
+        self.assertTrue(scan['plan'])
+        self.assertTrue(any('views.py' in frame for frame in scan['stack']))
+
+        SLOW_QUERY_LOG.clear()
+        self.client.get(reverse('product_page', kwargs={'product_id': 1}))
+        selects = [entry for entry in SLOW_QUERY_LOG.entries() if entry['sql'].startswith('SELECT')]
+        lookup = next(entry for entry in selects if 'FROM "main_product"' in entry['sql'])
+        self.assertFalse(lookup['full_scan'])
+
+    def test_staff_page_and_export(self):
+        """
+        Проверка страницы журнала и выгрузки в JSON только для модератора
+
+        """
+        self.client.force_login(User.objects.get(id=2))
+        with self.assertRaises(PermissionError):
+            self.client.get(reverse('slow_queries'))
+
+        self.client.force_login(User.objects.get(id=1))
+        self.client.get(reverse('catalog'))
+        response = self.client.get(reverse('slow_queries'))
+        self.assertTrue(response.context['entries'])
+        exported = self.client.get(reverse('slow_queries'),
+                                   {'format': 'json', 'full_scan': 1}).json()
+        self.assertTrue(exported)
+        self.assertTrue(all(entry['full_scan'] for entry in exported))
+
+
+class GenerateDatasetTestCase(TestCase):
+    """
+    Класс тестов генерации синтетических данных
+    """
+
+    def test_generate_small_dataset(self):
+        """
+        Проверка объёмов, уникальности пар и значений характеристик по типам
+
+        """
+        call_command('generate_dataset', '--categories', '3', '--characteristics', '4',
+                     '--users', '5', '--products', '12', '--rate-facts', '40', '--reviews', '10',
+                     '--stores', '3', '--store-links', '20', '--chunk-size', '7', '--seed', '1',
+                     stdout=StringIO())
+
+        self.assertEqual(Product.objects.count(), 12)
+        self.assertEqual(ProductRateFact.objects.count(), 40)
+        self.assertEqual(StoreProduct.objects.count(), 20)
+        self.assertEqual(ComparingReview.objects.count(), 10)
+        self.assertEqual(ProductRateFact.objects.values('user', 'product').distinct().count(), 40)
+        self.assertEqual(StoreProduct.objects.values('product', 'store').distinct().count(), 20)
+        for review in ComparingReview.objects.select_related('first', 'second'):
+            self.assertNotEqual(review.first_id, review.second_id)
+            self.assertEqual(review.first.category_id, review.second.category_id)
+
+        for characteristic in CategoryCharacteristic.objects.all():
+            values = characteristic.productcharacteristic_set.values_list('value', flat=True)
+            self.assertEqual(len(values), 4)
+            if characteristic.value_type == CharacteristicType.int:
+                self.assertTrue(all(value.lstrip('-').isdigit() for value in values), values)
+            elif characteristic.value_type == CharacteristicType.float:
+                self.assertTrue(all(value.lstrip('-').replace('.', '', 1).isdigit()
+                                    for value in values), values)
+            elif characteristic.value_type == CharacteristicType.bool:
+                self.assertTrue(set(values) <= {'1', ''})
+            else:
+                ladder = set(CategoryStringCharacteristicRating.objects.filter(
+                    characteristic=characteristic).values_list('value', flat=True))
+                self.assertEqual(characteristic.comparator, 2)
+                self.assertTrue(set(values) <= ladder)
+
+        rated = sum(Product.objects.values_list('user_rated', flat=True))
+        self.assertEqual(rated, 40)
+        out = StringIO()
+        call_command('rebuild_rating_aggregates', '--dry-run', stdout=out)
+        self.assertNotIn('Product #', out.getvalue())
+
+
+class LoadTestCommandTestCase(LiveServerTestCase):
+    """
+    Класс тестов нагрузочного прогона по запущенному серверу
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json'
+    ]
+
+    def setUp(self):
+        ComparingReview.objects.create(name='Обзор', author_id=1, first_id=2, second_id=3)
+
+    def test_short_run_reports_percentiles(self):
+        """
+        Проверка короткого прогона: вход тестовых пользователей,
+        перцентили по маршрутам в JSON и таблице
+
+        """
+        with tempfile.NamedTemporaryFile(suffix='.json') as file:
+            out = StringIO()
+            call_command('loadtest', '--base-url', self.live_server_url, '--clients', '4',
+                         '--duration', '1', '--anonymous-share', '0', '--seed', '1',
+                         '--password', 'loadtest-password', '--allow-production',
+                         '--json', file.name, stdout=out)
+            summary = json.load(file)
+
+        self.assertIn('p95, мс', out.getvalue())
+        self.assertGreater(summary['requests'], 0)
+        self.assertEqual(summary['errors'], 0)
+        self.assertIn('login', summary['routes'])
+        for route in summary['routes'].values():
+            self.assertLessEqual(route['p50_ms'], route['p95_ms'])
+            self.assertLessEqual(route['p95_ms'], route['p99_ms'])
+        self.assertTrue(User.objects.get(username='loadtest_0').check_password('loadtest-password'))
+
+    def test_refuses_production_users(self):
+        """
+        Проверка, что без --allow-production при DEBUG = False
+        тестовые пользователи не создаются
+
+        """
+        with self.assertRaises(CommandError):
+            call_command('loadtest', '--base-url', self.live_server_url, '--clients', '2',
+                         '--duration', '0.1', '--anonymous-share', '0', '--password', 'secret',
+                         stdout=StringIO())
+        self.assertFalse(User.objects.filter(username__startswith='loadtest_').exists())
+
+
+class AdviseIndexesTestCase(TransactionTestCase):
+    """
+    Класс тестов подбора индексов по журналу запросов: команда работает
+    с копией зафиксированной БД, поэтому данные не в транзакции теста
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json'
+    ]
+
+    def setUp(self):
+        Product.objects.bulk_create([
+            Product(title=f'Товар {index}', author_id=1, category_id=1 + index % 2,
+                    color=f'#{index:06d}')
+            for index in range(200)
+        ])
+
+    def write_queries(self, querysets) -> str:
+        """
+        :param querysets: запросы нагрузки
+        :return: путь до временного файла с их SQL и параметрами
+        """
+        file = tempfile.NamedTemporaryFile('w', suffix='.json', delete=False)
+        self.addCleanup(os.remove, file.name)
+        with file:
+            queries = (queryset.query.sql_with_params() for queryset in querysets)
+            json.dump([{'sql': sql, 'params': [str(param) for param in params], 'time_ms': 150}
+                       for sql, params in queries], file)
+        return file.name
+
+    def test_candidates(self):
+        """
+        Проверка кандидатов: колонки равенства, затем сортировки
+
+        """
+        ComparingReview.objects.create(name='Обзор', author_id=1, first_id=2, second_id=3)
+        sql, _ = Product.objects.get(id=2).get_reviews_with_product()[:5].query.sql_with_params()
+        self.assertEqual(get_candidates(sql), [
+            ('main_comparingreview', ('first_id',)),
+            ('main_comparingreview', ('first_id', 'created_at')),
+            ('main_comparingreview', ('second_id',)),
+            ('main_comparingreview', ('second_id', 'created_at')),
+            ('main_comparingreview', ('first_id', 'second_id', 'created_at')),
+        ])
+
+    def test_advises_missing_index_only(self):
+        """
+        Проверка выбора индекса для полного просмотра и отказа от уже
+        существующих индексов; схема БД после команды не меняется
+
+        """
+        path = self.write_queries([
+            Product.objects.filter(color='#000007').order_by('-created_at')[:10],
+            ComparingReview.objects.filter(first_id=1).order_by('-created_at')[:5],
+            ProductCharacteristic.objects.filter(product_id=1, characteristic_id=1),
+        ])
+        out = StringIO()
+        call_command('advise_indexes', path, stdout=out)
+
+        self.assertIn("Product.Meta.indexes: models.Index(fields=['color'", out.getvalue())
+        self.assertNotIn('ComparingReview.Meta', out.getvalue())
+        self.assertNotIn('ProductCharacteristic.Meta', out.getvalue())
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, 'main_product')
+        self.assertFalse(any(name.startswith('advise') for name in constraints))
+
+
+class SqliteConnectionTestCase(TestCase):
+    """
+    Класс тестов настройки соединений с SQLite
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json'
+    ]
+
+    def test_pragmas_applied(self):
+        """
+        Проверка PRAGMA из SQLITE_PRAGMAS у открытого соединения
+
+        """
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], settings.SQLITE_PRAGMAS['busy_timeout'])
+            with self.assertRaises(ValueError):
+                apply_sqlite_pragmas(cursor, {'journal_mode': 'wal; DROP TABLE main_product'})
+
+
+class SqliteBenchmarkTestCase(TransactionTestCase):
+    """
+    Класс тестов сравнения настроек SQLite: команда копирует зафиксированную
+    БД, поэтому фикстуры должны быть записаны, а не в транзакции теста
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json'
+    ]
+
+    def test_benchmark(self):
+        """
+        Проверка сравнения профилей на копии БД: записи меняют строки копии,
+        счётчики просмотров исходной БД не меняются
+
+        """
+        out = StringIO()
+        call_command('benchmark_sqlite', '--duration', '0.2', '--readers', '2', '--writers', '1',
+                     stdout=out)
+        rows = [line.split() for line in out.getvalue().splitlines()[1:]]
+        self.assertEqual([row[0] for row in rows], ['before', 'after'])
+        for row in rows:
+            writes, views = round(float(row[2]) * 0.2), int(row[6])
+            self.assertGreater(views, 0)
+            self.assertEqual(views, writes)
+        self.assertEqual(sum(Product.objects.values_list('views', flat=True)), 0)
+
+
+class ReadReplicaRouterTestCase(TransactionTestCase):
+    """
+    Класс тестов чтения из реплик: вторая БД теста - зеркало основной
+    """
+    databases = {'default', 'replica'}
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json'
+    ]
+
+    @override_settings(DATABASE_REPLICAS=['replica_a', 'replica_b'])
+    def test_router(self):
+        """
+        Проверка очереди реплик и чтения из основной БД в транзакции,
+        после записи и при включённой привязке
+
+        """
+        # загрузка фикстур - запись, после неё поток теста читает из основной БД
+        self.addCleanup(reset_primary, use_primary(False))
+        router = ReadReplicaRouter()
+        self.assertEqual({router.db_for_read(Product) for _ in range(4)},
+                         {'replica_a', 'replica_b'})
+        with transaction.atomic():
+            self.assertEqual(router.db_for_read(Product), 'default')
+
+        token = use_primary()
+        self.assertEqual(router.db_for_read(Product), 'default')
+        reset_primary(token)
+
+        context = contextvars.copy_context()
+        self.assertEqual(context.run(router.db_for_write, Product), 'default')
+        self.assertEqual(context.run(router.db_for_read, Product), 'default')
+        self.assertNotEqual(router.db_for_read(Product), 'default')
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_sticky_after_write(self):
+        """
+        Проверка чтения из основной БД после оценки товара
+
+        """
+        self.client.force_login(User.objects.get(id=2))
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get(reverse('catalog'))
+        self.assertTrue(replica.captured_queries)
+
+        response = self.client.post(reverse('product_page', kwargs={'product_id': 1}),
+                                    {'rating': 5})
+        self.assertIn(settings.REPLICA_STICKY_COOKIE, response.cookies)
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.client.get(reverse('catalog'))
+        self.assertFalse(replica.captured_queries)
+
+
+class ProductImportTestCase(TestCase):
+    """
+    Класс тестов импорта товаров из CSV и JSONL
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+    ]
+
+    def setUp(self):
+        self.category = ProductCategory.objects.get(id=2)
+        CategoryCharacteristic.objects.create(name='Вес', category=self.category,
+                                              value_type=CharacteristicType.int)
+        CategoryCharacteristic.objects.create(name='Беспроводные', category=self.category,
+                                              value_type=CharacteristicType.bool)
+        self.author = User.objects.get(id=2)
+
+    def test_clean_value(self):
+        """
+        Проверка приведения значений характеристик к типу
+
+        """
+        self.assertEqual(CharacteristicType.clean_value(CharacteristicType.int, ' 42 '), '42')
+        self.assertEqual(CharacteristicType.clean_value(CharacteristicType.float, '1,5'), '1.5')
+        self.assertEqual(CharacteristicType.clean_value(CharacteristicType.bool, 'да'), '1')
+        self.assertEqual(CharacteristicType.clean_value(CharacteristicType.bool, 'no'), '')
+        invalid = ((CharacteristicType.int, '1.5'), (CharacteristicType.float, 'abc'),
+                   (CharacteristicType.bool, 'maybe'), (CharacteristicType.str, ' '))
+        for value_type, value in invalid:
+            with self.assertRaises(ValueError):
+                CharacteristicType.clean_value(value_type, value)
+
+    def test_import_csv(self):
+        """
+        Проверка импорта из CSV: строки с ошибками пропускаются
+        и попадают в отчёт с номерами строк файла
+
+        """
+        rows = [
+            'title,description,category,color,images,Вес,Беспроводные',
+            'Наушники 1,,Наушники,,product_images/1.png|product_images/2.png,250,да',
+            'Наушники 2,Описание,2,#000000,,300,нет',
+            ',,Наушники,,,abc,да',
+            'Наушники 3,,Нет такой,,,1,1',
+            'Наушники 4,,2,,../secret.png,1,1',
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'products.csv')
+            report_path = os.path.join(directory, 'report.json')
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write('\n'.join(rows))
+            call_command('import_products', path, '--author', self.author.username,
+                         '--chunk-size', '1', '--report', report_path, stdout=StringIO())
+            with open(report_path, encoding='utf-8') as file:
+                report = json.load(file)
+
+        self.assertEqual(report['created'], 2)
+        self.assertEqual([error['line'] for error in report['errors']], [4, 5, 6])
+        self.assertEqual(len(report['errors'][0]['errors']), 2)
+
+        product = Product.objects.get(title='Наушники 1')
+        self.assertEqual(product.author, self.author)
+        self.assertEqual(product.color, '#FFFF00')
+        self.assertEqual(product.get_characteristic_value_by_name('Вес').value, '250')
+        self.assertEqual(product.get_characteristic_value_by_name('Беспроводные').value, '1')
+        self.assertEqual(product.productimage_set.count(), 2)
+        self.assertEqual(Product.objects.get(title='Наушники 2').get_characteristic_value_by_name(
+            'Беспроводные').value, '')
+
+    def test_import_page(self):
+        """
+        Проверка загрузки JSONL представителем магазина: товары подтверждены
+        его магазином; остальным пользователям страница недоступна
+
+        """
+        store = Store.objects.create(name='Магазин')
+        StoreManager.objects.create(store=store, user=self.author)
+        lines = [
+            json.dumps({'title': 'Наушники', 'category': 2,
+                        'characteristics': {'Вес': 10, 'Беспроводные': True}}),
+            '{"title": ',
+            json.dumps({'title': 'Наушники', 'category': 2, 'characteristics': {'Вес': 10}}),
+        ]
+        upload = SimpleUploadedFile('products.jsonl', '\n'.join(lines).encode('utf-8'))
+
+        self.client.force_login(self.author)
+        response = self.client.post(reverse('product_import'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        report = response.context['report']
+        self.assertEqual(report.created, 1)
+        self.assertEqual([error['line'] for error in report.errors], [2, 3])
+        self.assertTrue(StoreProduct.objects.filter(store=store,
+                                                    product__title='Наушники').exists())
+
+        self.client.force_login(User.objects.create(username='visitor'))
+        with self.assertRaises(PermissionError):
+            self.client.get(reverse('product_import'))
+
+    def test_import_broken_file(self):
+        """
+        Проверка файла, который не дочитывается: CSV из Excel в cp1251
+        и CSV с полем больше лимита модуля csv. Строки до ошибки импортируются,
+        ошибка попадает в отчёт, команда завершается с CommandError
+
+        """
+        rows = ['title,category,Вес,Беспроводные', 'Наушники 1,2,250,да', 'Наушники 2,2,300,нет']
+        upload = SimpleUploadedFile('products.csv', '\n'.join(rows).encode('cp1251'))
+        self.client.force_login(User.objects.get(username='vasya'))
+        response = self.client.post(reverse('product_import'), {'file': upload})
+        self.assertEqual(response.status_code, 200)
+        report = response.context['report']
+        self.assertEqual(report.created, 0)
+        self.assertEqual(report.file_error['line'], 1)
+        self.assertIn('UTF-8', report.file_error['error'])
+
+        rows[2] = 'Наушники 2,2,300,' + 'x' * (csv.field_size_limit() + 1)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'products.csv')
+            report_path = os.path.join(directory, 'report.json')
+            with open(path, 'w', encoding='utf-8') as file:
+                file.write('\n'.join(rows))
+            with self.assertRaisesMessage(CommandError, 'строке 3'):
+                call_command('import_products', path, '--author', self.author.username,
+                             '--chunk-size', '1', '--report', report_path, stdout=StringIO())
+            with open(report_path, encoding='utf-8') as file:
+                self.assertEqual(json.load(file)['file_error']['line'], 3)
+        self.assertTrue(Product.objects.filter(title='Наушники 1').exists())
+
+
+class ProductBatchCreateTestCase(TestCase):
+    """
+    Класс тестов пакетного создания товаров и проверки характеристик при добавлении товара
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+    ]
+
+    def setUp(self):
+        self.category = ProductCategory.objects.get(id=2)
+        CategoryCharacteristic.objects.create(name='Вес', category=self.category,
+                                              value_type=CharacteristicType.int)
+        CategoryCharacteristic.objects.create(name='Цена', category=self.category,
+                                              value_type=CharacteristicType.float)
+        self.user = User.objects.get(id=2)
+        self.client.force_login(self.user)
+
+    def post_batch(self, products: list):
+        """
+        :param products: товары пачки
+        :return: ответ на создание пачки в категории теста
+        """
+        return self.client.post(reverse('product_batch_create'), json.dumps({
+            'category': self.category.id,
+            'products': products,
+        }), content_type='application/json')
+
+    def test_batch_create(self):
+        """
+        Проверка создания пачки: одна вставка на таблицу, бонусы одним UPDATE
+
+        """
+        bonuses = self.user.bonuses
+        products = [{'title': f'Наушники {number}',
+                     'characteristics': {'Вес': number, 'Цена': '9,99'},
+                     'images': [f'product_images/{number}.png']} for number in range(30)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.post_batch(products)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['products']), 30)
+
+        statements = [query['sql'] for query in queries.captured_queries]
+        inserts = [sql for sql in statements if sql.startswith('INSERT')]
+        self.assertEqual(len(inserts), 3)
+        updates = [sql for sql in statements if sql.startswith('UPDATE "main_user"')]
+        self.assertEqual(len(updates), 1)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.bonuses, bonuses + 30 * 10)
+
+        product = Product.objects.get(title='Наушники 7')
+        self.assertEqual(product.get_characteristic_value_by_name('Вес').value, '7')
+        self.assertEqual(product.get_characteristic_value_by_name('Цена').value, '9.99')
+
+    def test_batch_errors(self):
+        """
+        Проверка пачки с ошибками: ничего не создаётся, ошибки по номерам товаров
+
+        """
+        response = self.post_batch([
+            {'title': 'Наушники', 'characteristics': {'Вес': 1, 'Цена': 1}},
+            {'title': 'Наушники', 'characteristics': {'Вес': 'лёгкие', 'Цена': 1}},
+            'Наушники',
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([error['index'] for error in response.json()['errors']], [1, 2])
+        self.assertFalse(Product.objects.exists())
+
+        self.assertEqual(self.post_batch([]).status_code, 400)
+        response = self.client.post(reverse('product_batch_create'), {'category': 2})
+        self.assertEqual(response.status_code, 400)
+
+    def test_add_product_validates_characteristics(self):
+        """
+        Проверка формы добавления товара: при неверном значении
+        характеристики товар не создаётся
+
+        """
+        data = {'title': 'Наушники', 'description': '-', 'category': self.category.id,
+                'color': '#FFFF00', 'form-0-value': '10', 'form-1-value': 'дорого'}
+        self.client.post(reverse('add_product'), data)
+        self.assertFalse(Product.objects.exists())
+
+        data['form-1-value'] = '99.5'
+        self.client.post(reverse('add_product'), data)
+        product = Product.objects.get()
+        self.assertEqual(product.productcharacteristic_set.count(), 2)
+
+
+class ProductSoftDeleteTestCase(TestCase):
+    """
+    Класс тестов мягкого удаления товаров и фоновой очистки
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json'
+    ]
+
+    def setUp(self):
+        self.review = ComparingReview.objects.create(name='Обзор', author_id=1, first_id=2,
+                                                     second_id=3)
+        ReviewRateFact.objects.create(user_id=1, review=self.review, rating=5)
+        for user_id in (1, 2):
+            ProductRateFact.objects.create(user_id=user_id, product_id=2, rating=4)
+        ProductImage.objects.create(product_id=2, image='product_images/2.png')
+        ProductDailyViews.objects.create(product_id=2, day=timezone.localdate(), views=3)
+        TrendingProduct.add_events({2: 1.0})
+        self.staff = User.objects.create(username='moderator', is_staff=True)
+
+    def test_deleted_product_hidden(self):
+        """
+        Проверка, что удалённый товар и обзоры с ним сразу скрыты,
+        а строки остаются до очистки
+
+        """
+        self.client.force_login(self.staff)
+        self.client.get(reverse('product_delete', kwargs={'product_id': 2}))
+
+        self.assertFalse(Product.objects.filter(id=2).exists())
+        self.assertTrue(Product.all_objects.filter(id=2).exists())
+        self.assertFalse(ComparingReview.objects.exists())
+        self.assertFalse(Product.objects.get(id=3).get_reviews_with_product().exists())
+        self.assertFalse(TrendingProduct.objects.filter(product_id=2).exists())
+        self.assertEqual(ProductRateFact.objects.filter(product_id=2).count(), 2)
+
+        response = self.client.get(reverse('catalog'))
+        self.assertNotIn(2, [product.id for product in response.context['products']])
+        response = self.client.get(reverse('product_page', kwargs={'product_id': 2}))
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get(reverse('comparing_review', kwargs={'rev_id': self.review.id}))
+        self.assertEqual(response.status_code, 404)
+
+        ViewCounter.write({(2, timezone.localdate()): 5})
+        self.assertEqual(Product.all_objects.get(id=2).views, 0)
+
+    def test_deleted_hidden_in_profile(self):
+        """
+        Проверка, что удалённый товар и обзор с ним не попадают в оценённые
+        пользователем, ни из рабочих фактов, ни из архива
+
+        """
+        user = User.objects.get(id=1)
+        ArchivedProductRateFact.objects.create(user=user, product_id=3, rating=5,
+                                               created_at=timezone.now())
+        ArchivedProductRateFact.objects.create(user_id=3, product_id=2, rating=5,
+                                               created_at=timezone.now())
+        self.assertEqual(len(user.get_all_rated_reviews()), 1)
+        Product.objects.get(id=2).soft_delete()
+
+        self.assertEqual([product.id for product in user.get_all_rated_products()], [3])
+        self.assertEqual(User.objects.get(id=3).get_all_rated_products(), [])
+        self.assertEqual(user.get_all_rated_reviews(), [])
+
+    def test_purge_in_chunks(self):
+        """
+        Проверка очистки пачками: зависимые строки раньше товара,
+        в каждой пачке не больше chunk_size строк
+
+        """
+        Product.objects.get(id=2).soft_delete()
+        counts = []
+        while True:
+            count = Product.purge_deleted_chunk(chunk_size=1)
+            if not count:
+                break
+            counts.append(count)
+        self.assertTrue(all(count == 1 for count in counts))
+        self.assertEqual(len(counts), 7)
+
+        self.assertFalse(Product.all_objects.filter(id=2).exists())
+        self.assertFalse(ComparingReview.all_objects.exists())
+        self.assertFalse(ReviewRateFact.objects.exists())
+        self.assertFalse(ProductRateFact.objects.exists())
+        self.assertFalse(ProductImage.objects.exists())
+        self.assertFalse(ProductDailyViews.objects.exists())
+        self.assertEqual(Product.objects.count(), 2)
+
+        out = StringIO()
+        call_command('purge_deleted_products', stdout=out)
+        self.assertIn('Удалено строк: 0', out.getvalue())
+
+    @override_settings(TEST_FLUSH_INTERVAL=0.01)
+    def test_purger_stops_when_idle(self):
+        """
+        Проверка, что поток очистки завершается, когда удалять нечего,
+        и запускается снова при следующем удалении
+
+        """
+        pending = [1, 2]
+        flusher = PeriodicFlusher('test', lambda: pending.pop() if pending else 0,
+                                  'TEST_FLUSH_INTERVAL', stop_when_idle=True)
+        for _ in range(2):
+            flusher.start()
+            thread = flusher._thread
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+            self.assertFalse(flusher.is_running())
+            self.assertEqual(pending, [])
+            pending.append(3)
+
+
+class ProductCountersTestCase(TestCase):
+    """
+    Класс тестов счётчиков изображений, обзоров и магазинов товара
+    """
+    fixtures = [
+        'users.json',
+        'categories.json',
+        'products.json'
+    ]
+
+    def get_counters(self) -> dict:
+        """
+        :return: {id товара: (изображения, обзоры, магазины, первое изображение)}
+        """
+        return {product.id: (product.image_count, product.review_count, product.store_count,
+                             product.primary_image)
+                for product in Product.all_objects.order_by('id')}
+
+    def assertCountersConsistent(self):
+        """
+        Проверка, что счётчики совпадают с пересчитанными с нуля
+        """
+        counters = self.get_counters()
+        Product.recount_counters(Product.all_objects.all())
+        self.assertEqual(counters, self.get_counters())
+
+    def test_related_writes(self):
+        """
+        Проверка обновления счётчиков при добавлении и удалении связанных записей
+
+        """
+        first = ProductImage.objects.create(product_id=2, image='product_images/first.png')
+        ProductImage.objects.create(product_id=2, image='product_images/second.png')
+        store = Store.objects.create(name='Магазин')
+        StoreProduct.objects.create(product_id=2, store=store)
+        ComparingReview.objects.create(name='Обзор', author_id=1, first_id=2, second_id=3)
+        product = Product.objects.get(id=2)
+        self.assertEqual((product.image_count, product.review_count, product.store_count),
+                         (2, 1, 1))
+        self.assertTrue(product.get_primary_image().endswith('product_images/first.png'))
+        self.assertTrue(product.is_confirmed())
+        self.assertCountersConsistent()
+
+        first.delete()
+        StoreProduct.objects.filter(product_id=2).delete()
+        product.refresh_from_db()
+        self.assertEqual(product.primary_image, 'product_images/second.png')
+        self.assertEqual((product.image_count, product.store_count), (1, 0))
+        self.assertFalse(product.is_confirmed())
+        self.assertCountersConsistent()
+
+        product.soft_delete()
+        self.assertEqual(Product.objects.get(id=3).review_count, 0)
+        self.assertEqual(Product.objects.get(id=3).get_comparable_products(), [])
+        while Product.purge_deleted_chunk():
+            pass
+        self.assertCountersConsistent()
+
+    def test_catalog_prefetches_images(self):
+        """
+        Проверка, что карусели карточек каталога берут изображения одним запросом,
+        а магазины не запрашиваются
+
+        """
+        ProductImage.objects.create(product_id=1, image='product_images/first.png')
+        ProductImage.objects.create(product_id=1, image='product_images/second.png')
+        ProductImage.objects.create(product_id=2, image='product_images/third.png')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('catalog'))
+        for image in ('first', 'second', 'third'):
+            self.assertContains(response, f'/media/product_images/{image}.png')
+        self.assertContains(response, 'data-bs-target="#carouselExampleIndicators1"', count=2)
+        self.assertNotContains(response, 'data-bs-target="#carouselExampleIndicators2"')
+        sqls = [query['sql'] for query in queries.captured_queries]
+        self.assertEqual(len([sql for sql in sqls if 'main_productimage' in sql]), 1)
+        self.assertFalse([sql for sql in sqls if 'main_storeproduct' in sql])
+
+    def test_bulk_paths(self):
+        """
+        Проверка счётчиков после импорта и генерации данных мимо сигналов
+
+        """
+        call_command('generate_dataset', '--categories', '2', '--characteristics', '1',
+                     '--users', '3', '--products', '10', '--rate-facts', '5', '--reviews', '8',
+                     '--stores', '2', '--store-links', '6', '--seed', '1', stdout=StringIO())
+        ProductImporter(User.objects.get(id=1), Store.objects.first()).run([
+            (1, {'title': 'Товар', 'category': 1,
+                 'images': ['product_images/a.png', 'product_images/b.png']}),
+        ])
+        self.assertEqual(Product.objects.get(title='Товар').primary_image, 'product_images/a.png')
+        self.assertCountersConsistent()
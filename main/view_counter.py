@@ -0,0 +1,243 @@
+"""
+Отложенная запись просмотров товаров
+"""
+
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from main.flusher import PeriodicFlusher
+from main.hyperloglog import HyperLogLog
+from main.models import Product, ProductDailyViews, ProductVisitorSketch, TrendingProduct
+
+
+class ViewCounter:
+    """
+    Счётчик просмотров в памяти процесса. Просмотры копятся в словаре
+    по ключу (товар, день) и сбрасываются в БД раз в
+    VIEW_COUNTER_FLUSH_INTERVAL секунд запросами
+    UPDATE ... SET views = views + n - по одному на каждое встретившееся n,
+    а не на каждый просмотр. Пишутся и общий счётчик Product.views,
+    и дневные сводки ProductDailyViews. Посетители учитываются в дневных
+    скетчах HyperLogLog, которые при сбросе объединяются с сохранёнными.
+    Для метрики уникальных посетителей процесс держит сегодняшний скетч
+    всех товаров (см. visitors_today).
+
+    Потеря при аварийном падении процесса ограничена интервалом сброса
+    и VIEW_COUNTER_MAX_PENDING просмотрами: при переполнении буфер
+    сбрасывается сразу в потоке запроса. При штатной остановке процесса
+    буфер сбрасывается (см. PeriodicFlusher)
+    """
+
+    def __init__(self):
+        self._pending = Counter()
+        self._size = 0
+        self._visitors: Dict[Tuple[int, date], HyperLogLog] = {}
+        # (день, время загрузки, скетч записанных в БД посетителей всех товаров за день)
+        self._written_today: Optional[Tuple[date, float, HyperLogLog]] = None
+        self._lock = threading.Lock()
+
+    def record(self, product_id: int, visitor: Optional[str] = None) -> None:
+        """
+        Учёт одного просмотра товара
+
+        :param product_id: id товара
+        :param visitor: идентификатор посетителя (None - не учитывать в уникальных)
+        """
+        key = (product_id, timezone.localdate())
+        with self._lock:
+            self._pending[key] += 1
+            self._size += 1
+            if visitor is not None:
+                self._visitors.setdefault(key, HyperLogLog()).add(visitor)
+            overflow = self._size >= settings.VIEW_COUNTER_MAX_PENDING
+
+        if overflow or not VIEW_FLUSHER.interval:
+            VIEW_FLUSHER.flush_safely()
+        else:
+            VIEW_FLUSHER.start()
+
+    def pending(self, product_id: int) -> int:
+        """
+        :param product_id: id товара
+        :return: количество ещё не записанных в БД сегодняшних просмотров товара
+        """
+        with self._lock:
+            return self._pending[(product_id, timezone.localdate())]
+
+    def pending_visitors(self, product_id: int) -> HyperLogLog:
+        """
+        :param product_id: id товара
+        :return: копия ещё не записанного в БД сегодняшнего скетча посетителей товара
+        """
+        with self._lock:
+            sketch = self._visitors.get((product_id, timezone.localdate()))
+            return sketch.copy() if sketch is not None else HyperLogLog()
+
+    def visitors_today(self) -> HyperLogLog:
+        """
+        Скетч сегодняшних посетителей всех товаров. Записанная в БД часть
+        загружается из дневных скетчей в начале дня и раз в
+        UNIQUE_VISITORS_RELOAD_INTERVAL секунд, а между загрузками в неё
+        добавляются скетчи, которые записывает этот процесс (write_visitors).
+        Посетители, записанные другими процессами в товары, которые этот
+        процесс не записывал, появляются после следующей загрузки
+
+        :return: объединение записанного и ещё не записанного скетчей
+        """
+        today = timezone.localdate()
+        with self._lock:
+            written = self._written_today
+        expired = written is None or written[0] != today \
+            or time.monotonic() - written[1] >= settings.UNIQUE_VISITORS_RELOAD_INTERVAL
+        if expired:
+            written = (today, time.monotonic(), ProductVisitorSketch.get_day_total(today))
+            with self._lock:
+                self._written_today = written
+
+        with self._lock:
+            return HyperLogLog.merge([written[2]] + [
+                sketch for (_, day), sketch in self._visitors.items() if day == today
+            ])
+
+    def add_written_visitors(self, visitors: Dict[Tuple[int, date], HyperLogLog]) -> None:
+        """
+        Добавление записанных в БД скетчей в сегодняшний скетч процесса.
+        Объединение скетчей идемпотентно: если запись откатится и повторится,
+        оценка не завысится
+
+        :param visitors: скетчи посетителей {(id товара, день): скетч}
+        """
+        with self._lock:
+            if self._written_today is None:
+                return
+            today, _, total = self._written_today
+            for (_, day), sketch in visitors.items():
+                if day == today:
+                    total.update(sketch)
+
+    def size(self) -> int:
+        """
+        :return: количество ещё не записанных в БД просмотров
+        """
+        with self._lock:
+            return self._size
+
+    def flush(self) -> int:
+        """
+        Запись накопленных просмотров в БД. Если запись не удалась,
+        просмотры возвращаются в буфер
+
+        :return: количество записанных просмотров
+        """
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+            visitors, self._visitors = self._visitors, {}
+            size, self._size = self._size, 0
+        if not pending:
+            return 0
+
+        try:
+            with transaction.atomic():
+                self.write(pending, visitors)
+        except DatabaseError:
+            with self._lock:
+                self._pending.update(pending)
+                self._size += size
+                for key, sketch in visitors.items():
+                    self._visitors.setdefault(key, HyperLogLog()).update(sketch)
+            raise
+        return size
+
+    @staticmethod
+    def write(pending: Dict[Tuple[int, date], int],
+              visitors: Optional[Dict[Tuple[int, date], HyperLogLog]] = None) -> None:
+        """
+        Запись пачки просмотров: строки дневных сводок создаются одним
+        INSERT, а счётчики увеличиваются одним UPDATE на каждое значение
+        прироста. Просмотры удалённых товаров отбрасываются
+
+        :param pending: прирост просмотров {(id товара, день): количество}
+        :param visitors: скетчи посетителей {(id товара, день): скетч}
+        """
+        existing = set(Product.objects.filter(
+            id__in={product_id for product_id, _ in pending}
+        ).values_list('id', flat=True))
+        pending = {key: count for key, count in pending.items() if key[0] in existing}
+
+        ProductDailyViews.objects.bulk_create([
+            ProductDailyViews(product_id=product_id, day=day) for product_id, day in pending
+        ], ignore_conflicts=True)
+
+        totals = Counter()
+        daily: Dict[Tuple[date, int], List[int]] = defaultdict(list)
+        for (product_id, day), count in pending.items():
+            totals[product_id] += count
+            daily[(day, count)].append(product_id)
+
+        for (day, count), product_ids in daily.items():
+            ProductDailyViews.objects.filter(day=day, product_id__in=product_ids).update(
+                views=F('views') + count
+            )
+        for count, product_ids in group_by_value(totals).items():
+            Product.objects.filter(id__in=product_ids).update(views=F('views') + count)
+
+        TrendingProduct.add_events({
+            product_id: count * settings.TRENDING_WEIGHTS['view']
+            for product_id, count in totals.items()
+        })
+
+        if visitors:
+            ViewCounter.write_visitors({key: sketch for key, sketch in visitors.items()
+                                        if key[0] in existing})
+
+    @staticmethod
+    def write_visitors(visitors: Dict[Tuple[int, date], HyperLogLog]) -> None:
+        """
+        Объединение скетчей посетителей с сохранёнными. Вызывается внутри
+        транзакции после записи просмотров, так что чтение и запись скетчей
+        не пересекаются с другим сбросом
+
+        :param visitors: скетчи посетителей {(id товара, день): скетч}
+        """
+        written = dict(visitors)
+        stored = ProductVisitorSketch.objects.filter(
+            product_id__in={product_id for product_id, _ in visitors},
+            day__in={day for _, day in visitors},
+        )
+        updated = []
+        for row in stored:
+            sketch = visitors.pop((row.product_id, row.day), None)
+            if sketch is not None:
+                sketch.update(row.get_sketch())
+                row.registers = bytes(sketch)
+                updated.append(row)
+
+        ProductVisitorSketch.objects.bulk_update(updated, ['registers'])
+        ProductVisitorSketch.objects.bulk_create([
+            ProductVisitorSketch(product_id=product_id, day=day, registers=bytes(sketch))
+            for (product_id, day), sketch in visitors.items()
+        ])
+        VIEW_COUNTER.add_written_visitors(written)
+
+
+def group_by_value(counter: Dict[int, int]) -> Dict[int, List[int]]:
+    """
+    :param counter: {ключ: количество}
+    :return: {количество: [ключи]}
+    """
+    groups: Dict[int, List[int]] = defaultdict(list)
+    for key, count in counter.items():
+        groups[count].append(key)
+    return groups
+
+
+VIEW_COUNTER = ViewCounter()
+VIEW_FLUSHER = PeriodicFlusher('views', VIEW_COUNTER.flush, 'VIEW_COUNTER_FLUSH_INTERVAL')
@@ -1,25 +1,49 @@
-from datetime import datetime
+"""
+Страницы сайта
+"""
+
+import io
+import json
+from typing import Optional
 
 from django import forms
+from django.conf import settings
 from django.contrib import messages
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
 from django.forms import formset_factory
-from django.http import Http404
+from django.http import Http404, FileResponse, HttpResponse
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404
 from django.shortcuts import render, redirect
 from django.template.loader import render_to_string
 from django.urls import reverse
-from django.utils.timezone import get_current_timezone
+from django.utils import timezone
 
 from main.forms import EditProfileForm, ProductEditForm, ProductImageForm, UploadUserAvatarForm, \
     ProductAddingForm, CategoryCharacteristicForm, ComparingReviewForm, ApplicationForm, \
-    ProductCharacteristicForm
+    ProductCharacteristicForm, ProductImportForm
 from main.forms import RegistrationForm
-from main.models import User, ComparingReview, Product, UserAvatar, ProductRateFact, \
+from main.models import RATING_SCALE, User, ComparingReview, Product, UserAvatar, \
     ProductCategory, CategoryCharacteristic, StoreManager, StoreProduct, Application, \
-    Store, ProductImage, UpdatingViews
+    Store, ProductImage, ProductDailyViews, ProductVisitorSketch, TrendingProduct
+from main.metrics import can_read_metrics, render_metrics
+from main.product_import import ProductImporter, ProductBatchError, create_products, get_format, \
+    read_rows
+from main.profiling import get_slowest_profiles, get_profile_path
+from main.slow_queries import SLOW_QUERY_LOG
+from main.view_counter import VIEW_COUNTER
+
+
+# Сортировка "по рейтингу" идёт по байесовской оценке, а не по среднему:
+# товар с одной пятёркой не обгоняет товар с тысячами оценок 4.8
+# Сортировка "по просмотрам" - по просмотрам за сегодня
+CATALOG_SORT_FIELDS = {
+    'rating': '-score',
+    'views': '-views_today',
+}
 
 
 def get_menu_context():
@@ -32,9 +56,39 @@ def get_menu_context():
 
 
 def is_ajax(request):
+    """
+    :param request: объект с деталями запроса
+    :return: запрос отправлен из JavaScript (заголовок X-Requested-With)
+    """
     return request.META.get('HTTP_X_REQUESTED_WITH') == 'XMLHttpRequest'
 
 
+def get_posted_rating(request) -> Optional[int]:
+    """
+    Оценка из формы: целое число из RATING_SCALE
+
+    :param request: объект с деталями запроса
+    :return: оценка или None, если она некорректна
+    """
+    value = request.POST.get('rating', '').strip()
+    if not value.isdigit() or int(value) not in RATING_SCALE:
+        return None
+    return int(value)
+
+
+def get_visitor_id(request) -> str:
+    """
+    Идентификатор посетителя для подсчёта уникальных: пользователь,
+    а для анонимов - адрес и браузер. В БД попадает только хеш в скетче
+
+    :param request: объект с деталями запроса
+    :return: идентификатор посетителя
+    """
+    if request.user.is_authenticated:
+        return f'user:{request.user.id}'
+    return f"anon:{request.META.get('REMOTE_ADDR', '')}:{request.META.get('HTTP_USER_AGENT', '')}"
+
+
 def get_base_context(pagename, request):
     """
     Функция получения базового контекста страницы
@@ -42,8 +96,8 @@ def get_base_context(pagename, request):
     :return: словарь - контекст страницы
     """
     context = {
-        'app': Application.objects.filter(status='under consideration').count(),
-        'apps': Application.objects.filter(status='under consideration'),
+        # Функция, а не число: шаблон вызовет её только в меню модератора
+        'pending_applications_count': Application.get_pending_count,
         'pagename': pagename,
         'menu': get_menu_context()
     }
@@ -84,12 +138,12 @@ def profile_page(request):
         'menu': get_menu_context(),
         'pagename': 'Профиль',
         'votings_count': ComparingReview.objects.filter(author=request.user).count(),
-        'ratefact_count': request.user.get_all_product_rate_facts().count(),
+        'ratefact_count': request.user.get_product_rate_count(),
         'avatar': request.user.get_avatar(),
     }
 
     if request.user.is_store_manager():
-        context['products'] = Product.objects.all().order_by('rating')
+        context['products'] = Product.with_card_data(Product.objects.all().order_by('rating'))
 
     return render(request, 'pages/profile/profile.html', context)
 
@@ -109,7 +163,7 @@ def profile_edit_page(request, user_id):
         'menu': get_menu_context(),
         'pagename': ' Редактирование профиля',
         'votings_count': ComparingReview.objects.filter(author=request.user).count(),
-        'ratefact_count': ProductRateFact.objects.filter(user=request.user).count(),
+        'ratefact_count': request.user.get_product_rate_count(),
         'form': EditProfileForm(),
         'user': get_object_or_404(User, id=user_id),
         'avatar': request.user.get_avatar()
@@ -203,6 +257,13 @@ def registration_store_manager_page(request):
 
 
 def comparing_review_page(request, rev_id):
+    """
+    Сравнительный обзор и его оценка
+
+    :param request: объект с деталями запроса
+    :param rev_id: id обзора
+    :return: страница обзора
+    """
     review = get_object_or_404(ComparingReview, id=rev_id)
     compare_data = Product.compare_products(review.first, review.second)
     table = []
@@ -219,15 +280,19 @@ def comparing_review_page(request, rev_id):
     context['review'] = review
     context['comparing_table'] = table
 
-    if request.method == "POST" and request.POST['rating']:
-        if request.user.is_authenticated:
-            if request.user.has_already_rated(review):
-                messages.warning(request, 'Вы уже оценили обзор', 'alert-warning')
-            else:
-                request.user.rate(review, int(request.POST['rating']))
-                messages.success(request, 'Благодарим за оценку!', 'alert-success')
-        else:
+    if request.method == "POST" and request.POST.get('rating'):
+        rating = get_posted_rating(request)
+        if not request.user.is_authenticated:
             messages.warning(request, 'Зарегистрируйтесь, чтобы оставить отзыв!!!', 'alert-warning')
+        elif rating is None:
+            messages.error(request, 'Оценка должна быть от 1 до 5', 'alert-danger')
+        elif request.user.rate(review, rating):
+            messages.success(request, 'Благодарим за оценку!', 'alert-success')
+        else:
+            messages.warning(request, 'Вы уже оценили обзор', 'alert-warning')
+
+    if request.user.is_authenticated:
+        context['user_rating'] = request.user.get_rating(review)
 
     return render(request, 'pages/comparing_review/comparing_review.html', context)
 
@@ -249,17 +314,22 @@ def product_add_page(request):
 
     if request.method == "POST":
         form = ProductAddingForm(request.POST)
-        product = None
-
-        if form.is_valid():
-            product = form.save(commit=False)
-            product.author = request.user
-            product.save()
-            context['product'] = product
-            request.user.product_bonuses()
-            messages.success(request, 'Товар успешно создан', 'alert-success')
-        else:
+        if not form.is_valid():
             messages.error(request, 'Ошибка создания товара', 'alert-danger')
+            return redirect(reverse('add_product'))
+
+        product = form.save(commit=False)
+        product.author = request.user
+        try:
+            with transaction.atomic():
+                product.save()
+                product.save_product_characteristics(request)
+                request.user.product_bonuses()
+        except ValueError as error:
+            for message in error.args:
+                messages.error(request, message, 'alert-danger')
+            return redirect(reverse('add_product'))
+        messages.success(request, 'Товар успешно создан', 'alert-success')
 
         image_form = ProductImageForm(request.POST, request.FILES)
 
@@ -271,14 +341,93 @@ def product_add_page(request):
         else:
             messages.error(request, 'Ошибка загрузки изображения', 'alert-danger')
 
-        product.save_product_characteristics(request)
-
         return redirect(reverse('product_page', kwargs={'product_id': product.id}))
 
     return render(request, 'pages/product/add_product.html', context)
 
 
+@login_required
+def product_import_page(request):
+    """
+    Импорт товаров из файла CSV или JSONL (для представителей магазинов
+    и модераторов). Товары представителя сразу подтверждены его магазином
+
+    :param request: запрос
+    :return: страница с формой и отчётом об импорте
+    """
+    if not request.user.is_staff and not request.user.is_store_manager():
+        raise PermissionError('К сожалению, вам отказано в доступе к данной странице')
+
+    context = get_base_context('Импорт товаров', request)
+    form = ProductImportForm(request.POST or None, request.FILES or None)
+    if request.method == 'POST' and form.is_valid():
+        upload = form.cleaned_data['file']
+        store = request.user.get_store() if request.user.is_store_manager() else None
+        # Файл читается потоком, без загрузки целиком в память
+        with io.TextIOWrapper(upload.open('rb'), encoding='utf-8-sig', newline='') as stream:
+            rows = read_rows(stream, get_format(upload.name))
+            report = ProductImporter(request.user, store).run(rows)
+        context['report'] = report
+        if report.created:
+            messages.success(request, f'Создано товаров: {report.created}', 'alert-success')
+        if report.failed:
+            messages.warning(request, f'Строк с ошибками: {report.failed}', 'alert-warning')
+        if report.file_error:
+            messages.error(request, f'Импорт прерван на строке {report.file_error["line"]}: '
+                                    f'{report.file_error["error"]}', 'alert-danger')
+    context['form'] = form
+    return render(request, 'pages/product/product_import.html', context)
+
+
+@login_required
+def product_batch_create(request):
+    """
+    API создания товаров одной категории пачкой. POST с телом JSON:
+    {"category": id, "products": [{"title": ..., "description": ..., "color": ...,
+    "characteristics": {"название": значение}, "images": [пути]}, ...]}.
+    Товары создаются все или ни один (см. create_products)
+
+    :param request: запрос
+    :return: JSON с id созданных товаров или ошибками по номерам товаров
+    """
+    if request.method != 'POST':
+        return JsonResponse({'success': False, 'error': 'Ожидается POST-запрос'}, status=405)
+    try:
+        data = json.loads(request.body)
+        category_id = int(data['category'])
+        items = data['products']
+    except (ValueError, TypeError, KeyError):
+        return JsonResponse({
+            'success': False,
+            'error': 'Ожидается JSON с полями category и products',
+        }, status=400)
+    if not isinstance(items, list) or not 0 < len(items) <= settings.PRODUCT_BATCH_MAX_SIZE:
+        return JsonResponse({
+            'success': False,
+            'error': f'products - список от 1 до {settings.PRODUCT_BATCH_MAX_SIZE} товаров',
+        }, status=400)
+    if not ProductCategory.objects.filter(id=category_id).exists():
+        return JsonResponse({'success': False, 'error': 'Категория не найдена'}, status=404)
+
+    try:
+        products = create_products(request.user, category_id, items)
+    except ProductBatchError as error:
+        return JsonResponse({'success': False, 'error': str(error), 'errors': error.errors},
+                            status=400)
+    return JsonResponse({
+        'success': True,
+        'error': None,
+        'products': [product.id for product in products],
+    }, status=201)
+
+
 def catalog_page(request):
+    """
+    Каталог товаров с фильтром по категории и сортировкой
+
+    :param request: объект с деталями запроса
+    :return: страница каталога
+    """
     context = get_base_context('Каталог товаров', request)
     products = Product.objects.all()
     context['categories'] = ProductCategory.objects.all()
@@ -294,28 +443,45 @@ def catalog_page(request):
             except ValueError as value_error:
                 raise Http404 from value_error
 
+    sort_filter = request.GET.get('sort_filter', 'rating')
+    if sort_filter not in CATALOG_SORT_FIELDS:
+        raise Http404
+    if sort_filter == 'views':
+        products = products.annotate(views_today=Subquery(
+            ProductDailyViews.objects.filter(
+                product=OuterRef('pk'), day=timezone.localdate()
+            ).values('views')[:1]
+        ))
+    products = products.order_by(CATALOG_SORT_FIELDS[sort_filter], '-id')
     if 'sort_filter' in request.GET:
-        sort_filter = request.GET.get('sort_filter')
-        products = products.order_by('-'+sort_filter)
         context['sort_filter'] = sort_filter
-    else:
-        products = products.order_by('-rating')
 
-    context['products'] = products
+    context['products'] = Product.with_card_data(products)
+    context['trending'] = TrendingProduct.get_top(context.get('filter_category'))
     return render(request, 'pages/catalog/catalog_page.html', context)
 
 
 def search_results_page(request):
+    """
+    :param request: объект с деталями запроса
+    :return: товары, в названии которых есть строка поиска
+    """
     context = get_base_context('Результаты поиска', request)
-    context['products'] = Product.objects.filter(title__icontains=request.GET.get('title', '')
-                                                 ).order_by('rating')
+    context['products'] = Product.with_card_data(
+        Product.objects.filter(title__icontains=request.GET.get('title', '')).order_by('rating')
+    )
     return render(request, 'pages/catalog/catalog_page.html', context)
 
 
 def review_search_results_page(request):
+    """
+    :param request: объект с деталями запроса
+    :return: обзоры, в названии которых есть строка поиска
+    """
     context = get_base_context('Результаты поиска', request)
-    context['reviews'] = ComparingReview.objects.filter(name__icontains=request.GET.get('title',
-                                                                                        ''))
+    context['reviews'] = ComparingReview.with_list_data(
+        ComparingReview.objects.filter(name__icontains=request.GET.get('title', ''))
+    )
     context['categories'] = ProductCategory.objects.all()
     if 'category' in request.GET:
         category_id = request.GET.get('category')
@@ -325,55 +491,69 @@ def review_search_results_page(request):
             reviews = ComparingReview.objects.filter(first__category=category)
         except ValueError as value_error:
             raise Http404 from value_error
-        context['reviews'] = reviews
+        context['reviews'] = ComparingReview.with_list_data(reviews)
     return render(request, 'pages/catalog/catalog_reviews.html', context)
 
 
 def product_page(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
-    if UpdatingViews.objects.all().count() == 0:
-        update = UpdatingViews(update=datetime.now(tz=get_current_timezone()))
-        update.id = 1
-        update.save()
-    update = get_object_or_404(UpdatingViews, id=1)
-    if (update.update.day != datetime.now(tz=get_current_timezone()).day) or (update.update.month != datetime.now(tz=get_current_timezone()).month):
-        for p in Product.objects.all():
-            p.views = 0
-            p.save()
-        update.update = datetime.now(tz=get_current_timezone())
-        update.save()
-        product.views = 0
-    product.views += 1
-    product.save()
+    """
+    Страница товара: просмотры, уникальные посетители, оценка товара
+
+    :param request: объект с деталями запроса
+    :param product_id: id товара
+    :return: страница товара
+    """
+    product = get_object_or_404(Product.objects.select_related('category'), id=product_id)
+    views = ProductDailyViews.get_views(product)
+    pending = VIEW_COUNTER.pending(product.id) + 1
+    views = {period: count + pending for period, count in views.items()}
+    visitor = get_visitor_id(request)
+    visitors = VIEW_COUNTER.pending_visitors(product.id)
+    visitors.add(visitor)
+    uniques = ProductVisitorSketch.get_uniques(product, visitors)
+    VIEW_COUNTER.record(product.id, visitor)
     context = get_base_context("Товар: " + product.title, request)
-    if product.views % 10 == 1:
+    if views['today'] % 10 == 1:
         context['views_type'] = 1
-    elif 2 <= product.views % 10 <= 4:
+    elif 2 <= views['today'] % 10 <= 4:
         context['views_type'] = 2
-    elif product.views % 10 > 4 or product.views % 10 == 0:
+    elif views['today'] % 10 > 4 or views['today'] % 10 == 0:
         context['views_type'] = 3
+    context['views'] = views
+    context['uniques'] = uniques
     context['product'] = product
     context['images'] = product.get_images()
-    context['characteristics'] = product.productcharacteristic_set.all()
-    context['reviews'] = product.get_comparable_products()[:5]
+    context['characteristics'] = product.productcharacteristic_set.select_related('characteristic')
+    context['reviews'] = product.get_comparable_products(5)
     context['reviews_url'] = reverse('catalog_reviews') + f'?product={product.id}'
     if product.is_confirmed():
         context['stores'] = product.get_stores()
 
-    if request.method == "POST" and request.POST['rating']:
-        if request.user.is_authenticated:
-            if request.user.has_already_rated(product):
-                messages.warning(request, 'Вы уже оценили товар', 'alert-warning')
-            else:
-                request.user.rate(product, int(request.POST['rating']))
-                messages.success(request, 'Благодарим за оценку!', 'alert-success')
-        else:
+    if request.method == "POST" and request.POST.get('rating'):
+        rating = get_posted_rating(request)
+        if not request.user.is_authenticated:
             messages.warning(request, 'Зарегистрируйтесь, чтобы оставить отзыв!!!', 'alert-warning')
+        elif rating is None:
+            messages.error(request, 'Оценка должна быть от 1 до 5', 'alert-danger')
+        elif request.user.rate(product, rating):
+            messages.success(request, 'Благодарим за оценку!', 'alert-success')
+        else:
+            messages.warning(request, 'Вы уже оценили товар', 'alert-warning')
+
+    if request.user.is_authenticated:
+        context['user_rating'] = request.user.get_rating(product)
     return render(request, 'pages/product/product_page.html', context)
 
 
 @login_required
 def product_edit_page(request, product_id):
+    """
+    Редактирование товара и его изображений
+
+    :param request: объект с деталями запроса
+    :param product_id: id товара
+    :return: страница редактирования товара
+    """
     context = get_base_context('Каталог товаров', request)
     product = get_object_or_404(Product, id=product_id)
     context['product'] = product
@@ -392,6 +572,7 @@ def product_edit_page(request, product_id):
             product.color = form.cleaned_data['color']
             product.description = form.cleaned_data['description']
             product.save()
+            TrendingProduct.objects.filter(product=product).update(category=product.category)
             messages.success(request, 'Изменения сохранены', 'alert-success')
             return redirect(reverse('product_page', kwargs={'product_id': product.id}))
 
@@ -448,14 +629,28 @@ def product_remove_image(request):
 
 
 def product_delete(request, product_id):
+    """
+    Удаление товара модератором (товар сразу скрывается, см. Product.soft_delete)
+
+    :param request: объект с деталями запроса
+    :param product_id: id товара
+    :return: перенаправление в каталог
+    """
     if request.user.is_staff:
         product = get_object_or_404(Product, id=product_id)
-        product.delete()
+        product.soft_delete()
         messages.warning(request, 'Продукт удалён', 'alert-warning')
     return redirect(reverse('catalog'))
 
 
 def product_verify(request, product_id):
+    """
+    Подтверждение товара магазином представителя
+
+    :param request: объект с деталями запроса
+    :param product_id: id товара
+    :return: перенаправление в каталог
+    """
     product = get_object_or_404(Product, id=product_id)
     store_product = StoreProduct(
         product=product,
@@ -467,6 +662,13 @@ def product_verify(request, product_id):
 
 
 def product_cancel_verification(request, product_id):
+    """
+    Отмена подтверждения товара магазином
+
+    :param request: объект с деталями запроса
+    :param product_id: id товара
+    :return: перенаправление в каталог
+    """
     store_product = get_object_or_404(StoreProduct, product=product_id)
     store_product.delete()
     messages.warning(request, 'Верификация отменена', 'alert-warning')
@@ -475,16 +677,29 @@ def product_cancel_verification(request, product_id):
 
 @login_required
 def applications_page(request):
+    """
+    Заявки на представительство магазина, ожидающие рассмотрения
+
+    :param request: объект с деталями запроса
+    :return: страница заявок
+    """
     if request.user.is_staff:
         context = get_base_context('Заявки', request)
         context['avatar'] = request.user.get_avatar()
-        context['apps'] = Application.objects.filter(status='under consideration')
+        context['apps'] = Application.get_pending()
     else:
         raise PermissionError('К сожалению, вам отказано в доступе к данной странице')
     return render(request, 'pages/moderation/applications.html', context)
 
 
 def application_accept(request, app_id):
+    """
+    Принятие заявки: пользователь становится представителем магазина
+
+    :param request: объект с деталями запроса
+    :param app_id: id заявки
+    :return: перенаправление к заявкам
+    """
     application = get_object_or_404(Application, id=app_id)
 
     if not Store.objects.filter(name=application.store_name, address=application.store_address):
@@ -505,6 +720,11 @@ def application_accept(request, app_id):
 
 
 def application_reject(request, app_id):
+    """
+    :param request: объект с деталями запроса
+    :param app_id: id заявки
+    :return: перенаправление к заявкам
+    """
     application = get_object_or_404(Application, id=app_id)
     application.status = 'rejected'
     application.save()
@@ -512,7 +732,75 @@ def application_reject(request, app_id):
     return redirect(reverse('applications'))
 
 
+def profiles_page(request):
+    """
+    Самые медленные из последних профилированных запросов
+
+    :param request: объект с деталями запроса
+    :return: страница профилей
+    """
+    if not request.user.is_staff:
+        raise PermissionError('К сожалению, вам отказано в доступе к данной странице')
+    context = get_base_context('Профили запросов', request)
+    context['profiles'] = get_slowest_profiles(settings.PROFILING_KEEP)
+    return render(request, 'pages/moderation/profiles.html', context)
+
+
+def profile_download(request, name):
+    """
+    Скачивание профиля запроса для pstats/snakeviz
+
+    :param request: объект с деталями запроса
+    :param name: имя профиля
+    :return: файл профиля
+    """
+    if not request.user.is_staff:
+        raise PermissionError('К сожалению, вам отказано в доступе к данной странице')
+    path = get_profile_path(name)
+    if path is None:
+        raise Http404
+    return FileResponse(open(path, 'rb'), as_attachment=True, filename=f'{name}.prof')
+
+
+def slow_queries_page(request):
+    """
+    Журнал медленных запросов к БД; ?format=json - выгрузка в JSON
+
+    :param request: объект с деталями запроса
+    :return: страница журнала или JSON
+    """
+    if not request.user.is_staff:
+        raise PermissionError('К сожалению, вам отказано в доступе к данной странице')
+    entries = SLOW_QUERY_LOG.entries()
+    if request.GET.get('full_scan'):
+        entries = [entry for entry in entries if entry['full_scan']]
+    if request.GET.get('format') == 'json':
+        return JsonResponse(entries, safe=False, json_dumps_params={'ensure_ascii': False})
+    context = get_base_context('Медленные запросы', request)
+    context['entries'] = entries
+    context['threshold'] = settings.SLOW_QUERY_THRESHOLD_MS
+    return render(request, 'pages/moderation/slow_queries.html', context)
+
+
+def metrics_page(request):
+    """
+    Метрики для Prometheus, см. main.metrics.can_read_metrics.
+    Для остальных посетителей страницы нет
+
+    :param request: объект с деталями запроса
+    :return: метрики в текстовом формате Prometheus
+    """
+    if not can_read_metrics(request):
+        raise Http404
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 def application_see(request, app_id):
+    """
+    :param request: объект с деталями запроса
+    :param app_id: id заявки
+    :return: страница с согласием из заявки
+    """
     application = get_object_or_404(Application, id=app_id)
     context = get_base_context('Просмотр согласия', request)
     context['agreement'] = application.agreement
@@ -521,6 +809,11 @@ def application_see(request, app_id):
 
 @login_required
 def category_characteristics_page(request, category_id):
+    """
+    :param request: объект с деталями запроса
+    :param category_id: id категории
+    :return: страница характеристик категории
+    """
     category = get_object_or_404(ProductCategory, id=category_id)
     context = get_base_context('Управление характеристиками', request)
     context['category'] = category
@@ -529,6 +822,14 @@ def category_characteristics_page(request, category_id):
 
 
 def category_characteristics_edit_form(request, category_id, char_id):
+    """
+    Редактирование характеристики категории
+
+    :param request: объект с деталями запроса
+    :param category_id: id категории
+    :param char_id: id характеристики
+    :return: форма или перенаправление к характеристикам категории
+    """
     get_object_or_404(ProductCategory, id=category_id)
     characteristic = get_object_or_404(CategoryCharacteristic, id=char_id)
     form = CategoryCharacteristicForm(category_id, char_id, instance=characteristic)
@@ -542,6 +843,13 @@ def category_characteristics_edit_form(request, category_id, char_id):
 
 
 def goods_create_form(request, cat_id):
+    """
+    Форма добавления товара с полями характеристик категории
+
+    :param request: объект с деталями запроса
+    :param cat_id: id категории
+    :return: JSON с отрисованной формой
+    """
     category = get_object_or_404(ProductCategory, id=cat_id)
     product_form = ProductAddingForm(initial={'category': category})
     product_form.fields['category'].widget = forms.HiddenInput()
@@ -570,6 +878,12 @@ def goods_create_form(request, cat_id):
 
 @login_required
 def review_add(request):
+    """
+    Создание сравнительного обзора двух товаров
+
+    :param request: объект с деталями запроса
+    :return: форма обзора или перенаправление к обзору
+    """
     context = get_base_context('Создание сравнительного обзора', request)
 
     if request.method == "GET":
@@ -589,6 +903,9 @@ def review_add(request):
         if form.is_valid():
             if form.cleaned_data['first'].category == form.cleaned_data['second'].category:
                 review = form.save()
+                TrendingProduct.add_events(dict.fromkeys(
+                    [review.first_id, review.second_id], settings.TRENDING_WEIGHTS['review']
+                ))
                 messages.success(request, 'Сравнительный обзор успешно создан', 'alert-success')
                 request.user.review_bonuses()
                 return redirect(reverse('comparing_review', kwargs={'rev_id': review.id}))
@@ -624,6 +941,12 @@ def review_selector_change(request):
 
 
 def catalog_reviews(request):
+    """
+    Каталог обзоров с фильтром по категории
+
+    :param request: объект с деталями запроса
+    :return: страница каталога обзоров
+    """
     context = get_base_context('Каталог обзоров', request)
     context['categories'] = ProductCategory.objects.all()
     if 'category' in request.GET:
@@ -644,7 +967,7 @@ def catalog_reviews(request):
             raise Http404 from value_error
     else:
         reviews = ComparingReview.objects.all()
-    context['reviews'] = reviews
+    context['reviews'] = ComparingReview.with_list_data(reviews)
     return render(request, 'pages/catalog/catalog_reviews.html', context)
 
 
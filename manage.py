@@ -5,6 +5,9 @@ import sys
 
 
 def main():
+    # Тесты идут со своими настройками (simple_votings/test_settings.py)
+    if len(sys.argv) > 1 and sys.argv[1] == 'test':
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'simple_votings.test_settings')
     os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'simple_votings.settings')
     try:
         from django.core.management import execute_from_command_line
@@ -52,6 +52,11 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'main.middleware.ReplicaStickinessMiddleware',
+    'main.middleware.MetricsMiddleware',
+    'main.middleware.ProfilingMiddleware',
+    'main.middleware.QueryBudgetMiddleware',
+    'main.middleware.SlowQueryMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -64,7 +69,8 @@ ROOT_URLCONF = 'simple_votings.urls'
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        # DjangoTemplates с замером времени отрисовки (main.metrics)
+        'BACKEND': 'main.metrics.DjangoTemplates',
         'DIRS': [],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -88,9 +94,32 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # Тестовая БД в файле, а не в памяти: in-memory SQLite с общим кэшем
+        # не ждёт блокировку, а сразу падает, и тесты параллельной записи
+        # проверяли бы не то поведение, что в рабочей БД
+        'TEST': {
+            'NAME': os.path.join(BASE_DIR, 'test_db.sqlite3'),
+        },
+        # Соединение живёт между запросами (в каждом потоке сервера своё),
+        # а не открывается заново на каждый запрос
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
     }
 }
 
+# PRAGMA, выполняемые при открытии каждого соединения с SQLite (см. main.db).
+# WAL: читатели не ждут писателя, писатель не ждёт читателей.
+# busy_timeout: сколько мс ждать блокировку записи вместо ошибки "database is locked".
+# synchronous = normal в режиме WAL не теряет целостность, только последние
+# транзакции при отключении питания. mmap_size и cache_size (отрицательное - в КБ)
+# держат горячие страницы в памяти
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'busy_timeout': 5000,
+    'synchronous': 'normal',
+    'mmap_size': 256 * 1024 * 1024,
+    'cache_size': -64 * 1024,
+}
+
 # Password validation
 # https://docs.djangoproject.com/en/3.0/ref/settings/#auth-password-validators
 
@@ -160,3 +189,114 @@ EMAIL_HOST_USER = "unicat_moderation@mail.ru"
 EMAIL_HOST_PASSWORD = "QGiP95u8PfCTW0z7jQyx"
 EMAIL_USE_TLS = True
 EMAIL_USE_SSL = False
+
+# Буфер оценок: при включении оценки сначала пишутся в PendingProductRating /
+# PendingReviewRating, а фоновый поток раз в FLUSH_INTERVAL секунд переносит
+# их в факты пачками по BATCH_SIZE. FLUSH_INTERVAL = 0 - без фонового потока,
+# только командой flush_ratings
+RATING_BUFFER_ENABLED = False
+RATING_BUFFER_FLUSH_INTERVAL = 2
+RATING_BUFFER_BATCH_SIZE = 1000
+
+# Байесовская оценка для сортировки: рейтинг притягивается к RATING_PRIOR_MEAN
+# с весом RATING_PRIOR_WEIGHT оценок
+RATING_PRIOR_MEAN = 3.0
+RATING_PRIOR_WEIGHT = 10
+
+# Реплики только для чтения (см. main.db.ReadReplicaRouter): копии файла БД,
+# пути через запятую в DB_REPLICAS. Чтение распределяется между репликами по
+# очереди, запись и чтение внутри транзакций - в основную БД. Посетитель,
+# который что-то записал, REPLICA_STICKY_SECONDS читает из основной БД,
+# чтобы видеть свою оценку или товар, пока реплика не догнала
+REPLICA_PATHS = [path for path in os.environ.get('DB_REPLICAS', '').split(',') if path]
+for replica_number, replica_path in enumerate(REPLICA_PATHS):
+    DATABASES[f'replica_{replica_number}'] = dict(DATABASES['default'], NAME=replica_path,
+                                                  TEST={'MIRROR': 'default'})
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['main.db.ReadReplicaRouter']
+REPLICA_STICKY_SECONDS = 10
+REPLICA_STICKY_COOKIE = 'primary_until'
+
+# Счётчик просмотров копится в памяти процесса и сбрасывается раз
+# в FLUSH_INTERVAL секунд или при накоплении MAX_PENDING просмотров
+VIEW_COUNTER_FLUSH_INTERVAL = 5
+VIEW_COUNTER_MAX_PENDING = 1000
+# Метрика уникальных посетителей берёт сегодняшний скетч из памяти процесса
+# и перечитывает дневные скетчи из БД раз в RELOAD_INTERVAL секунд,
+# чтобы подхватить посетителей, записанных другими процессами
+UNIQUE_VISITORS_RELOAD_INTERVAL = 300
+
+# Удалённые товары скрываются сразу, а их строки и строки зависимых таблиц
+# удаляются пачками по PURGE_CHUNK_SIZE строк раз в PURGE_INTERVAL секунд.
+# Поток очистки запускается удалением товара только в том процессе, где
+# оно произошло, и завершается, когда удалять нечего. Пачка может совпасть
+# с пачкой другого процесса - повторное удаление тех же строк безвредно.
+# PURGE_INTERVAL = 0 выключает поток: тогда очистку выполняет команда
+# purge_deleted_products по расписанию (cron)
+PRODUCT_PURGE_INTERVAL = 1
+PRODUCT_PURGE_CHUNK_SIZE = 1000
+
+# "Сейчас популярно": вес событий и период полураспада счёта популярности
+TRENDING_HALF_LIFE_HOURS = 24
+TRENDING_WEIGHTS = {
+    'view': 1,
+    'rating': 5,
+    'review': 10,
+}
+TRENDING_TOP_SIZE = 6
+# Товары с меньшим счётом удаляются из таблицы при сдвиге точки отсчёта
+TRENDING_MIN_SCORE = 0.01
+
+# Наибольшее количество товаров в одном запросе к API product_batch_create
+PRODUCT_BATCH_MAX_SIZE = 500
+
+# Бюджет запросов к БД на страницу по имени маршрута (main.middleware).
+# Превышение пишется в лог ('log') или, если превышено число запросов,
+# выбрасывает исключение ('raise'); None - проверка выключена.
+# Запросы сброса буферов просмотров и оценок в бюджет страницы не входят.
+# На страницах товара и обзора оценка записывается прямо в запросе
+# (RATING_BUFFER_ENABLED = False): рейтинг, гистограмма, популярность
+QUERY_BUDGET_ACTION = 'log'
+QUERY_BUDGET_DEFAULT = {'queries': 12, 'time_ms': 500}
+QUERY_BUDGETS = {
+    'catalog': {'queries': 12},
+    'search_results': {'queries': 8},
+    'catalog_reviews': {'queries': 8},
+    'review_search_results': {'queries': 8},
+    'profile': {'queries': 12},
+    'product_page': {'queries': 21},
+    'comparing_review': {'queries': 14},
+    'product_delete': {'queries': 25},
+    # импорт пишет файл пачками: несколько запросов на каждые 2000 строк
+    'product_import': {'queries': 500, 'time_ms': 120000},
+    'product_batch_create': {'queries': 20, 'time_ms': 5000},
+}
+
+# Профилирование запросов (main.middleware.ProfilingMiddleware): запрос
+# с заголовком X-Profile-Token: <PROFILING_TOKEN> и доля SAMPLE_RATE
+# остальных запросов. Хранятся KEEP последних профилей
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN', '')
+PROFILING_SAMPLE_RATE = 0.0
+PROFILING_DIR = os.path.join(BASE_DIR, 'profiles')
+PROFILING_KEEP = 200
+PROFILING_TOP_FUNCTIONS = 15
+
+# Кэш в памяти процесса с учётом попаданий (main.metrics)
+CACHES = {
+    'default': {
+        'BACKEND': 'main.metrics.LocMemCache',
+        'LOCATION': 'default',
+    }
+}
+
+# Страница /metrics доступна модераторам и с заголовком
+# Authorization: Bearer <METRICS_TOKEN>. Адреса из ALLOWED_IPS пускаются
+# без токена - только если сервер не стоит за обратным прокси
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+METRICS_ALLOWED_IPS = []
+
+# Журнал медленных запросов (main.slow_queries): запросы дольше THRESHOLD_MS
+# записываются с планом выполнения, хранятся LOG_SIZE последних.
+# None - журнал выключен
+SLOW_QUERY_THRESHOLD_MS = 100
+SLOW_QUERY_LOG_SIZE = 200
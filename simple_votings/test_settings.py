@@ -0,0 +1,20 @@
+"""
+Настройки для тестов: python manage.py test подключает их сам
+(или --settings=simple_votings.test_settings)
+"""
+
+# pylint: disable=wildcard-import,unused-wildcard-import
+from simple_votings.settings import *  # noqa: F401,F403
+
+# Фоновые потоки сброса буферов и очистки удалённых товаров не запускаются:
+# буферы сбрасываются прямо в запросе, очистку тесты вызывают сами
+VIEW_COUNTER_FLUSH_INTERVAL = 0
+PRODUCT_PURGE_INTERVAL = 0
+
+# Превышение бюджета запросов страницы роняет тест
+QUERY_BUDGET_ACTION = 'raise'
+
+# Вторая БД - зеркало основной. Чтение из неё включается только
+# в тестах маршрутизации (override_settings(DATABASE_REPLICAS=...))
+DATABASES['replica'] = dict(DATABASES['default'], TEST={'MIRROR': 'default'})
+DATABASE_REPLICAS = []
@@ -42,6 +42,8 @@ urlpatterns = [
     path('profile/<int:user_id>/edit/', views.profile_edit_page, name='profile_edit'),
     path('product/add/', views.product_add_page, name='add_product'),
     path('product/add/<int:cat_id>/', views.goods_create_form, name='goods_create_form'),
+    path('product/import/', views.product_import_page, name='product_import'),
+    path('product/batch/', views.product_batch_create, name='product_batch_create'),
     path('product/delete/<int:product_id>', views.product_delete, name='product_delete'),
     path('product/verify/<int:product_id>', views.product_verify, name='product_verify'),
 
@@ -81,6 +83,10 @@ urlpatterns = [
     path('applications/<int:app_id>/accept', views.application_accept, name='application_accept'),
     path('applications/<int:app_id>/reject', views.application_reject, name='application_reject'),
     path('applications/<int:app_id>/see', views.application_see, name='application_see'),
+    path('profiles/', views.profiles_page, name='profiles'),
+    path('profiles/<str:name>/', views.profile_download, name='profile_download'),
+    path('metrics', views.metrics_page, name='metrics'),
+    path('slow_queries/', views.slow_queries_page, name='slow_queries'),
     path('__debug__/', include('debug_toolbar.urls')),
 
 ]